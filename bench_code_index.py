@@ -0,0 +1,86 @@
+"""Benchmark for the code index against a whole-tree grep.
+
+Generates a synthetic Python project, then times a cold build, a no-change
+refresh, a single-file update and both lookups. ``grep -rnw`` over the same
+tree stands in for the Grep tool the index replaces.
+
+Run with: python bench_code_index.py [files]   (default 20000)
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from code_index import CodeIndex
+
+MODULE = '''"""Module {i}."""
+
+from pkg{prev_pkg}.module_{prev} import Service{prev}
+
+
+class Service{i}(Service{prev}):
+    def handle_{i}(self, request):
+        return self.dispatch(request, helper_{i}(request))
+
+
+def helper_{i}(value):
+    return [item for item in value if item]
+'''
+
+
+def _build_tree(root: str, count: int) -> None:
+    for i in range(count):
+        directory = os.path.join(root, f"pkg{i // 100}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"module_{i}.py"), "w") as f:
+            prev = max(i - 1, 0)
+            f.write(MODULE.format(i=i, prev=prev, prev_pkg=prev // 100))
+
+
+def _timed(label: str, fn, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    unit, value = ("s", elapsed) if elapsed >= 1 else ("ms", elapsed * 1000)
+    print(f"  {label:<38} {value:>9.2f} {unit}")
+    return result
+
+
+def main() -> int:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    root = tempfile.mkdtemp(prefix="bench-code-index-")
+    try:
+        _build_tree(root, count)
+        symbol = f"Service{count // 2}"
+        print(f"{count} files under {root}\n")
+
+        index = CodeIndex(root)
+        _timed("build (cold)", index.refresh)
+        print(f"    {index.stats()}")
+        _timed("refresh (nothing changed)", index.refresh)
+        changed = os.path.join(root, f"pkg{count // 200}", f"module_{count // 2}.py")
+        with open(changed, "a") as f:
+            f.write("\n\ndef added_later():\n    pass\n")
+        _timed("update_file (one Write/Edit)", lambda: index.update_file(changed))
+        assert index.find_symbol("added_later"), "update_file missed the new definition"
+
+        hits = _timed(f"find_symbol({symbol})", lambda: index.find_symbol(symbol), repeat=200)
+        assert hits and hits[0][3] == symbol
+        _timed("find_symbol(substring 'handle_1234')", lambda: index.find_symbol("handle_1234"), repeat=200)
+        refs, files = _timed(f"find_references({symbol})", lambda: index.find_references(symbol), repeat=50)
+        assert len(refs) == 3 and files == 2, (refs, files)
+
+        grep = _timed(f"grep -rnw {symbol} (baseline)", lambda: subprocess.run(
+            ["grep", "-rnw", symbol, root], capture_output=True, text=True))
+        assert len(grep.stdout.splitlines()) == len(refs)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
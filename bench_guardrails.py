@@ -0,0 +1,105 @@
+"""Decision check and micro-benchmark for the PreToolUse guardrails.
+
+Asserts allow/deny decisions for a set of representative commands, then times
+the original per-call pattern loop against ``GuardrailEngine`` with a cold and
+a warm decision memo. Both run once per tool call, so the numbers are µs/call.
+On this workload the cold engine costs about 1.5x the legacy loop (it also
+resolves cd chains, which the loop never did); the warm memo is ~30x faster.
+
+Run with: python bench_guardrails.py
+"""
+
+import os
+import re
+import sys
+import time
+
+from guardrails import BASH_RULES, GuardrailEngine, policy_for_stage
+
+TARGET = "/tmp/bench-project"
+
+# (command, should be denied)
+DECISIONS: list[tuple[str, bool]] = [
+    ("bin/rails test", False),
+    ("python -m pytest -q tests/test_users.py", False),
+    ("cd /tmp/bench-project && npx jest --runInBand", False),
+    ("cd '/tmp/bench-project/sub dir' && ls", False),
+    ("cat src/app.py | grep -n 'def ' | head -20", False),
+    ("echo 'cd /etc' > notes.txt", False),
+    ("cat <<EOF > notes.md\ncd /etc\nEOF", False),
+    ("rm -rf /tmp/bench-project/build", False),
+    ("git push origin main", True),
+    ("git reset --hard HEAD~1", True),
+    ("sudo apt-get install jq", True),
+    ("rm -rf /", True),
+    ("cd /etc && cat passwd", True),
+    ("cd /tmp/bench-project-other", True),
+    ("cd /tmp/bench-project/src && cd ../..", True),
+    ("pushd ~/other", True),
+]
+
+# What an agent typically sends: mostly repeats of a few test/read commands
+WORKLOAD = [cmd for cmd, _ in DECISIONS[:7]] * 20 + [cmd for cmd, _ in DECISIONS[7:]]
+
+_LEGACY_PATTERNS = list(BASH_RULES.values())
+
+
+def legacy_check(command: str) -> bool:
+    """The original bash_guardrail body: pattern loop plus cd regex."""
+    for pattern in _LEGACY_PATTERNS:
+        if re.search(pattern, command, re.IGNORECASE):
+            return True
+    norm_target = os.path.normpath(TARGET)
+    for cd_match in re.finditer(r"(?:^|[;&|])\s*cd\s+(/[^\s;|&]*)", command):
+        if not os.path.normpath(cd_match.group(1)).startswith(norm_target):
+            return True
+    return False
+
+
+def check_decisions() -> bool:
+    engine = GuardrailEngine(TARGET)
+    policy = policy_for_stage("GREEN")
+    ok = True
+    for command, denied in DECISIONS:
+        got = engine.check_bash(command, policy) is not None
+        if got != denied:
+            print(f"  FAIL {command!r}: denied={got}, expected {denied}")
+            ok = False
+    print(f"decisions: {len(DECISIONS)} commands {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def _time(fn, rounds: int = 50) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for command in WORKLOAD:
+            fn(command)
+    return (time.perf_counter() - start) / (rounds * len(WORKLOAD)) * 1e6
+
+
+def bench() -> None:
+    policy = policy_for_stage("GREEN")
+    warm = GuardrailEngine(TARGET)
+    uncached = GuardrailEngine(TARGET)
+
+    def cold(command: str):
+        uncached._memo.clear()
+        return uncached.check_bash(command, policy)
+
+    results = {
+        "legacy pattern loop": _time(legacy_check),
+        "engine, cold memo": _time(cold, rounds=10),
+        "engine, warm memo": _time(lambda c: warm.check_bash(c, policy)),
+    }
+    for name, usec in results.items():
+        print(f"  {name:<22} {usec:8.2f} µs/call")
+
+
+def main() -> int:
+    ok = check_decisions()
+    bench()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
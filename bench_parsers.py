@@ -0,0 +1,434 @@
+"""Corpus check and micro-benchmark for the test-output parsers.
+
+Runs every corpus sample through its registered parser and asserts the
+extracted counts, then times each parser on multi-megabyte outputs and on
+pathological single lines (long digit / letter runs) at two sizes. A parser
+with catastrophic backtracking shows up as a super-linear time ratio.
+
+Run with: python bench_parsers.py
+"""
+
+import sys
+import time
+
+from test_parsers import parse_output, runner_for_command
+
+# (command, output, expected (total, failures, errors))
+CORPUS: dict[str, tuple[str, str, tuple[int, int, int]]] = {
+    "minitest": (
+        "bin/rails test",
+        """Running 33 tests in a single process (parallelization threshold is 50)
+Run options: --seed 4821
+
+# Running:
+
+..F...E..........................
+
+Failure:
+UsersControllerTest#test_should_create_user [test/controllers/users_controller_test.rb:19]:
+"User.count" didn't change by 1.
+Expected: 3
+  Actual: 2
+
+Error:
+UserTest#test_email_format:
+NoMethodError: undefined method `valid_email?' for #<User id: nil>
+    app/models/user.rb:12:in `validate_email'
+
+Finished in 0.842131s, 39.1862 runs/s, 53.4362 assertions/s.
+33 runs, 45 assertions, 1 failures, 1 errors, 0 skips
+""",
+        (33, 1, 1),
+    ),
+    "pytest": (
+        "python -m pytest",
+        """============================= test session starts ==============================
+platform linux -- Python 3.12.1, pytest-8.0.0, pluggy-1.4.0
+rootdir: /srv/app
+collected 8 items
+
+tests/test_api.py ..F.....                                               [100%]
+
+=================================== FAILURES ===================================
+_______________________________ test_create_item _______________________________
+
+    def test_create_item(client):
+        resp = client.post("/items", json={"name": "x"})
+>       assert resp.status_code == 201
+E       assert 400 == 201
+
+tests/test_api.py:14: AssertionError
+=========================== short test summary info ============================
+FAILED tests/test_api.py::test_create_item - assert 400 == 201
+========================= 1 failed, 7 passed in 0.31s ==========================
+""",
+        (8, 1, 0),
+    ),
+    "unittest": (
+        "python manage.py test",
+        """Creating test database for alias 'default'...
+System check identified no issues (0 silenced).
+..F.E.
+======================================================================
+FAIL: test_slug (blog.tests.PostTests.test_slug)
+----------------------------------------------------------------------
+AssertionError: 'hello world' != 'hello-world'
+
+----------------------------------------------------------------------
+Ran 6 tests in 0.052s
+
+FAILED (failures=1, errors=1)
+Destroying test database for alias 'default'...
+""",
+        (6, 1, 1),
+    ),
+    "jest": (
+        "npx jest",
+        """ FAIL  src/cart.test.js
+  ● Cart › applies discount
+
+    expect(received).toBe(expected) // Object.is equality
+
+    Expected: 90
+    Received: 100
+
+ PASS  src/utils.test.js
+
+Test Suites: 1 failed, 1 passed, 2 total
+Tests:       1 failed, 6 passed, 7 total
+Snapshots:   0 total
+Time:        1.204 s
+Ran all test suites.
+""",
+        (7, 1, 0),
+    ),
+    "vitest": (
+        "npx vitest run",
+        """ ✓ src/math.test.ts  (4 tests) 3ms
+ ❯ src/cart.test.ts  (3 tests | 1 failed) 6ms
+
+⎯⎯⎯⎯⎯⎯⎯ Failed Tests 1 ⎯⎯⎯⎯⎯⎯⎯
+
+ FAIL  src/cart.test.ts > Cart > applies discount
+AssertionError: expected 100 to be 90 // Object.is equality
+
+- Expected
++ Received
+
+- 90
++ 100
+
+ ❯ src/cart.test.ts:14:32
+
+⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯⎯[1/1]⎯
+
+ Test Files  1 failed | 1 passed (2)
+      Tests  1 failed | 6 passed (7)
+   Start at  10:21:04
+   Duration  412ms
+""",
+        (7, 1, 0),
+    ),
+    "mocha": (
+        "npx mocha",
+        """  Cart
+    ✓ adds items
+    1) applies discount
+
+  5 passing (14ms)
+  1 failing
+
+  1) Cart
+       applies discount:
+     AssertionError: expected 100 to equal 90
+""",
+        (6, 1, 0),
+    ),
+    "go": (
+        "go test -v ./...",
+        """=== RUN   TestAdd
+--- PASS: TestAdd (0.00s)
+=== RUN   TestDivide
+=== RUN   TestDivide/by_zero
+    math_test.go:21: expected error, got nil
+    --- FAIL: TestDivide/by_zero (0.00s)
+--- FAIL: TestDivide (0.00s)
+=== RUN   TestParse
+--- PASS: TestParse (0.00s)
+FAIL
+FAIL\texample.com/calc\t0.004s
+ok  \texample.com/calc/util\t0.002s
+FAIL
+""",
+        (3, 1, 0),
+    ),
+    "cargo": (
+        "cargo test",
+        """   Compiling calc v0.1.0 (/srv/calc)
+    Finished test [unoptimized + debuginfo] target(s) in 1.21s
+     Running unittests src/lib.rs (target/debug/deps/calc-1a2b3c)
+
+running 4 tests
+test tests::adds ... ok
+test tests::divides ... FAILED
+test tests::parses ... ok
+test tests::negates ... ok
+
+failures:
+
+---- tests::divides stdout ----
+thread 'tests::divides' panicked at src/lib.rs:30:9:
+assertion `left == right` failed
+  left: 2
+ right: 3
+
+failures:
+    tests::divides
+
+test result: FAILED. 3 passed; 1 failed; 0 ignored; 0 measured; 0 filtered out; finished in 0.00s
+
+   Doc-tests calc
+
+running 2 tests
+test src/lib.rs - add (line 5) ... ok
+test src/lib.rs - sub (line 12) ... ok
+
+test result: ok. 2 passed; 0 failed; 0 ignored; 0 measured; 0 filtered out; finished in 0.21s
+""",
+        (6, 1, 0),
+    ),
+    "rspec": (
+        "bundle exec rspec",
+        """..F.*.
+
+Pending: (Failures listed here are expected and do not affect your suite's status)
+
+  1) Order#ship sends an email
+     # Not yet implemented
+
+Failures:
+
+  1) Order#total sums line items
+     Failure/Error: expect(order.total).to eq(30)
+
+       expected: 30
+            got: 20
+
+Finished in 0.04213 seconds (files took 0.51 seconds to load)
+6 examples, 1 failure, 1 pending
+
+Failed examples:
+
+rspec ./spec/models/order_spec.rb:12 # Order#total sums line items
+""",
+        (6, 1, 0),
+    ),
+    "phpunit": (
+        "vendor/bin/phpunit",
+        """PHPUnit 10.5.2 by Sebastian Bergmann and contributors.
+
+Runtime:       PHP 8.3.0
+
+..F.E                                                               5 / 5 (100%)
+
+Time: 00:00.031, Memory: 8.00 MB
+
+There was 1 error:
+
+1) Tests\\CartTest::testEmpty
+TypeError: Cart::total(): Return value must be of type int, null returned
+
+There was 1 failure:
+
+1) Tests\\CartTest::testDiscount
+Failed asserting that 100 is identical to 90.
+
+FAILURES!
+Tests: 5, Assertions: 9, Errors: 1, Failures: 1.
+""",
+        (5, 1, 1),
+    ),
+    "mix": (
+        "mix test",
+        """Compiling 2 files (.ex)
+....
+
+  1) test sums line items (CartTest)
+     test/cart_test.exs:12
+     Assertion with == failed
+     code:  assert Cart.total(cart) == 30
+     left:  20
+     right: 30
+
+Finished in 0.05 seconds (0.03s async, 0.02s sync)
+1 doctest, 5 tests, 1 failure
+
+Randomized with seed 112233
+""",
+        (6, 1, 0),
+    ),
+    "dotnet": (
+        "dotnet test",
+        """  Determining projects to restore...
+  All projects are up-to-date for restore.
+  Calc -> /srv/calc/bin/Debug/net8.0/Calc.dll
+  Calc.Tests -> /srv/calc/tests/bin/Debug/net8.0/Calc.Tests.dll
+Test run for /srv/calc/tests/bin/Debug/net8.0/Calc.Tests.dll (.NETCoreApp,Version=v8.0)
+Starting test execution, please wait...
+A total of 1 test files matched the specified pattern.
+  Failed Calc.Tests.CartTests.AppliesDiscount [12 ms]
+  Error Message:
+   Assert.Equal() Failure
+Expected: 90
+Actual:   100
+
+Failed!  - Failed:     1, Passed:    11, Skipped:     0, Total:    12, Duration: 48 ms - Calc.Tests.dll (net8.0)
+""",
+        (12, 1, 0),
+    ),
+    "maven": (
+        "mvn test",
+        """[INFO] -------------------------------------------------------
+[INFO]  T E S T S
+[INFO] -------------------------------------------------------
+[INFO] Running com.example.CartTest
+[ERROR] Tests run: 4, Failures: 1, Errors: 0, Skipped: 0, Time elapsed: 0.041 s <<< FAILURE! -- in com.example.CartTest
+[ERROR] com.example.CartTest.appliesDiscount -- Time elapsed: 0.005 s <<< FAILURE!
+org.opentest4j.AssertionFailedError: expected: <90> but was: <100>
+[INFO] Running com.example.MathTest
+[INFO] Tests run: 3, Failures: 0, Errors: 1, Skipped: 0, Time elapsed: 0.002 s -- in com.example.MathTest
+[INFO]
+[INFO] Results:
+[INFO]
+[ERROR] Failures:
+[ERROR]   CartTest.appliesDiscount:21 expected: <90> but was: <100>
+[INFO]
+[ERROR] Tests run: 7, Failures: 1, Errors: 1, Skipped: 0
+[INFO]
+[INFO] BUILD FAILURE
+""",
+        (7, 1, 1),
+    ),
+    "gradle": (
+        "./gradlew test",
+        """> Task :compileJava
+> Task :test
+
+CartTest > appliesDiscount() FAILED
+    org.opentest4j.AssertionFailedError at CartTest.java:21
+
+10 tests completed, 1 failed
+
+> Task :test FAILED
+
+FAILURE: Build failed with an exception.
+
+BUILD FAILED in 3s
+""",
+        (10, 1, 0),
+    ),
+    "swift": (
+        "swift test",
+        """Building for debugging...
+Build complete! (1.20s)
+Test Suite 'All tests' started at 2024-01-10 10:00:00.000.
+Test Suite 'CalcTests' started at 2024-01-10 10:00:00.001.
+Test Case '-[CalcTests.CalcTests testAdd]' passed (0.001 seconds).
+/srv/calc/Tests/CalcTests/CalcTests.swift:14: error: -[CalcTests.CalcTests testDivide] : XCTAssertEqual failed: ("2") is not equal to ("3")
+Test Case '-[CalcTests.CalcTests testDivide]' failed (0.002 seconds).
+Test Suite 'CalcTests' failed at 2024-01-10 10:00:00.004.
+\t Executed 2 tests, with 1 failure (0 unexpected) in 0.003 (0.003) seconds
+Test Suite 'All tests' failed at 2024-01-10 10:00:00.004.
+\t Executed 2 tests, with 1 failure (0 unexpected) in 0.003 (0.004) seconds
+""",
+        (2, 1, 0),
+    ),
+}
+
+# Noise lines repeated to build multi-megabyte outputs per runner
+_NOISE = (
+    "    at Object.<anonymous> (/srv/app/node_modules/lib/index.js:1234:56) 42 passed 7 failed\n"
+    "DEBUG 2024-01-10T10:00:00Z request id=1234567890 status=200 elapsed_ms=12\n"
+    "test tests::case_0001 ... ok\n"
+)
+_TARGET_BYTES = 4 * 1024 * 1024
+
+# Pathological single lines: long digit and letter runs that make
+# backtracking regexes go quadratic.
+_PATHOLOGICAL = {
+    "digits": lambda n: "1" * n,
+    "digits+spaces": lambda n: "1 " * (n // 2) + "runs",
+    "letters": lambda n: "a" * n,
+    "letters+colons": lambda n: "Tests" + "a" * n + ":",
+}
+
+
+def _time(command: str, output: str) -> float:
+    start = time.perf_counter()
+    parse_output(command, output)
+    return time.perf_counter() - start
+
+
+def check_corpus() -> bool:
+    ok = True
+    for name, (command, output, expected) in CORPUS.items():
+        runner = runner_for_command(command)
+        counts = parse_output(command, output)
+        got = (counts.total, counts.failures, counts.errors)
+        # Every sample has at least one failing test whose name must be found
+        status = "ok" if got == expected and runner == name and counts.failed_tests else "MISMATCH"
+        ok = ok and status == "ok"
+        print(f"  {name:<10} runner={runner:<10} got={got} expected={expected}  {status}")
+    return ok
+
+
+def bench_large() -> bool:
+    ok = True
+    for name, (command, output, expected) in CORPUS.items():
+        padding = _NOISE * (_TARGET_BYTES // len(_NOISE))
+        big = padding + output
+        elapsed = _time(command, big)
+        counts = parse_output(command, big)
+        ok = ok and (counts.total, counts.failures, counts.errors) == expected
+        mb_s = len(big) / (1024 * 1024) / elapsed
+        print(f"  {name:<10} {len(big) / (1024 * 1024):.1f} MB  {elapsed * 1000:8.1f} ms  {mb_s:7.1f} MB/s")
+    return ok
+
+
+def bench_pathological(max_ratio: float = 4.0) -> bool:
+    """Time each parser on n and 4n-sized lines; linear parsers scale ~4x."""
+    ok = True
+    small, large = 250_000, 1_000_000
+    commands = {name: command for name, (command, _, _) in CORPUS.items()}
+    commands["generic"] = "npm test"
+    for shape, make in _PATHOLOGICAL.items():
+        line_small, line_large = make(small), make(large)
+        for name, command in commands.items():
+            t_small = max(_time(command, line_small), 1e-4)
+            t_large = _time(command, line_large)
+            ratio = t_large / t_small
+            # Allow generous headroom over the ideal 4x for timer noise
+            bad = ratio > 4 * max_ratio
+            ok = ok and not bad
+            if bad or name == "generic":
+                print(
+                    f"  {shape:<15} {name:<10} {t_small * 1000:7.2f} ms → "
+                    f"{t_large * 1000:7.2f} ms  (x{ratio:.1f}){'  SUPER-LINEAR' if bad else ''}"
+                )
+    return ok
+
+
+def main() -> int:
+    print("Corpus:")
+    corpus_ok = check_corpus()
+    print("\nMulti-megabyte outputs:")
+    large_ok = bench_large()
+    print("\nPathological lines (250k → 1M chars):")
+    path_ok = bench_pathological()
+    ok = corpus_ok and large_ok and path_ok
+    print("\nOK" if ok else "\nFAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Run-level budget: tokens, dollars and wall time.
+
+Usage is recorded from each stage's ResultMessage. The pipeline uses the
+budget in three ways. Before starting another review, QA, security or fix
+round, it checks whether the average stage cost so far still fits. Each stage
+gets a turn cap from what is left at the average cost per turn
+(``turn_cap``), enforced by the stage watchdog. Between stages, it stops the
+run with a checkpoint summary once any limit is used up.
+"""
+
+import os
+import time
+from dataclasses import dataclass, field
+
+
+def _env_number(name: str) -> float | None:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+# Defaults for every run; /api/run can override them per request (unset = unlimited)
+RUN_MAX_TOKENS = _env_number("RUN_MAX_TOKENS")
+RUN_MAX_COST_USD = _env_number("RUN_MAX_COST_USD")
+RUN_MAX_WALL_SECONDS = _env_number("RUN_MAX_WALL_SECONDS")
+
+# Stages kept in reserve for REPORT and GIT_COMMIT when projecting a round
+_RESERVED_STAGES = 2
+
+
+@dataclass
+class RunBudget:
+    max_tokens: int | None = None
+    max_cost_usd: float | None = None
+    max_wall_seconds: float | None = None
+    tokens_used: int = 0        # input + cache writes + output; cache reads are excluded
+    cost_usd: float = 0.0
+    stages: int = 0
+    turns: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    _session_costs: dict[str, float] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_request(cls, data: dict | None = None) -> "RunBudget":
+        """Build a budget from env defaults overridden by an /api/run ``budget`` object.
+
+        Raises ValueError for non-numeric or non-positive limits.
+        """
+        limits = {
+            "max_tokens": RUN_MAX_TOKENS,
+            "max_cost_usd": RUN_MAX_COST_USD,
+            "max_wall_seconds": RUN_MAX_WALL_SECONDS,
+        }
+        for key, value in (data or {}).items():
+            if key not in limits:
+                raise ValueError(f"unknown budget field: {key}")
+            limits[key] = value
+        for key, value in limits.items():
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"budget {key} must be a positive number")
+        if limits["max_tokens"] is not None:
+            limits["max_tokens"] = int(limits["max_tokens"])
+        return cls(**limits)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def record(self, session_id: str | None, tokens: int, session_cost_usd: float, turns: int = 0) -> None:
+        """Add one stage's usage. Cost is the session's running total, so only its delta counts."""
+        previous = self._session_costs.get(session_id, 0.0) if session_id else 0.0
+        if session_id:
+            self._session_costs[session_id] = max(previous, session_cost_usd)
+        self.tokens_used += tokens
+        self.cost_usd += max(session_cost_usd - previous, 0.0)
+        self.stages += 1
+        self.turns += turns
+
+    def _dimensions(self) -> list[tuple[str, float, float | None]]:
+        """(name, used, limit) for each dimension."""
+        return [
+            ("tokens", self.tokens_used, self.max_tokens),
+            ("cost", self.cost_usd, self.max_cost_usd),
+            ("wall time", self.elapsed, self.max_wall_seconds),
+        ]
+
+    def exhausted(self) -> str | None:
+        """Return which limit has been reached, or None."""
+        for name, used, limit in self._dimensions():
+            if limit is not None and used >= limit:
+                return f"{name} limit reached ({self.describe()})"
+        return None
+
+    def can_afford(self, stages: int) -> bool:
+        """True if ``stages`` more stages, plus the reserve, fit at the average stage cost so far."""
+        if not self.stages:
+            return True
+        needed = stages + _RESERVED_STAGES
+        for _name, used, limit in self._dimensions():
+            if limit is not None and used + used / self.stages * needed > limit:
+                return False
+        return True
+
+    def turn_cap(self, max_turns: int | None) -> int | None:
+        """Turns the next stage may take so the reserve still fits, at the average cost per turn.
+
+        Never above ``max_turns``; at least one. None when nothing limits it.
+        """
+        cap = max_turns
+        if not self.turns:
+            return cap
+        for _name, used, limit in self._dimensions():
+            if limit is None or used <= 0:
+                continue
+            left = limit - used - used / self.stages * _RESERVED_STAGES
+            turns = max(int(left / (used / self.turns)), 1)
+            cap = turns if cap is None else min(cap, turns)
+        return cap
+
+    def describe(self) -> str:
+        tokens = f"{self.tokens_used} tokens" + (f" of {self.max_tokens}" if self.max_tokens else "")
+        cost = f"${self.cost_usd:.4f}" + (f" of ${self.max_cost_usd:.2f}" if self.max_cost_usd else "")
+        wall = f"{self.elapsed:.0f}s" + (f" of {self.max_wall_seconds:.0f}s" if self.max_wall_seconds else "")
+        return f"{tokens}, {cost}, {wall}"
+
+    def snapshot(self) -> dict:
+        return {
+            "tokens_used": self.tokens_used,
+            "cost_usd": round(self.cost_usd, 6),
+            "elapsed_seconds": round(self.elapsed, 1),
+            "stages": self.stages,
+            "max_tokens": self.max_tokens,
+            "max_cost_usd": self.max_cost_usd,
+            "max_wall_seconds": self.max_wall_seconds,
+            "exhausted": self.exhausted(),
+        }
@@ -0,0 +1,163 @@
+"""Pool of pre-connected ClaudeSDKClient sessions.
+
+Every ClaudeSDKClient spawns a CLI subprocess and completes a handshake before
+its first query. ``ClientPool.warm`` starts that work in the background while
+earlier stages run, and ``ClientPool.session`` hands out a connected client
+just in time, falling back to a cold connect when nothing is warm.
+
+Sessions are single-use: a client carries its conversation with it, so it is
+disconnected when the session ends instead of going back into the pool.
+Warm clients that are not checked out within ``POOL_IDLE_SECONDS`` are
+disconnected.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from claude_agent_sdk import ClaudeAgentOptions, ClaudeSDKClient
+
+from events import EventBus
+
+POOL_IDLE_SECONDS = float(os.getenv("POOL_IDLE_SECONDS", "900"))
+
+
+def profile_key(options: ClaudeAgentOptions) -> tuple:
+    """Options that decide whether a warm client can serve a request."""
+    hooks = tuple(
+        (event, matcher.matcher, tuple(id(h) for h in matcher.hooks))
+        for event, matchers in sorted((options.hooks or {}).items())
+        for matcher in matchers
+    )
+    # In-process MCP servers are bound to per-run state: match them by identity
+    servers = (
+        tuple((name, id(server)) for name, server in sorted(options.mcp_servers.items()))
+        if isinstance(options.mcp_servers, dict) else str(options.mcp_servers)
+    )
+    return (
+        tuple(options.allowed_tools or ()),
+        servers,
+        options.model,
+        str(options.cwd) if options.cwd else None,
+        options.max_thinking_tokens,
+        options.max_turns,
+        options.permission_mode,
+        options.include_partial_messages,
+        hooks,
+    )
+
+
+@dataclass
+class _PooledClient:
+    client: ClaudeSDKClient
+    created_at: float = field(default_factory=time.monotonic)
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    release: asyncio.Event = field(default_factory=asyncio.Event)
+    error: BaseException | None = None
+    owner: asyncio.Task | None = None
+
+
+@dataclass
+class SessionStats:
+    label: str
+    warm: bool
+    startup_ms: float       # time the caller waited for a connected client
+
+
+class ClientPool:
+    """Pre-spawned clients keyed by option profile (tools, model, cwd, thinking, hooks)."""
+
+    def __init__(self, idle_seconds: float = POOL_IDLE_SECONDS) -> None:
+        self.idle_seconds = idle_seconds
+        self.stats: list[SessionStats] = []
+        self._idle: dict[tuple, list[_PooledClient]] = {}
+        self._reaper: asyncio.Task | None = None
+
+    def _spawn(self, options: ClaudeAgentOptions) -> _PooledClient:
+        entry = _PooledClient(ClaudeSDKClient(options=options))
+        # Connect and disconnect happen in one owner task: the SDK's task group
+        # must be entered and exited from the same task.
+        entry.owner = asyncio.create_task(self._hold(entry))
+        return entry
+
+    @staticmethod
+    async def _hold(entry: _PooledClient) -> None:
+        try:
+            async with entry.client:
+                entry.ready.set()
+                await entry.release.wait()
+        except Exception as exc:
+            entry.error = exc
+        finally:
+            entry.ready.set()
+
+    def warm(self, options: ClaudeAgentOptions, count: int = 1) -> None:
+        """Start connecting clients for ``options`` in the background."""
+        pending = self._idle.setdefault(profile_key(options), [])
+        while len(pending) < count:
+            pending.append(self._spawn(options))
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _checkout(self, options: ClaudeAgentOptions) -> tuple[_PooledClient, bool]:
+        pending = self._idle.get(profile_key(options))
+        while pending:
+            entry = pending.pop(0)
+            await entry.ready.wait()
+            if entry.error is None and not entry.owner.done():
+                return entry, True
+        entry = self._spawn(options)
+        await entry.ready.wait()
+        if entry.error is not None:
+            await entry.owner
+            raise entry.error
+        return entry, False
+
+    @asynccontextmanager
+    async def session(
+        self,
+        options: ClaudeAgentOptions,
+        label: str = "",
+        event_bus: EventBus | None = None,
+    ) -> AsyncIterator[ClaudeSDKClient]:
+        """Check out a connected client for one stage; it is disconnected on exit."""
+        start = time.monotonic()
+        entry, warm = await self._checkout(options)
+        stats = SessionStats(label, warm, (time.monotonic() - start) * 1000)
+        self.stats.append(stats)
+        message = f"{label or 'Agent'} session ready in {stats.startup_ms:.0f} ms ({'warm' if warm else 'cold'})"
+        print(f"  [pool] {message}")
+        if event_bus:
+            await event_bus.emit({"type": "log", "data": {"message": message}})
+        try:
+            yield entry.client
+        finally:
+            entry.release.set()
+            await entry.owner
+
+    async def _reap(self) -> None:
+        """Disconnect warm clients idle for longer than ``idle_seconds``."""
+        while any(self._idle.values()):
+            await asyncio.sleep(min(self.idle_seconds, 30.0))
+            now = time.monotonic()
+            for pending in self._idle.values():
+                for entry in [e for e in pending if now - e.created_at > self.idle_seconds]:
+                    pending.remove(entry)
+                    entry.release.set()
+
+    async def close(self) -> None:
+        """Disconnect every client that was warmed but never checked out."""
+        entries = [e for pending in self._idle.values() for e in pending]
+        self._idle.clear()
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for entry in entries:
+            entry.release.set()
+        await asyncio.gather(*(e.owner for e in entries), return_exceptions=True)
+
+
+# Process-wide pool for sessions outside a pipeline run (optimizer, summarizer)
+shared_pool = ClientPool()
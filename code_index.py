@@ -0,0 +1,354 @@
+"""In-process symbol and identifier index of the target, served as SDK MCP tools.
+
+Agents otherwise find definitions and call sites with Grep, which rescans the
+whole tree on every call. The index is built once per target (off the event
+loop) and kept per process, so later runs only re-read files whose size or
+mtime changed. Write/Edit hooks update single files as the agent changes them.
+
+- definitions: symbol name → (file, line, kind), including nested methods
+- identifiers: identifier → file ids containing it, so ``find_references``
+  only opens the files that can match
+- trigrams of the lower-cased definition names, for substring lookups
+
+``python code_index.py <target> <name>`` prints both lookups with timings.
+"""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from claude_agent_sdk import create_sdk_mcp_server, tool
+
+from repo_map import LANGUAGES, SKIP_DIRS, list_files
+
+CODE_INDEX = os.getenv("CODE_INDEX", "1") not in ("0", "false", "no")
+SERVER_NAME = "code_index"
+CODE_INDEX_TOOLS = [f"mcp__{SERVER_NAME}__find_symbol", f"mcp__{SERVER_NAME}__find_references"]
+
+# Larger files (bundles, fixtures, generated code) are not indexed
+_MAX_INDEX_BYTES = 512 * 1024
+_MAX_RESULTS = 50
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]{2,}")
+
+# Declarations per language, indented ones included; groups are (kind, name)
+_DEFINITION_PATTERNS: dict[str, re.Pattern] = {
+    "Python": re.compile(r"^[ \t]*(?:async[ \t]+)?(def|class)[ \t]+(\w+)", re.M),
+    "Ruby": re.compile(r"^[ \t]*(class|module|def)[ \t]+(?:self\.)?([\w?!]+)", re.M),
+    "JavaScript": re.compile(
+        r"^[ \t]*(?:export[ \t]+(?:default[ \t]+)?)?(?:async[ \t]+)?(function\*?|class|const|let)[ \t]+(\w+)",
+        re.M),
+    "TypeScript": re.compile(
+        r"^[ \t]*(?:export[ \t]+(?:default[ \t]+)?)?(?:declare[ \t]+)?(?:abstract[ \t]+)?(?:async[ \t]+)?"
+        r"(function\*?|class|interface|type|enum|const)[ \t]+(\w+)", re.M),
+    "Go": re.compile(r"^(func|type)[ \t]+(?:\([^)]*\)[ \t]*)?(\w+)", re.M),
+    "Rust": re.compile(
+        r"^[ \t]*(?:pub(?:\([^)]*\))?[ \t]+)?(?:async[ \t]+)?(fn|struct|enum|trait|mod|type)[ \t]+(\w+)", re.M),
+    "Java": re.compile(
+        r"^[ \t]*(?:(?:public|protected|private|abstract|final|static)[ \t]+)*(class|interface|enum|record)[ \t]+(\w+)",
+        re.M),
+    "Kotlin": re.compile(
+        r"^[ \t]*(?:(?:data|open|abstract|private|internal|override|suspend)[ \t]+)*(class|object|interface|fun)"
+        r"[ \t]+(?:<[^>]*>[ \t]*)?(\w+)", re.M),
+    "C#": re.compile(
+        r"^[ \t]*(?:(?:public|internal|private|protected|static|sealed|abstract|partial)[ \t]+)*"
+        r"(class|interface|record|enum|struct)[ \t]+(\w+)", re.M),
+    "PHP": re.compile(
+        r"^[ \t]*(?:(?:abstract|final|public|protected|private|static)[ \t]+)*(class|interface|trait|function)"
+        r"[ \t]+(\w+)", re.M),
+    "Elixir": re.compile(r"^[ \t]*(defmodule|def|defp|defmacro)[ \t]+([\w.?!]+)", re.M),
+    "Swift": re.compile(
+        r"^[ \t]*(?:(?:public|open|final|private|internal|static)[ \t]+)*(class|struct|enum|protocol|func)"
+        r"[ \t]+(\w+)", re.M),
+}
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CodeIndex:
+    """Definitions and identifier postings for one target; safe to update from a thread."""
+
+    def __init__(self, target: str) -> None:
+        self.target = os.path.abspath(target)
+        self.ready = threading.Event()      # set once the first refresh has finished, even if it failed
+        self.error: str | None = None       # why the latest refresh failed
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._paths: list[str | None] = []                  # file id → path; None once replaced
+        self._ids: dict[str, int] = {}                      # path → live file id
+        self._stamps: dict[str, tuple[int, int]] = {}       # path → (size, mtime_ns)
+        self._file_defs: dict[int, list[str]] = {}          # file id → names it defines
+        self._defs: dict[str, list[tuple[int, int, str]]] = {}  # name → [(file id, line, kind)]
+        self._name_trigrams: dict[str, set[str]] = defaultdict(set)
+        self._postings: dict[str, array] = {}               # identifier → file ids (may be stale)
+        self._stale_ids = 0
+
+    # ── Building ──
+
+    def refresh(self) -> tuple[int, int]:
+        """Bring the index in line with the tree; returns (files re-indexed, files removed)."""
+        with self._refresh_lock:
+            try:
+                stamps: dict[str, tuple[int, int]] = {}
+                for rel in list_files(self.target):
+                    try:
+                        st = os.stat(os.path.join(self.target, rel))
+                    except OSError:
+                        continue
+                    stamps[rel] = (st.st_size, st.st_mtime_ns)
+                with self._lock:
+                    known = dict(self._stamps)
+                changed = [rel for rel, stamp in stamps.items() if known.get(rel) != stamp]
+                removed = [rel for rel in known if rel not in stamps]
+                for rel in changed:
+                    self._index_file(rel, stamps[rel])
+                with self._lock:
+                    for rel in removed:
+                        self._remove(rel)
+                    self._maybe_compact()
+                self.error = None
+                return len(changed), len(removed)
+            except Exception as exc:
+                self.error = f"{type(exc).__name__}: {exc}"
+                raise
+            finally:
+                # Lookups wait on this; they must not hang when indexing fails
+                self.ready.set()
+
+    def update_file(self, file_path: str) -> None:
+        """Re-index one file after a Write/Edit; paths outside the target are ignored."""
+        path = os.path.abspath(os.path.join(self.target, file_path))
+        rel = os.path.relpath(path, self.target)
+        if rel.startswith("..") or SKIP_DIRS.intersection(rel.split(os.sep)[:-1]):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._remove(rel)
+            return
+        self._index_file(rel, (st.st_size, st.st_mtime_ns))
+
+    def _index_file(self, rel: str, stamp: tuple[int, int]) -> None:
+        identifiers: set[str] = set()
+        definitions: list[tuple[str, int, str]] = []
+        if stamp[0] <= _MAX_INDEX_BYTES:
+            try:
+                with open(os.path.join(self.target, rel), errors="replace") as f:
+                    text = f.read()
+            except OSError:
+                text = ""
+            if "\0" not in text[:1024]:
+                identifiers = set(_IDENTIFIER.findall(text))
+                pattern = _DEFINITION_PATTERNS.get(LANGUAGES.get(os.path.splitext(rel)[1].lower(), ""))
+                if pattern is not None:
+                    line, offset = 1, 0
+                    for match in pattern.finditer(text):
+                        line += text.count("\n", offset, match.start())
+                        offset = match.start()
+                        definitions.append((match.group(2), line, match.group(1)))
+
+        with self._lock:
+            self._remove(rel)
+            file_id = len(self._paths)
+            self._paths.append(rel)
+            self._ids[rel] = file_id
+            self._stamps[rel] = stamp
+            for name in identifiers:
+                posting = self._postings.get(name)
+                if posting is None:
+                    posting = self._postings[name] = array("I")
+                posting.append(file_id)
+            for name, line, kind in definitions:
+                entries = self._defs.get(name)
+                if entries is None:
+                    entries = self._defs[name] = []
+                    for trigram in _trigrams(name.lower()):
+                        self._name_trigrams[trigram].add(name)
+                entries.append((file_id, line, kind))
+            self._file_defs[file_id] = list({name for name, _, _ in definitions})
+
+    def _remove(self, rel: str) -> None:
+        """Drop ``rel``; caller holds the lock. Its postings are filtered lazily."""
+        file_id = self._ids.pop(rel, None)
+        self._stamps.pop(rel, None)
+        if file_id is None:
+            return
+        self._paths[file_id] = None
+        self._stale_ids += 1
+        for name in self._file_defs.pop(file_id, ()):
+            entries = [entry for entry in self._defs[name] if entry[0] != file_id]
+            if entries:
+                self._defs[name] = entries
+            else:
+                del self._defs[name]
+                for trigram in _trigrams(name.lower()):
+                    self._name_trigrams[trigram].discard(name)
+
+    def _maybe_compact(self) -> None:
+        """Rewrite postings once stale ids outnumber live files; caller holds the lock."""
+        if self._stale_ids <= max(len(self._ids), 1000):
+            return
+        paths = self._paths
+        for name in list(self._postings):
+            live = array("I", (i for i in self._postings[name] if paths[i] is not None))
+            if live:
+                self._postings[name] = live
+            else:
+                del self._postings[name]
+        self._stale_ids = 0
+
+    # ── Lookups ──
+
+    def find_symbol(self, query: str, limit: int = _MAX_RESULTS) -> list[tuple[str, int, str, str]]:
+        """Definitions named ``query``; falls back to case-insensitive substring matches.
+
+        Returns (path, line, kind, name), exact matches first, then prefix
+        matches, then the shortest names.
+        """
+        query = query.strip()
+        lowered = query.lower()
+        with self._lock:
+            if query in self._defs:
+                names = [query]
+            elif len(lowered) >= 3:
+                grams = sorted((self._name_trigrams.get(t, set()) for t in _trigrams(lowered)), key=len)
+                candidates = set.intersection(*grams) if grams else set()
+                names = [n for n in candidates if lowered in n.lower()]
+            else:
+                names = [n for n in self._defs if lowered in n.lower()]
+            names.sort(key=lambda n: (n.lower() != lowered, not n.lower().startswith(lowered), len(n), n))
+            hits = []
+            for name in names:
+                for file_id, line, kind in self._defs[name]:
+                    hits.append((self._paths[file_id], line, kind, name))
+                    if len(hits) >= limit:
+                        return hits
+            return hits
+
+    def files_containing(self, identifier: str) -> list[str]:
+        with self._lock:
+            posting = self._postings.get(identifier, ())
+            return sorted({self._paths[i] for i in posting if self._paths[i] is not None})
+
+    def find_references(self, identifier: str, limit: int = _MAX_RESULTS) -> tuple[list[tuple[str, int, str]], int]:
+        """Lines using ``identifier`` as a whole word, and the number of files containing it."""
+        files = self.files_containing(identifier.strip())
+        word = re.compile(rf"(?<![\w$]){re.escape(identifier.strip())}(?![\w$])")
+        hits: list[tuple[str, int, str]] = []
+        for rel in files:
+            try:
+                with open(os.path.join(self.target, rel), errors="replace") as f:
+                    for number, line in enumerate(f, 1):
+                        if word.search(line):
+                            hits.append((rel, number, line.strip()[:200]))
+                            if len(hits) >= limit:
+                                return hits, len(files)
+            except OSError:
+                continue
+        return hits, len(files)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._ids), "definitions": len(self._defs), "identifiers": len(self._postings)}
+
+
+_indexes: dict[str, CodeIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(target: str) -> CodeIndex:
+    """The process-wide index for ``target``; call ``refresh`` to (re)build it."""
+    target = os.path.abspath(target)
+    with _indexes_lock:
+        index = _indexes.get(target)
+        if index is None:
+            index = _indexes[target] = CodeIndex(target)
+        return index
+
+
+def _text(body: str, is_error: bool = False) -> dict:
+    result = {"content": [{"type": "text", "text": body}]}
+    if is_error:
+        result["is_error"] = True
+    return result
+
+
+async def _unavailable(index: CodeIndex) -> dict | None:
+    """Wait for the first refresh; an error result if the index could not be built."""
+    await asyncio.to_thread(index.ready.wait)
+    if index.error is None:
+        return None
+    return _text(f"The code index is unavailable ({index.error}). Use Grep instead.", is_error=True)
+
+
+def create_code_index_server(index: CodeIndex):
+    """SDK MCP server exposing ``find_symbol`` and ``find_references`` over ``index``."""
+
+    @tool(
+        "find_symbol",
+        "Find where a function, class, method or type is defined. Takes an exact name or a "
+        "case-insensitive fragment of one. Answers from a prebuilt index — much faster than Grep.",
+        {"name": str},
+    )
+    async def find_symbol(args):
+        if (failed := await _unavailable(index)) is not None:
+            return failed
+        name = args.get("name", "")
+        hits = index.find_symbol(name)
+        if not hits:
+            return _text(f"No definitions matching {name!r}.")
+        return _text("\n".join(f"{path}:{line}: {kind} {symbol}" for path, line, kind, symbol in hits))
+
+    @tool(
+        "find_references",
+        "List lines that use an identifier (whole-word match) across the project, as path:line: text. "
+        "Only files known to contain the identifier are read — much faster than Grep.",
+        {"name": str},
+    )
+    async def find_references(args):
+        if (failed := await _unavailable(index)) is not None:
+            return failed
+        name = args.get("name", "")
+        hits, files = await asyncio.to_thread(index.find_references, name)
+        if not hits:
+            return _text(f"No references to {name!r}.")
+        more = f"\n(first {len(hits)} matches; {files} files contain {name!r})" if len(hits) >= _MAX_RESULTS else ""
+        return _text("\n".join(f"{path}:{line}: {text}" for path, line, text in hits) + more)
+
+    return create_sdk_mcp_server(name=SERVER_NAME, version="1.0.0", tools=[find_symbol, find_references])
+
+
+def main() -> int:
+    if len(sys.argv) < 3:
+        print("usage: python code_index.py <target> <name>")
+        return 1
+    target, name = sys.argv[1], sys.argv[2]
+    index = get_index(target)
+    start = time.perf_counter()
+    index.refresh()
+    print(f"Indexed {index.stats()} in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    hits = index.find_symbol(name)
+    print(f"\nfind_symbol({name!r}): {len(hits)} hits in {(time.perf_counter() - start) * 1000:.2f} ms")
+    for path, line, kind, symbol in hits[:20]:
+        print(f"  {path}:{line}: {kind} {symbol}")
+
+    start = time.perf_counter()
+    refs, files = index.find_references(name)
+    print(f"\nfind_references({name!r}): {len(refs)} lines in {files} files "
+          f"in {(time.perf_counter() - start) * 1000:.2f} ms")
+    for path, line, text in refs[:20]:
+        print(f"  {path}:{line}: {text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
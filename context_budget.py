@@ -0,0 +1,236 @@
+"""Token estimates and compaction for the per-run blocks injected into prompts.
+
+Plan text, reviewer findings, QA output and the ticket are pasted verbatim
+into later prompts. A block larger than its limit is compacted before the
+prompt is sent, in three steps that stop as soon as it fits:
+
+1. fenced code blocks are replaced by a one-line marker, largest first
+2. only essential lines are kept: headings, list items, verdict lines and
+   lines that name a file; dropped runs become ``[...]``
+3. head and tail are kept around a truncation marker
+
+Blocks that are already structured listings are cut along their structure
+instead: ``diff_context`` keeps whole file diffs from the top and lists the
+files it dropped by name (code fences are the content there, not noise), and
+``repo_map`` keeps whole lines.
+
+If the whole prompt still exceeds ``PROMPT_MAX_TOKENS``, the largest blocks
+are compacted further. Estimates use ~4 characters per token: no tokenizer
+ships with the SDK, and the limits only need to be approximately right.
+
+``PromptSizes`` keeps a per-stage histogram of prompt sizes for the
+``prompt_size`` events, plus a count of mid-stage context compactions.
+"""
+
+import os
+import re
+from collections import defaultdict
+
+CHARS_PER_TOKEN = 4
+# Limits for a single injected block and for a whole rendered prompt (0 disables)
+BLOCK_MAX_TOKENS = int(os.getenv("BLOCK_MAX_TOKENS", "6000"))
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "30000"))
+# Blocks that carry requirements or are already size-capped get more room
+_BLOCK_LIMIT_FACTORS = {"ticket": 2.0, "diff_context": 2.0, "plan": 1.5}
+# Blocks are never compacted below this during whole-prompt fitting
+_MIN_BLOCK_TOKENS = 1000
+
+HISTOGRAM_BUCKETS = (1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+_FENCE = re.compile(r"^(\s*)(```|~~~)[^\n]*\n.*?^\1\2[ \t]*$", re.M | re.S)
+_ESSENTIAL = re.compile(
+    r"^\s*(?:#{1,6}\s|[-*+]\s|\d+[.)]\s|\|)"                 # headings, list items, table rows
+    r"|\b(?:VERDICT|QA|SECURITY|OVERRIDE|FAIL(?:ED|ING|URE)?|ERROR)\b"
+    r"|[\w./-]+\.\w{1,5}(?::\d+)?\b"                          # mentions a file (optionally :line)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def block_limit(name: str) -> int | None:
+    """Token limit for block ``name``; None when compaction is disabled."""
+    if BLOCK_MAX_TOKENS <= 0:
+        return None
+    return int(BLOCK_MAX_TOKENS * _BLOCK_LIMIT_FACTORS.get(name, 1.0))
+
+
+def _strip_code(text: str, max_chars: int) -> str:
+    """Replace fenced code blocks by a marker, largest first, until ``max_chars`` is met."""
+    fences = sorted(_FENCE.finditer(text), key=lambda m: len(m.group(0)), reverse=True)
+    excess = len(text) - max_chars
+    replaced: dict[int, tuple[int, str]] = {}
+    for match in fences:
+        if excess <= 0:
+            break
+        lines = match.group(0).count("\n")
+        marker = f"{match.group(1)}[code block: {lines} lines omitted]"
+        replaced[match.start()] = (match.end(), marker)
+        excess -= len(match.group(0)) - len(marker)
+    parts, pos = [], 0
+    for start in sorted(replaced):
+        end, marker = replaced[start]
+        parts += [text[pos:start], marker]
+        pos = end
+    return "".join(parts) + text[pos:]
+
+
+def _essential_lines(text: str) -> str:
+    kept: list[str] = []
+    for line in text.splitlines():
+        if line.strip() and _ESSENTIAL.search(line):
+            kept.append(line)
+        elif kept and kept[-1] != "[...]":
+            kept.append("[...]")
+    return "\n".join(kept)
+
+
+def _head_tail(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    marker = "\n[... {} chars omitted ...]\n"
+    room = max(max_chars - len(marker) - 8, 0)
+    head = text[: room * 3 // 5]
+    tail = text[len(text) - (room - len(head)):] if room > len(head) else ""
+    return head + marker.format(len(text) - len(head) - len(tail)) + tail
+
+
+def _sections(text: str) -> list[str]:
+    """Split at blank lines outside code fences."""
+    sections: list[str] = []
+    current: list[str] = []
+    fenced = False
+    for line in text.split("\n"):
+        if line.lstrip().startswith(("```", "~~~")):
+            fenced = not fenced
+        if line.strip() or fenced:
+            current.append(line)
+        elif current:
+            sections.append("\n".join(current))
+            current = []
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+def _drop_file_diffs(text: str, max_chars: int) -> str:
+    """Keep whole ``### path`` diff chunks from the top; list the dropped files by name."""
+    sections = _sections(text)
+    headers = {i: s.split("\n", 1)[0][4:] for i, s in enumerate(sections) if s.startswith("### ")}
+    note = "Not shown (prompt size limit) — Read these directly:"
+    # Start as if every chunk were dropped, then bring chunks back while they fit
+    used = sum(len(s) + 2 for i, s in enumerate(sections) if i not in headers)
+    used += len(note) + sum(len(h) + 3 for h in headers.values())
+    kept: list[str] = []
+    dropped: list[str] = []
+    for i, section in enumerate(sections):
+        if i not in headers:
+            kept.append(section)
+            continue
+        cost = len(section) + 2 - (len(headers[i]) + 3)
+        if used + cost <= max_chars:
+            kept.append(section)
+            used += cost
+        else:
+            dropped.append(f"- {headers[i]}")
+    if dropped:
+        kept.append(note + "\n" + "\n".join(dropped))
+    return "\n\n".join(kept)
+
+
+def _drop_lines(text: str, max_chars: int) -> str:
+    """Keep whole lines from the top, with a count of the ones dropped."""
+    lines = text.split("\n")
+    kept: list[str] = []
+    used = 40       # room for the marker
+    for line in lines:
+        if used + len(line) + 1 > max_chars:
+            break
+        kept.append(line)
+        used += len(line) + 1
+    if len(kept) < len(lines):
+        kept.append(f"  ... {len(lines) - len(kept)} more lines omitted (size limit)")
+    return "\n".join(kept)
+
+
+# Blocks cut along their own structure instead of the generic steps
+_STRUCTURED = {"diff_context": _drop_file_diffs, "repo_map": _drop_lines}
+
+
+def compact(text: str, max_tokens: int, name: str = "") -> str:
+    """Shrink ``text`` (block ``name``) to about ``max_tokens``, keeping its essential sections."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if name in _STRUCTURED:
+        text = _STRUCTURED[name](text, max_chars)
+        return text if estimate_tokens(text) <= max_tokens else _head_tail(text, max_chars)
+    for step in (lambda t: _strip_code(t, max_chars), _essential_lines):
+        reduced = step(text)
+        # Keep a step only if it leaves something useful behind
+        if reduced.strip():
+            text = reduced
+        if estimate_tokens(text) <= max_tokens:
+            return text
+    return _head_tail(text, max_chars)
+
+
+def fit_blocks(blocks: dict[str, str], fixed_chars: int) -> tuple[dict[str, str], list[str]]:
+    """Compact ``blocks`` to their limits, then the largest ones until the prompt fits.
+
+    ``fixed_chars`` is the size of everything else in the prompt. Returns the
+    (possibly) compacted blocks and a note per compacted block.
+    """
+    fitted: dict[str, str] = {}
+    for name, text in blocks.items():
+        limit = block_limit(name)
+        fitted[name] = compact(text, limit, name) if limit else text
+
+    if PROMPT_MAX_TOKENS > 0:
+        for _ in range(len(fitted)):
+            used = fixed_chars // CHARS_PER_TOKEN + sum(map(estimate_tokens, fitted.values()))
+            excess = used - PROMPT_MAX_TOKENS
+            if excess <= 0:
+                break
+            name = max(fitted, key=lambda n: len(fitted[n]))
+            current = estimate_tokens(fitted[name])
+            if current <= _MIN_BLOCK_TOKENS:
+                break
+            fitted[name] = compact(fitted[name], max(current - excess, _MIN_BLOCK_TOKENS), name)
+
+    notes = [
+        f"<{name}> {estimate_tokens(blocks[name])} → {estimate_tokens(fitted[name])} tokens"
+        for name in blocks if fitted[name] != blocks[name]
+    ]
+    return fitted, notes
+
+
+def _bucket(tokens: int) -> str:
+    for bound in HISTOGRAM_BUCKETS:
+        if tokens <= bound:
+            return f"≤{bound // 1000}k"
+    return f">{HISTOGRAM_BUCKETS[-1] // 1000}k"
+
+
+class PromptSizes:
+    """Per-stage-kind prompt size histogram for one run."""
+
+    def __init__(self) -> None:
+        self.histograms: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.largest: dict[str, int] = {}
+        self.context_compactions = 0
+
+    def record(self, kind: str, prompt: str) -> int:
+        tokens = estimate_tokens(prompt)
+        self.histograms[kind][_bucket(tokens)] += 1
+        self.largest[kind] = max(self.largest.get(kind, 0), tokens)
+        return tokens
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": [_bucket(b) for b in HISTOGRAM_BUCKETS] + [_bucket(HISTOGRAM_BUCKETS[-1] + 1)],
+            "histograms": {kind: dict(counts) for kind, counts in self.histograms.items()},
+            "largest": dict(self.largest),
+            "context_compactions": self.context_compactions,
+        }
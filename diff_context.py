@@ -0,0 +1,193 @@
+"""Per-file diff of the run's changes for the review, QA and security prompts.
+
+Reviewers used to open every round with ``git status``, ``git diff`` and file
+reads. The pipeline now diffs the working tree against the baseline commit
+(untracked files included, via a scratch index so the real one is untouched)
+and hands each reviewer one chunk per changed file. Each reviewer kind
+remembers the blob of every file it has seen: later rounds include full
+chunks only for files that changed since its previous round and list the rest
+by name.
+
+The diff is computed off the event loop, started alongside each gate so it is
+usually ready by the time the next review prompt is assembled.
+"""
+
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+DIFF_CONTEXT = os.getenv("DIFF_CONTEXT", "1") not in ("0", "false", "no")
+# Rendered diff budget; files past it are listed with their stats only
+DIFF_MAX_CHARS = int(os.getenv("DIFF_MAX_CHARS", "40000"))
+DIFF_FILE_MAX_CHARS = int(os.getenv("DIFF_FILE_MAX_CHARS", "8000"))
+
+# `git hash-object -t tree /dev/null` — the baseline when the repo has no commits
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+_STATUS = {"A": "added", "M": "modified", "D": "deleted", "T": "type changed"}
+
+
+@dataclass
+class FileDiff:
+    path: str
+    status: str         # A / M / D / T
+    blob: str           # post-image blob id; identifies this version of the file
+    added: int | None   # None for binary files
+    removed: int | None
+    patch: str
+
+    @property
+    def status_label(self) -> str:
+        return _STATUS.get(self.status, self.status)
+
+
+def baseline_commit(target: str) -> str:
+    """HEAD of the target (the pipeline's baseline snapshot), or the empty tree."""
+    proc = subprocess.run(
+        ["git", "rev-parse", "--verify", "-q", "HEAD"], cwd=target, capture_output=True, text=True
+    )
+    return proc.stdout.strip() if proc.returncode == 0 and proc.stdout.strip() else EMPTY_TREE
+
+
+def _git(target: str, env: dict, *args: str) -> str:
+    proc = subprocess.run(["git", "-c", "core.quotepath=off", *args], cwd=target, env=env, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {proc.stderr.decode(errors='replace').strip()}")
+    return proc.stdout.decode(errors="replace")
+
+
+def collect_diff(target: str, baseline: str) -> list[FileDiff]:
+    """Changes in the working tree since ``baseline``, one entry per file."""
+    git_dir = os.path.join(target, ".git")
+    with tempfile.TemporaryDirectory(prefix="tdd-diff-") as scratch:
+        index = os.path.join(scratch, "index")
+        if os.path.exists(os.path.join(git_dir, "index")):
+            shutil.copyfile(os.path.join(git_dir, "index"), index)
+        env = {**os.environ, "GIT_INDEX_FILE": index}
+        _git(target, env, "add", "-A")
+        raw = _git(target, env, "diff", "--cached", "--raw", "--no-renames", "--abbrev=40", "-z", baseline)
+        numstat = _git(target, env, "diff", "--cached", "--numstat", "--no-renames", "-z", baseline)
+        patch = _git(target, env, "diff", "--cached", "--no-renames", "--no-color", "--no-ext-diff", baseline)
+
+    # --raw -z: ":<old mode> <new mode> <old blob> <new blob> <status>\0<path>\0"
+    entries: dict[str, FileDiff] = {}
+    fields = raw.split("\0")
+    for header, path in zip(fields[0::2], fields[1::2]):
+        if not header.startswith(":"):
+            continue
+        _, _, _, new_blob, status = header[1:].split(" ")
+        entries[path] = FileDiff(path, status[0], new_blob, None, None, "")
+
+    # --numstat -z: "<added>\t<removed>\t<path>\0"; "-" counts mean binary
+    for record in numstat.split("\0"):
+        parts = record.split("\t", 2)
+        if len(parts) == 3 and parts[2] in entries:
+            added, removed, path = parts
+            if added != "-":
+                entries[path].added, entries[path].removed = int(added), int(removed)
+
+    for chunk in re.split(r"^(?=diff --git )", patch, flags=re.M):
+        header = chunk.split("\n", 1)[0]
+        if not header.startswith("diff --git a/"):
+            continue
+        # Without renames the header is "diff --git a/<path> b/<path>"
+        paths = header[len("diff --git a/"):]
+        path = paths[:(len(paths) - 3) // 2]
+        if path in entries:
+            entries[path].patch = chunk.rstrip("\n")
+    return sorted(entries.values(), key=lambda e: e.path)
+
+
+def _file_header(diff: FileDiff) -> str:
+    counts = "binary" if diff.added is None else f"+{diff.added} -{diff.removed}"
+    return f"### {diff.path} ({diff.status_label}, {counts})"
+
+
+def render_diffs(
+    diffs: list[FileDiff],
+    unchanged: list[FileDiff] | None = None,
+    reverted: list[str] | None = None,
+    max_chars: int = DIFF_MAX_CHARS,
+) -> str:
+    """One chunk per file; chunks past ``max_chars`` are listed by name instead."""
+    if not diffs and not unchanged and not reverted:
+        return "(no changes since the baseline commit)"
+    parts: list[str] = []
+    if diffs:
+        parts.append(f"{len(diffs)} file(s) with changes to review:")
+    used = sum(len(p) for p in parts)
+    overflow: list[FileDiff] = []
+    for diff in diffs:
+        if diff.status == "D" or diff.added is None:
+            body = ""
+        elif len(diff.patch) > DIFF_FILE_MAX_CHARS:
+            cut = diff.patch.rfind("\n", 0, DIFF_FILE_MAX_CHARS)
+            body = diff.patch[:cut] + "\n... (diff truncated — Read the file for the rest)"
+        else:
+            body = diff.patch
+        chunk = _file_header(diff) + (f"\n```diff\n{body}\n```" if body else "")
+        if used + len(chunk) > max_chars:
+            overflow.append(diff)
+            continue
+        parts.append(chunk)
+        used += len(chunk)
+    if overflow:
+        parts.append("Not shown (size limit) — Read these directly:\n"
+                     + "\n".join(f"- {_file_header(d)[4:]}" for d in overflow))
+    if unchanged:
+        parts.append("Unchanged since your previous round (already reviewed):\n"
+                     + "\n".join(f"- {_file_header(d)[4:]}" for d in unchanged))
+    if reverted:
+        parts.append("No longer differ from the baseline since your previous round:\n"
+                     + "\n".join(f"- {path}" for path in reverted))
+    return "\n\n".join(parts)
+
+
+class DiffTracker:
+    """Diff snapshots for one run, and what each reviewer kind has already seen."""
+
+    def __init__(self, target: str, baseline: str) -> None:
+        self.target = target
+        self.baseline = baseline
+        self._pending: asyncio.Task | None = None
+        self._seen: dict[str, dict[str, str]] = {}      # kind → path → blob
+
+    def prefetch(self) -> None:
+        """Start computing the diff of the current tree in the background."""
+        if not DIFF_CONTEXT:
+            return
+        self.invalidate()
+        self._pending = asyncio.create_task(asyncio.to_thread(collect_diff, self.target, self.baseline))
+
+    def invalidate(self) -> None:
+        """Drop a prefetched snapshot; the tree may have changed since it was taken."""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+    async def _snapshot(self) -> list[FileDiff]:
+        task, self._pending = self._pending, None
+        if task is not None:
+            return await task
+        return await asyncio.to_thread(collect_diff, self.target, self.baseline)
+
+    async def context_for(self, kind: str) -> str:
+        """Rendered diff for the next ``kind`` round: only what changed since its last round."""
+        if not DIFF_CONTEXT:
+            return "(diff context disabled — run `git status --short` and `git diff` to find the changes)"
+        try:
+            diffs = await self._snapshot()
+        except (OSError, RuntimeError) as exc:
+            return f"(diff unavailable: {exc} — run `git status --short` and `git diff` to find the changes)"
+        seen = self._seen.get(kind)
+        self._seen[kind] = {d.path: d.blob for d in diffs}
+        if seen is None:
+            return render_diffs(diffs)
+        changed = [d for d in diffs if seen.get(d.path) != d.blob]
+        unchanged = [d for d in diffs if seen.get(d.path) == d.blob]
+        current = {d.path for d in diffs}
+        reverted = sorted(path for path in seen if path not in current)
+        return render_diffs(changed, unchanged, reverted)
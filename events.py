@@ -1,17 +1,28 @@
 import asyncio
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Callable
 
 
 class EventBus:
-    """Async pub/sub event bus for streaming pipeline events to SSE clients."""
+    """Async pub/sub event bus for streaming pipeline events to SSE clients.
 
-    def __init__(self) -> None:
+    ``observers`` are called synchronously with every event as it is emitted,
+    so state folded from the stream is never behind the pipeline.
+    """
+
+    def __init__(self, observers: list[Callable[[dict[str, Any]], None]] | None = None) -> None:
         self._subscribers: list[asyncio.Queue[dict[str, Any]]] = []
+        self._observers = list(observers or [])
 
     async def emit(self, event: dict[str, Any]) -> None:
+        for observe in self._observers:
+            observe(event)
         for queue in self._subscribers:
             await queue.put(event)
 
+    def stats(self) -> dict[str, Any]:
+        """Subscriber count and the number of events waiting in each subscriber's queue."""
+        return {"subscribers": len(self._subscribers), "queued": [q.qsize() for q in self._subscribers]}
+
     async def subscribe(self) -> AsyncGenerator[dict[str, Any], None]:
         queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
         self._subscribers.append(queue)
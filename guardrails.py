@@ -0,0 +1,223 @@
+"""Compiled guardrail policies for the PreToolUse hooks.
+
+These checks run on every tool call of every stage, so everything that can be
+prepared up front is: the blocked-command rules are folded into one
+case-insensitive alternation per policy, the target path is normalised once,
+and decisions for repeated commands and paths are memoised.
+
+``cd``/``pushd`` confinement tokenises the command with shlex instead of
+matching a regex, so quoted paths, ``~``/``$HOME`` and ``cd`` chains inside
+one command are all resolved before the boundary check. Here-document bodies
+are dropped first, so a ``cd`` written into a file is not taken for a command.
+"""
+
+import os
+import re
+import shlex
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Dangerous shell commands, keyed by rule name
+BASH_RULES: dict[str, str] = {
+    "rm_root": r"rm\s+-r[fd]?\s+/(?!\S)",        # rm -rf / (but not rm -rf /some/path)
+    "git_push": r"git\s+push",
+    "git_reset_hard": r"git\s+reset\s+--hard",
+    "git_clean": r"git\s+clean\s+-[fd]",
+    "mkfs": r"mkfs\b",
+    "dd_device": r"dd\s+.*of=/dev/",
+    "fork_bomb": r":\(\)\{.*\}",
+    "sudo": r"sudo\s+",
+    "chmod_root": r"chmod\s+-R\s+777\s+/",
+    "drop_table": r"drop\s+(?:table|database)\b",
+    "truncate_table": r"truncate\s+table\b",
+}
+
+_MEMO_SIZE = 1024
+_SEPARATORS = {";", "&&", "||", "|", "&", "(", ")", "\n", ";;", "|&"}
+# Words that can precede a simple command without being its name
+_COMMAND_PREFIXES = {"{", "!", "then", "do", "else", "time"}
+# Cheap prefilter: only commands that may contain a cd are tokenised
+_CD_HINT = re.compile(r"(?:^|[;&|(\n{!]|\b(?:then|do|else|time)\s)\s*(?:cd|pushd)\b")
+# Separator run or word of a command without quotes or escapes
+_PLAIN_TOKEN = re.compile(r"([;&|()\n]+)|([^ \t\r;&|()\n]+)")
+# Here-document operator: <<WORD, <<-WORD, <<'WORD', <<"WORD" (not the <<< here-string)
+_HEREDOC = re.compile(r"(?<!<)<<(-?)[ \t]*(?:'([^'\n]+)'|\"([^\"\n]+)\"|\\?([A-Za-z_][\w.-]*))")
+
+
+@dataclass(frozen=True)
+class StagePolicy:
+    """What the guardrails enforce during one stage."""
+    name: str
+    protect_test_files: bool = False
+    bash_rules: frozenset[str] = field(default_factory=lambda: frozenset(BASH_RULES))
+    confine_cd: bool = True
+
+
+DEFAULT_POLICY = StagePolicy("default")
+# Implementation stages must not touch tests
+_IMPLEMENTATION_POLICY = StagePolicy("implementation", protect_test_files=True)
+
+STAGE_POLICIES: dict[str, StagePolicy] = {
+    "GREEN": _IMPLEMENTATION_POLICY,
+    "REVIEW_GREEN": _IMPLEMENTATION_POLICY,
+    "SECURITY_GREEN": _IMPLEMENTATION_POLICY,
+    "QA_GREEN": _IMPLEMENTATION_POLICY,
+}
+
+
+def policy_for_stage(stage: str) -> StagePolicy:
+    return STAGE_POLICIES.get(stage, DEFAULT_POLICY)
+
+
+@lru_cache(maxsize=None)
+def _compile_rules(rule_names: frozenset[str]) -> re.Pattern | None:
+    parts = [f"(?P<{name}>{BASH_RULES[name]})" for name in sorted(rule_names)]
+    return re.compile("|".join(parts), re.IGNORECASE) if parts else None
+
+
+def _strip_heredocs(command: str) -> str:
+    """Drop here-document bodies, which are data for the command, not commands."""
+    if "<<" not in command:
+        return command
+    out: list[str] = []
+    pending: list[tuple[bool, str]] = []    # (strip tabs, delimiter) still to be closed
+    for line in command.split("\n"):
+        if pending:
+            tabs, word = pending[0]
+            if (line.lstrip("\t") if tabs else line) == word:
+                pending.pop(0)
+            continue
+        out.append(line)
+        pending = [(m[1] == "-", m[2] or m[3] or m[4]) for m in _HEREDOC.finditer(line)]
+    return "\n".join(out)
+
+
+def _tokenize(command: str) -> list[list[str]] | None:
+    """Split a shell command into simple-command word lists; None if unparsable."""
+    if not any(ch in command for ch in "'\"\\"):
+        # Nothing for shlex to unquote: a regex split is several times cheaper
+        segments = [[]]
+        for separator, word in _PLAIN_TOKEN.findall(command):
+            if separator:
+                segments.append([])
+            else:
+                segments[-1].append(word)
+        return [s for s in segments if s]
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=";&|()\n")
+    lexer.whitespace = " \t\r"
+    lexer.whitespace_split = True
+    lexer.commenters = ""
+    segments: list[list[str]] = [[]]
+    try:
+        for token in lexer:
+            if token in _SEPARATORS:
+                segments.append([])
+            else:
+                segments[-1].append(token)
+    except ValueError:
+        return None
+    return [s for s in segments if s]
+
+
+class GuardrailEngine:
+    """Per-run guardrail decisions for one target directory.
+
+    ``check_bash`` and ``check_path`` return a denial reason, or None to allow.
+    """
+
+    def __init__(self, target: str) -> None:
+        self.target = target
+        self._norm_target = os.path.normpath(os.path.abspath(target))
+        self._home = os.path.expanduser("~")
+        self._memo: OrderedDict[tuple[str, str, str], str | None] = OrderedDict()
+
+    def _inside(self, path: str) -> bool:
+        return path == self._norm_target or path.startswith(self._norm_target + os.sep)
+
+    def _remember(self, key: tuple[str, str, str], reason: str | None) -> str | None:
+        self._memo[key] = reason
+        if len(self._memo) > _MEMO_SIZE:
+            self._memo.popitem(last=False)
+        return reason
+
+    def check_bash(self, command: str, policy: StagePolicy = DEFAULT_POLICY) -> str | None:
+        key = ("bash", policy.name, command)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+
+        matcher = _compile_rules(policy.bash_rules)
+        if matcher is not None and matcher.search(command):
+            return self._remember(key, f"Blocked dangerous command: {command[:120]}")
+
+        if policy.confine_cd:
+            outside = self._cd_outside_target(command)
+            if outside is not None:
+                return self._remember(
+                    key,
+                    f"cd to {outside} is outside the target project directory "
+                    f"{self.target}. Stay within {self.target}.",
+                )
+        return self._remember(key, None)
+
+    def _cd_outside_target(self, command: str) -> str | None:
+        """Return the first cd destination outside the target, if any."""
+        if not _CD_HINT.search(command):
+            return None
+        command = _strip_heredocs(command)
+        segments = _tokenize(command)
+        if segments is None:
+            # Unbalanced quotes: fall back to checking plain absolute cd targets
+            for m in re.finditer(r"(?:^|[;&|\n(])\s*(?:cd|pushd)\s+(/[^\s;|&)]*)", command):
+                path = os.path.normpath(m.group(1))
+                if not self._inside(path):
+                    return path
+            return None
+
+        # The Bash tool's cwd is unknown at the start of a command, so relative
+        # cd destinations are only resolved after an absolute cd in the same chain.
+        cwd: str | None = None
+        for words in segments:
+            while words and words[0] in _COMMAND_PREFIXES:
+                words = words[1:]
+            if not words or words[0] not in ("cd", "pushd"):
+                continue
+            args = [w for w in words[1:] if not w.startswith("-") or w == "-"]
+            dest = args[0] if args else "~"
+            if dest == "-":
+                cwd = None
+                continue
+            for prefix in ("~", "${HOME}", "$HOME"):
+                if dest == prefix or dest.startswith(prefix + "/"):
+                    dest = self._home + dest[len(prefix):]
+                    break
+            if dest.startswith("$"):
+                cwd = None
+                continue
+            if os.path.isabs(dest):
+                path = os.path.normpath(dest)
+            elif cwd is not None:
+                path = os.path.normpath(os.path.join(cwd, dest))
+            else:
+                continue
+            if not self._inside(path):
+                return path
+            cwd = path
+        return None
+
+    def check_path(self, file_path: str) -> str | None:
+        """Deny absolute file paths outside the target directory."""
+        if not file_path or not os.path.isabs(file_path):
+            return None
+        key = ("path", "", file_path)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        if self._inside(os.path.normpath(file_path)):
+            return self._remember(key, None)
+        return self._remember(
+            key,
+            f"Path {file_path} is outside the target project directory {self.target}. "
+            f"All operations must stay within {self.target}.",
+        )
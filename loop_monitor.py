@@ -0,0 +1,214 @@
+"""Event-loop lag monitoring and blocking-call detection.
+
+``LoopMonitor`` always measures loop lag: a probe task sleeps for
+LOOP_LAG_INTERVAL and records how late it wakes up. With LOOP_DIAGNOSTICS=1
+it also finds out what blocked the loop:
+
+- a sampler thread watches the probe, and once it is overdue by
+  LOOP_SLOW_CALLBACK_SECONDS captures the loop thread's stack — the blocking
+  call is still on it, since the loop can't move until it returns
+- asyncio debug mode reports every callback slower than the same threshold
+
+Incidents are attributed to the innermost frame in this codebase, printed, and
+aggregated per call site for ``/api/debug/loop``. Debug mode slows the loop
+down, so diagnostics are off by default.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from metrics import LAG_BUCKETS, Histogram
+
+# How often the lag probe wakes up (seconds)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+LOOP_DIAGNOSTICS = os.getenv("LOOP_DIAGNOSTICS", "0") not in ("0", "false", "no")
+LOOP_SLOW_CALLBACK_SECONDS = float(os.getenv("LOOP_SLOW_CALLBACK_SECONDS", "0.1"))
+# Recent incidents kept for /api/debug/loop, and frames kept per captured stack
+MAX_INCIDENTS = 50
+STACK_DEPTH = 15
+
+_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# asyncio's report: "Executing <handle> took 0.312 seconds"
+_SLOW_CALLBACK = re.compile(r"Executing (.*) took ([\d.]+) seconds", re.DOTALL)
+# Where a task's coroutine is, in its repr: "coro=<api_summary() running at /path/web.py:215>"
+_RUNNING_AT = re.compile(r"coro=<(\S+?)\(\) running at (\S+?):(\d+)>")
+
+
+def _short(path: str) -> str:
+    return os.path.relpath(path, _SOURCE_DIR) if path.startswith(_SOURCE_DIR + os.sep) else path
+
+
+def _format_stack(frames: list[traceback.FrameSummary]) -> list[str]:
+    return [f"{_short(f.filename)}:{f.lineno} in {f.name}: {(f.line or '').strip()}" for f in frames]
+
+
+def _attribute(frames: list[traceback.FrameSummary]) -> tuple[str, str]:
+    """(call site in this codebase, innermost frame) of a captured stack."""
+    if not frames:
+        return "unknown", ""
+    innermost = frames[-1]
+    ours = [f for f in frames if f.filename.startswith(_SOURCE_DIR + os.sep) and f.filename != __file__]
+    site = ours[-1] if ours else innermost
+    return (
+        f"{_short(site.filename)}:{site.lineno} in {site.name}",
+        f"{_short(innermost.filename)}:{innermost.lineno} in {innermost.name}",
+    )
+
+
+@dataclass
+class Incident:
+    kind: str           # "stall" (sampled stack) or "slow_callback" (asyncio debug report)
+    site: str
+    seconds: float
+    at: float
+    detail: str = ""    # innermost frame of a stall, or the slow callback's repr
+    stack: list[str] = field(default_factory=list)
+
+
+@dataclass
+class CallSite:
+    kind: str
+    site: str
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    stack: list[str] = field(default_factory=list)     # latest captured
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Receives asyncio's debug-mode slow-callback warnings."""
+
+    def __init__(self, monitor: "LoopMonitor") -> None:
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if match := _SLOW_CALLBACK.match(record.getMessage()):
+            self.monitor._slow_callback(match[1], float(match[2]))
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL,
+        diagnostics: bool = LOOP_DIAGNOSTICS,
+        threshold: float = LOOP_SLOW_CALLBACK_SECONDS,
+    ) -> None:
+        self.interval = interval
+        self.diagnostics = diagnostics
+        self.threshold = threshold
+        self.last = 0.0
+        self.max = 0.0
+        self.histogram = Histogram(LAG_BUCKETS)
+        self.incidents: deque[Incident] = deque(maxlen=MAX_INCIDENTS)
+        self.sites: dict[tuple[str, str], CallSite] = {}
+        self.counts: dict[str, int] = {}
+        self._due = 0.0                 # when the probe should wake up (monotonic)
+        self._captured: tuple[float, list] | None = None   # (due, stack) from the sampler thread
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._handler: _SlowCallbackHandler | None = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._due = time.monotonic() + self.interval
+        self._task = loop.create_task(self._probe())
+        if not self.diagnostics:
+            return
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        self._handler = _SlowCallbackHandler(self)
+        logging.getLogger("asyncio").addHandler(self._handler)
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="loop-monitor", daemon=True
+        )
+        self._thread.start()
+        print(f"  Loop diagnostics on: reporting stalls and callbacks over {self.threshold * 1000:.0f}ms")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._stopping.set()
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        if self._handler is not None:
+            logging.getLogger("asyncio").removeHandler(self._handler)
+            self._handler = None
+
+    async def _probe(self) -> None:
+        while True:
+            self._due = due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(time.monotonic() - due, 0.0)
+            self.max = max(self.max, self.last)
+            self.histogram.observe(self.last)
+            captured, self._captured = self._captured, None
+            if captured is not None and captured[0] == due and self.last >= self.threshold:
+                self._stall(captured[1])
+
+    def _sample(self, loop_thread: int) -> None:
+        """Sampler thread: grab the loop thread's stack while the probe is overdue."""
+        captured_due = None
+        while not self._stopping.wait(self.threshold / 2):
+            due = self._due
+            if due == captured_due or time.monotonic() - due < self.threshold:
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            captured_due = due
+            self._captured = (due, traceback.extract_stack(frame)[-STACK_DEPTH:])
+
+    def _record(self, incident: Incident) -> None:
+        self.incidents.append(incident)
+        self.counts[incident.kind] = self.counts.get(incident.kind, 0) + 1
+        site = self.sites.setdefault((incident.kind, incident.site), CallSite(incident.kind, incident.site))
+        site.count += 1
+        site.total_seconds += incident.seconds
+        site.max_seconds = max(site.max_seconds, incident.seconds)
+        if incident.stack:
+            site.stack = incident.stack
+
+    def _stall(self, frames: list[traceback.FrameSummary]) -> None:
+        site, innermost = _attribute(frames)
+        print(f"  [loop] blocked {self.last * 1000:.0f}ms at {site} (in {innermost})")
+        self._record(Incident("stall", site, round(self.last, 4), time.time(), innermost, _format_stack(frames)))
+
+    def _slow_callback(self, handle: str, seconds: float) -> None:
+        match = _RUNNING_AT.search(handle)
+        site = f"{_short(match[2])}:{match[3]} in {match[1]}" if match else handle[:120]
+        print(f"  [loop] slow callback {seconds * 1000:.0f}ms: {site}")
+        self._record(Incident("slow_callback", site, seconds, time.time(), handle[:500]))
+
+    def snapshot(self) -> dict:
+        sites = sorted(self.sites.values(), key=lambda s: s.total_seconds, reverse=True)
+        return {
+            "diagnostics": self.diagnostics,
+            "threshold_ms": round(self.threshold * 1000),
+            "interval_ms": round(self.interval * 1000),
+            "lag_ms": {"last": round(self.last * 1000, 2), "max": round(self.max * 1000, 2)},
+            "counts": dict(self.counts),
+            "sites": [{**asdict(s), "total_seconds": round(s.total_seconds, 4)} for s in sites],
+            "incidents": [asdict(i) for i in reversed(self.incidents)],
+        }
+
+
+loop_monitor = LoopMonitor()
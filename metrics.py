@@ -0,0 +1,189 @@
+"""Prometheus metrics for the web server, folded from the pipeline's events.
+
+``PipelineMetrics.observe`` is an EventBus observer: stage durations,
+verification outcomes, per-model cost and tokens, tool calls, retries and
+timeouts are all derived from events ``run_stage``, ``_stage`` and
+``_verify_and_emit`` already emit. Gauges that describe the process right
+now (active runs, event-bus subscribers, rate-limiter queues, event-loop lag)
+are sampled at scrape time. ``render`` produces the text exposition format
+served at ``/metrics``.
+"""
+
+import os
+import time
+
+from events import EventBus
+from rate_limiter import limiter
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "tdd")
+
+STAGE_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+VERIFY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}     # label items → [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        counts, _, _ = series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def lines(self, name: str) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.series.items()):
+            labels = dict(key)
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(float(bound))})} {n}")
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return lines
+
+
+class PipelineMetrics:
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.stage_seconds = Histogram(STAGE_BUCKETS)
+        self.verify_seconds = Histogram(VERIFY_BUCKETS)
+        # Current run, as announced by its events
+        self._kind = ""
+        self._stage: tuple[str, str, float] | None = None    # (kind, model, started)
+        self._model = "default"
+        self._cost = 0.0
+        self._tokens = 0
+        self._outcome = ""
+
+    def _inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, event: dict) -> None:
+        """Fold one pipeline event into the metrics (an EventBus observer)."""
+        kind = event.get("type", "")
+        data = event.get("data") or {}
+        self._inc("events_total", type=kind)
+        if kind == "init":
+            self._cost, self._tokens, self._stage = 0.0, 0, None
+            self._inc("runs_started_total")
+        elif kind == "prompt_size":
+            self._kind = data.get("kind", "")
+        elif kind == "banner":
+            self._model = data.get("model") or "default"
+            self._stage = (self._kind or data.get("stage", ""), self._model, time.monotonic())
+            self._kind = ""
+        elif kind == "budget":
+            # Emitted once per pipeline stage with the run's running totals
+            cost, tokens = data.get("cost_usd", 0.0), data.get("tokens_used", 0)
+            self._inc("cost_usd_total", max(cost - self._cost, 0.0), model=self._model)
+            self._inc("tokens_total", max(tokens - self._tokens, 0), model=self._model)
+            self._cost, self._tokens = cost, tokens
+            if self._stage is not None:
+                stage_kind, model, started = self._stage
+                self.stage_seconds.observe(time.monotonic() - started, stage=stage_kind, model=model)
+                self._stage = None
+        elif kind == "result":
+            self._inc("agent_turns_total", data.get("turns") or 0, model=self._model)
+        elif kind == "tool":
+            self._inc("tool_calls_total", tool=data.get("tool", ""))
+        elif kind == "tool_error":
+            self._inc("tool_errors_total")
+        elif kind == "test_verify":
+            self._inc("verifications_total", outcome=data.get("outcome", ""))
+            if "duration_ms" in data:
+                self.verify_seconds.observe(data["duration_ms"] / 1000, outcome=data.get("outcome", ""))
+        elif kind == "retry":
+            self._inc("retries_total", kind=data.get("kind") or "other")
+        elif kind == "timeout":
+            self._inc("timeouts_total")
+        elif kind == "human_delivered":
+            self._inc("operator_messages_total", via=data.get("via", ""))
+        elif kind in ("stopped", "error"):
+            self._outcome = self._outcome or kind     # a failed stop summary is still a stop
+        elif kind == "done":
+            self._inc("runs_finished_total", outcome=self._outcome or "completed")
+            self._outcome = ""
+
+    def render(self, runs_active: int, bus: EventBus | None, loop) -> str:
+        """Prometheus text exposition of everything observed plus current gauges.
+
+        ``loop`` is the server's ``loop_monitor.LoopMonitor``.
+        """
+        p = METRICS_PREFIX
+        out: list[str] = []
+
+        def metric(name: str, kind: str, help_text: str, lines: list[str]) -> None:
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} {kind}")
+            out.extend(lines)
+
+        def counter(name: str, help_text: str) -> None:
+            series = self.counters.get(name, {})
+            metric(name, "counter", help_text, [
+                f"{p}_{name}{_labels(dict(key))} {value}" for key, value in sorted(series.items())
+            ])
+
+        metric("runs_active", "gauge", "Pipeline runs in progress", [f"{p}_runs_active {runs_active}"])
+        counter("runs_started_total", "Pipeline runs started")
+        counter("runs_finished_total", "Pipeline runs finished, by outcome (completed, stopped, error)")
+        queued = limiter.waiting()
+        metric("queries_queued", "gauge", "Model queries waiting on the rate limiter, by model", [
+            f"{p}_queries_queued{_labels({'model': model})} {n}" for model, n in sorted(queued.items())
+        ])
+        metric("stage_duration_seconds", "histogram", "Wall time of pipeline stages, by stage kind and model",
+               self.stage_seconds.lines(f"{p}_stage_duration_seconds"))
+        metric("verification_duration_seconds", "histogram", "Independent test verification time, by outcome",
+               self.verify_seconds.lines(f"{p}_verification_duration_seconds"))
+        counter("verifications_total", "Independent test verifications, by outcome")
+        counter("cost_usd_total", "Model cost in USD, by model")
+        counter("tokens_total", "Input, cache-write and output tokens, by model")
+        counter("agent_turns_total", "Agent turns, by model")
+        counter("tool_calls_total", "Agent tool calls, by tool")
+        counter("tool_errors_total", "Agent tool calls that returned an error")
+        counter("retries_total", "Transient model API errors retried, by kind (rate_limit, overloaded, timeout, connection, 5xx, other)")
+        counter("timeouts_total", "Stages, tool calls and verifications cut short by a deadline")
+        counter("operator_messages_total", "Operator messages delivered, by delivery path")
+        counter("events_total", "Pipeline events emitted, by type")
+
+        stats = bus.stats() if bus is not None else {"subscribers": 0, "queued": []}
+        metric("eventbus_subscribers", "gauge", "SSE and internal subscribers of the current run's event bus",
+               [f"{p}_eventbus_subscribers {stats['subscribers']}"])
+        metric("eventbus_queue_depth_max", "gauge", "Deepest subscriber queue of the current run's event bus",
+               [f"{p}_eventbus_queue_depth_max {max(stats['queued'], default=0)}"])
+        metric("eventbus_queue_depth_total", "gauge", "Events waiting across all subscriber queues",
+               [f"{p}_eventbus_queue_depth_total {sum(stats['queued'])}"])
+
+        metric("event_loop_lag_seconds", "gauge", "Latest event-loop lag sample",
+               [f"{p}_event_loop_lag_seconds {loop.last:.6f}"])
+        metric("event_loop_lag_max_seconds", "gauge", "Largest event-loop lag seen",
+               [f"{p}_event_loop_lag_max_seconds {loop.max:.6f}"])
+        metric("event_loop_lag_histogram_seconds", "histogram", "Event-loop lag samples",
+               loop.histogram.lines(f"{p}_event_loop_lag_histogram_seconds"))
+        metric("event_loop_blocked_total", "counter",
+               "Loop stalls and slow callbacks caught by loop diagnostics, by kind",
+               [f"{p}_event_loop_blocked_total{_labels({'kind': k})} {n}" for k, n in sorted(loop.counts.items())])
+        metric("process_start_time_seconds", "gauge", "Server start time (Unix seconds)",
+               [f"{p}_process_start_time_seconds {self.started:.0f}"])
+        return "\n".join(out) + "\n"
+
+
+metrics = PipelineMetrics()
@@ -0,0 +1,235 @@
+"""Per-stage model routing with escalation (opt-in: MODEL_ROUTING=1).
+
+Stages that usually succeed (RED, REFACTOR, REPORT, GIT_COMMIT) start on the
+cheapest tier; the rest start one tier up. A stage kind moves up a tier each
+time its gate fails or its verdict is missing, and drops back once it succeeds.
+Success rates per project are kept in ``.git/tdd_routing.json``, and a tier
+whose rate for a stage kind falls below ``ROUTER_MIN_SUCCESS`` is skipped in
+later runs. Every ``ROUTER_RETRY_EVERY``-th time a tier is skipped it is tried
+again with its record cleared, so a tier that failed on an early, harder
+change can win its stage kind back. ``choose`` has no side effects; skips are
+counted when the stage is recorded.
+
+Every decision and outcome is appended to ``.git/tdd_routing.jsonl``. Run
+``python model_router.py <target>`` for per-stage success, cost and latency.
+
+Explicit model env vars (PIPELINE_MODEL, QA_MODEL, SECURITY_MODEL,
+REPORT_MODEL) pin their stages and bypass routing.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "0") not in ("0", "false", "no")
+# Cheapest → strongest
+ROUTER_TIERS = [m.strip() for m in os.getenv("ROUTER_TIERS", "haiku,sonnet,opus").split(",") if m.strip()]
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "3"))
+ROUTER_MIN_SUCCESS = float(os.getenv("ROUTER_MIN_SUCCESS", "0.6"))
+# Re-try a skipped tier after this many skips (0 = never)
+ROUTER_RETRY_EVERY = int(os.getenv("ROUTER_RETRY_EVERY", "10"))
+
+STATS_FILENAME = "tdd_routing.json"
+LOG_FILENAME = "tdd_routing.jsonl"
+
+# Stage kinds that start on the cheapest tier
+_CHEAP_STAGES = {"RED", "REFACTOR", "REPORT", "GIT_COMMIT"}
+# Env vars that pin a stage kind's model (only when explicitly set)
+_PIN_ENV = {
+    "QA": "QA_MODEL",
+    "SECURITY_REVIEW": "SECURITY_MODEL",
+    "REPORT": "REPORT_MODEL",
+    "GIT_COMMIT": "REPORT_MODEL",
+}
+
+
+def _pinned(kind: str) -> str | None:
+    return os.getenv(_PIN_ENV.get(kind, "PIPELINE_MODEL")) or None
+
+
+def _write(path: str, text: str, mode: str) -> None:
+    try:
+        with open(path, mode) as f:
+            f.write(text)
+    except OSError:
+        pass
+
+
+class ModelRouter:
+    """Chooses a model per stage kind and records how that choice turned out."""
+
+    def __init__(self, target: str, enabled: bool = MODEL_ROUTING) -> None:
+        self.target = target
+        self.enabled = enabled and bool(ROUTER_TIERS)
+        git_dir = os.path.join(target, ".git")
+        self._stats_path = os.path.join(git_dir, STATS_FILENAME) if os.path.isdir(git_dir) else None
+        self._log_path = os.path.join(git_dir, LOG_FILENAME) if os.path.isdir(git_dir) else None
+        # kind → model → [attempts, successes, skips since last tried]
+        self._stats: dict[str, dict[str, list[int]]] = self._load_stats()
+        self._escalation: dict[str, int] = defaultdict(int)
+        self._last: dict[str, dict] = {}    # kind → latest decision awaiting an outcome
+        self._seq = 0
+
+    def _load_stats(self) -> dict[str, dict[str, list[int]]]:
+        if not self._stats_path or not os.path.exists(self._stats_path):
+            return {}
+        try:
+            with open(self._stats_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    async def _save_stats(self) -> None:
+        if self._stats_path:
+            await asyncio.to_thread(_write, self._stats_path, json.dumps(self._stats, indent=2), "w")
+
+    async def _append_log(self, entry: dict) -> None:
+        if self._log_path:
+            await asyncio.to_thread(_write, self._log_path, json.dumps(entry) + "\n", "a")
+
+    def _base_tier(self, kind: str) -> tuple[int, list[str], bool]:
+        """(starting tier, tiers skipped to get there, whether that tier is being re-tried)."""
+        tier = 0 if kind in _CHEAP_STAGES else min(1, len(ROUTER_TIERS) - 1)
+        # Skip tiers this project has shown it can't rely on for this stage kind
+        stats = self._stats.get(kind, {})
+        skipped: list[str] = []
+        while tier < len(ROUTER_TIERS) - 1:
+            model = ROUTER_TIERS[tier]
+            attempts, successes, *rest = stats.get(model, [0, 0])
+            if attempts < ROUTER_MIN_SAMPLES or successes / attempts >= ROUTER_MIN_SUCCESS:
+                return tier, skipped, False
+            if ROUTER_RETRY_EVERY and (rest[0] if rest else 0) + 1 >= ROUTER_RETRY_EVERY:
+                return tier, skipped, True
+            skipped.append(model)
+            tier += 1
+        return tier, skipped, False
+
+    def choose(self, kind: str) -> str | None:
+        """Model for the next ``kind`` stage; None leaves the session's model unchanged."""
+        if not self.enabled:
+            return None
+        pinned = _pinned(kind)
+        if pinned:
+            return pinned
+        tier = min(self._base_tier(kind)[0] + self._escalation[kind], len(ROUTER_TIERS) - 1)
+        return ROUTER_TIERS[tier]
+
+    def is_escalated(self, kind: str) -> bool:
+        return self._escalation[kind] > 0
+
+    async def record(
+        self,
+        kind: str,
+        stage: str,
+        model: str | None,
+        cost_usd: float,
+        tokens: int,
+        duration_ms: int,
+    ) -> None:
+        """Log a routed stage and count the tiers it skipped; the outcome comes via ``outcome``."""
+        if not self.enabled or model is None:
+            return
+        pinned = _pinned(kind) is not None
+        retry = False
+        if not pinned:
+            tier, skipped, retry = self._base_tier(kind)
+            retry = retry and model == ROUTER_TIERS[tier]
+            for name in skipped:
+                counts = self._stats.setdefault(kind, {}).setdefault(name, [0, 0, 0])
+                counts[2:] = [(counts[2] if len(counts) > 2 else 0) + 1]
+            if skipped:
+                await self._save_stats()
+        self._seq += 1
+        decision = {
+            "seq": self._seq,
+            "ts": time.time(),
+            "event": "decision",
+            "kind": kind,
+            "stage": stage,
+            "model": model,
+            "escalation": self._escalation[kind],
+            "pinned": pinned,
+            "retry": retry,
+            "cost_usd": round(cost_usd, 6),
+            "tokens": tokens,
+            "duration_ms": duration_ms,
+        }
+        self._last[kind] = decision
+        await self._append_log(decision)
+
+    async def outcome(self, kind: str, success: bool) -> None:
+        """Attach a gate/verdict outcome to the latest ``kind`` decision and adapt."""
+        decision = self._last.pop(kind, None)
+        if decision is None:
+            return
+        if success:
+            self._escalation[kind] = 0
+        else:
+            self._escalation[kind] += 1
+        if not decision["pinned"]:
+            if decision["retry"]:
+                # A re-tried tier starts its record over; the usual sample rule decides it again
+                self._stats.setdefault(kind, {})[decision["model"]] = [0, 0, 0]
+            counts = self._stats.setdefault(kind, {}).setdefault(decision["model"], [0, 0, 0])
+            counts[0] += 1
+            counts[1] += int(success)
+            await self._save_stats()
+        await self._append_log({"seq": decision["seq"], "ts": time.time(), "event": "outcome",
+                                "kind": kind, "model": decision["model"], "success": success})
+
+
+def summarize_log(target: str) -> list[dict]:
+    """Per (stage kind, model): decisions, success rate, mean cost and duration."""
+    path = os.path.join(target, ".git", LOG_FILENAME)
+    decisions: dict[int, dict] = {}
+    runs: list[dict] = []
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["event"] == "decision":
+                if entry["seq"] == 1:
+                    decisions = {}
+                decisions[entry["seq"]] = entry
+                runs.append(entry)
+            elif entry["seq"] in decisions:
+                decisions[entry["seq"]]["success"] = entry["success"]
+
+    groups: dict[tuple[str, str], list[dict]] = defaultdict(list)
+    for entry in runs:
+        groups[(entry["kind"], entry["model"])].append(entry)
+    rows = []
+    for (kind, model), entries in sorted(groups.items()):
+        judged = [e["success"] for e in entries if "success" in e]
+        rows.append({
+            "kind": kind,
+            "model": model,
+            "stages": len(entries),
+            "success_rate": sum(judged) / len(judged) if judged else None,
+            "mean_cost_usd": sum(e["cost_usd"] for e in entries) / len(entries),
+            "mean_duration_ms": sum(e["duration_ms"] for e in entries) / len(entries),
+        })
+    return rows
+
+
+def main() -> int:
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+    try:
+        rows = summarize_log(target)
+    except FileNotFoundError:
+        print(f"No routing log under {target}/.git")
+        return 1
+    print(f"{'stage':<16} {'model':<10} {'n':>4} {'success':>8} {'cost $':>9} {'secs':>7}")
+    for row in rows:
+        rate = f"{row['success_rate']:.0%}" if row["success_rate"] is not None else "-"
+        print(
+            f"{row['kind']:<16} {row['model']:<10} {row['stages']:>4} {rate:>8} "
+            f"{row['mean_cost_usd']:>9.4f} {row['mean_duration_ms'] / 1000:>7.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
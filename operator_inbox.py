@@ -0,0 +1,86 @@
+"""Operator messages for the running pipeline.
+
+Messages sent from the UI are delivered in one of two modes:
+
+- ``interrupt``: the in-flight agent turn is interrupted through the SDK
+  client and the stage is immediately re-queried with the message. With no
+  turn in flight, the message rides along with the stage's next query.
+- ``queue``: the message waits for the agent's next tool call, which is
+  denied with the message as the reason (see ``human_input_hook``), or for
+  the next query, whichever comes first.
+
+Each delivery is timed from the moment the message was received.
+"""
+
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from claude_agent_sdk import ClaudeSDKClient
+
+OPERATOR_MESSAGE_MODE = os.getenv("OPERATOR_MESSAGE_MODE", "interrupt")
+MESSAGE_MODES = ("interrupt", "queue")
+
+
+@dataclass
+class OperatorMessage:
+    text: str
+    mode: str
+    received_at: float = field(default_factory=time.monotonic)
+
+    def latency_ms(self) -> int:
+        return int((time.monotonic() - self.received_at) * 1000)
+
+
+class OperatorInbox:
+    def __init__(self) -> None:
+        self._urgent: deque[OperatorMessage] = deque()
+        self._queued: deque[OperatorMessage] = deque()
+        self._client: ClaudeSDKClient | None = None     # client with a turn in flight
+        self._interrupted = False
+
+    async def submit(self, text: str, mode: str = OPERATOR_MESSAGE_MODE) -> OperatorMessage:
+        message = OperatorMessage(text, mode)
+        if mode != "interrupt":
+            self._queued.append(message)
+            return message
+        self._urgent.append(message)
+        if self._client is not None and not self._interrupted:
+            self._interrupted = True
+            await self._client.interrupt()
+        return message
+
+    def clear(self) -> None:
+        self._urgent.clear()
+        self._queued.clear()
+
+    # ── Stage side ──
+
+    def attach(self, client: ClaudeSDKClient) -> None:
+        """Mark ``client`` as running a turn that interrupt messages may cut short."""
+        self._client = client
+        self._interrupted = False
+
+    def detach(self) -> None:
+        self._client = None
+        self._interrupted = False
+
+    def take_urgent(self) -> list[OperatorMessage]:
+        messages = list(self._urgent)
+        self._urgent.clear()
+        return messages
+
+    def take_all(self) -> list[OperatorMessage]:
+        """Every undelivered message, urgent first (for the next query)."""
+        messages = self.take_urgent() + list(self._queued)
+        self._queued.clear()
+        return messages
+
+    @staticmethod
+    def render(messages: list[OperatorMessage]) -> str:
+        return "\n\n".join(m.text for m in messages)
+
+    def take_queued(self) -> OperatorMessage | None:
+        """Next queued message, for a tool-call hook (urgent ones follow their interrupt)."""
+        return self._queued.popleft() if self._queued else None
@@ -1,42 +1,88 @@
-"""Plan optimizer: generates clarifying questions from a vague ticket, then rewrites it."""
+"""Plan optimizer: generates clarifying questions from a vague ticket, then rewrites it.
 
+Questions can be streamed: ``stream_questions`` yields scan progress and each
+question as soon as its JSON object is complete in the agent's output.
+
+The ticket-independent part of the work — surveying the target codebase — is
+cached per (target, tree hash), and question sets per normalised ticket, so a
+repeat optimize on an unchanged repo doesn't re-scan it. Concurrent requests
+for the same survey or question set share one query.
+"""
+
+import asyncio
 import json
 import os
 import re
+from typing import AsyncIterator
 
 from claude_agent_sdk import (
     AssistantMessage,
     ClaudeAgentOptions,
+    ResultMessage,
+    StreamEvent,
     TextBlock,
-    query,
+    ToolUseBlock,
 )
 
-_PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
-OPTIMIZER_MODEL = os.getenv("OPTIMIZER_MODEL", "sonnet") or None
+from client_pool import shared_pool
+from context_budget import estimate_tokens
+from prompt_registry import load_prompt
+from rate_limiter import PRIORITY_OPTIMIZER, limiter
+from repo_map import build_repo_map, repo_map_context
+from response_cache import cache_key, response_cache
 
+OPTIMIZER_MODEL = os.getenv("OPTIMIZER_MODEL", "sonnet") or None
 
-def _load_prompt(name: str, **kwargs: str) -> str:
-    path = os.path.join(_PROMPTS_DIR, f"{name}.md")
-    with open(path) as f:
-        template = f.read()
-    return template.format(**kwargs) if kwargs else template
+# Cache key → query in progress, shared by concurrent identical requests
+_inflight: dict[str, "_Flight"] = {}
 
 
-async def _run_query(prompt: str, target: str, scan_codebase: bool = True) -> str:
-    """Run a one-shot read-only query and return collected text."""
-    options = ClaudeAgentOptions(
+def _options(target: str, scan_codebase: bool) -> ClaudeAgentOptions:
+    return ClaudeAgentOptions(
         allowed_tools=["Read", "Glob", "Grep"] if scan_codebase else [],
         permission_mode="bypassPermissions",
         model=OPTIMIZER_MODEL,
         cwd=target if scan_codebase else None,
         max_turns=20,
+        include_partial_messages=True,     # text deltas for stream_questions
     )
+
+
+async def _run_query(prompt: str, target: str, scan_codebase: bool = True, on_event=None) -> str:
+    """Run a one-shot read-only query and return collected text.
+
+    ``on_event(kind, value)`` is awaited with ("text", delta) as the answer
+    streams in and ("tool", summary) for each file the agent looks at.
+    """
     collected: list[str] = []
-    async for message in query(prompt=prompt, options=options):
-        if isinstance(message, AssistantMessage):
-            for block in message.content:
-                if isinstance(block, TextBlock):
-                    collected.append(block.text)
+    estimate = estimate_tokens(prompt)
+    requests = limiter.expected_requests(OPTIMIZER_MODEL)
+    async with shared_pool.session(_options(target, scan_codebase), "OPTIMIZE") as client:
+        # Lowest priority: pipeline stages waiting on the same model go first
+        taken_requests, taken_tokens = await limiter.acquire(
+            OPTIMIZER_MODEL, estimate, PRIORITY_OPTIMIZER, requests=requests
+        )
+        await client.query(prompt)
+        async for message in client.receive_response():
+            if isinstance(message, StreamEvent):
+                delta = message.event.get("delta") or {}
+                if on_event is not None and delta.get("type") == "text_delta":
+                    await on_event("text", delta.get("text", ""))
+            elif isinstance(message, AssistantMessage):
+                for block in message.content:
+                    if isinstance(block, TextBlock):
+                        collected.append(block.text)
+                    elif isinstance(block, ToolUseBlock) and on_event is not None:
+                        await on_event("tool", _tool_summary(block))
+            elif isinstance(message, ResultMessage):
+                usage = message.usage or {}
+                tokens = sum(
+                    usage.get(key) or 0
+                    for key in ("input_tokens", "cache_creation_input_tokens", "output_tokens")
+                )
+                turns = max(message.num_turns or 1, 1)
+                limiter.record_turns(OPTIMIZER_MODEL, turns)
+                await asyncio.to_thread(limiter.settle, OPTIMIZER_MODEL, turns - taken_requests, tokens - taken_tokens)
     return "\n".join(collected)
 
 
@@ -71,12 +117,217 @@ def _extract_json(text: str) -> dict:
     raise ValueError(f"Could not extract JSON from agent response: {stripped[:200]}")
 
 
+class _Flight:
+    """One query in progress; its events are replayed to every caller that joins it."""
+
+    def __init__(self) -> None:
+        self.events: list[tuple[str, dict]] = []
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def emit(self, event: str, data: dict) -> None:
+        self.events.append((event, data))
+        self._changed.set()
+
+    async def follow(self) -> AsyncIterator[tuple[str, dict]]:
+        """Yield every event from the start until the query finishes."""
+        seen = 0
+        while True:
+            while seen < len(self.events):
+                yield self.events[seen]
+                seen += 1
+            if self.task.done():
+                return
+            self._changed.clear()
+            changed = asyncio.ensure_future(self._changed.wait())
+            try:
+                await asyncio.wait({self.task, changed}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+
+    async def result(self) -> str:
+        # Shielded: one caller disconnecting doesn't cancel the query for the others
+        return await asyncio.shield(self.task)
+
+
+def _join(key: str, factory) -> _Flight:
+    """Flight for ``key``, starting ``factory(emit)`` unless an identical query is running."""
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = _Flight()
+        flight.task = asyncio.ensure_future(factory(flight.emit))
+        _inflight[key] = flight
+
+        def finished(task: asyncio.Task) -> None:
+            _inflight.pop(key, None)
+            if not task.cancelled():
+                task.exception()    # callers that went away never retrieve it
+
+        flight.task.add_done_callback(finished)
+    return flight
+
+
+class _QuestionStream:
+    """Pulls ``context`` and each complete question out of a partial JSON response."""
+
+    _CONTEXT = re.compile(r'"context"\s*:\s*')
+    _QUESTIONS = re.compile(r'"questions"\s*:\s*\[')
+    _SEPARATOR = re.compile(r"[\s,]*")
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.context: str | None = None
+        self.questions: list[dict] = []
+        self._next: int | None = None      # where the next question may start
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> list[tuple[str, dict]]:
+        self.text += chunk
+        events = []
+        if self.context is None and (match := self._CONTEXT.search(self.text)):
+            try:
+                value, _ = self._decoder.raw_decode(self.text, match.end())
+            except ValueError:      # string not finished yet
+                value = None
+            if isinstance(value, str):
+                self.context = value
+                events.append(("context", {"context": value}))
+        if self._next is None and (match := self._QUESTIONS.search(self.text)):
+            self._next = match.end()
+        while self._next is not None:
+            start = self._SEPARATOR.match(self.text, self._next).end()
+            if not self.text.startswith("{", start):
+                break
+            try:
+                question, self._next = self._decoder.raw_decode(self.text, start)
+            except ValueError:
+                break
+            self.questions.append(question)
+            events.append(("question", question))
+        return events
+
+
+def _normalize_ticket(ticket: str) -> str:
+    return " ".join(ticket.lower().split())
+
+
+def _tool_summary(block: ToolUseBlock) -> str:
+    params = block.input or {}
+    detail = next((str(params[k]) for k in ("file_path", "pattern", "path") if params.get(k)), "")
+    return f"{block.name} {detail}".strip()
+
+
+async def _survey_events(target: str, repo_map) -> AsyncIterator[tuple[str, dict]]:
+    """Progress events of the codebase survey, then ("survey", {"text": ...})."""
+    prompt = load_prompt("optimize_survey", repo_map=repo_map_context(target, repo_map))
+    key = cache_key("SURVEY", prompt, OPTIMIZER_MODEL, repo_map.tree_hash)
+    survey = await asyncio.to_thread(response_cache.get, key)
+    if survey is not None:
+        yield "progress", {"phase": "survey", "message": "Using cached codebase survey"}
+        yield "survey", {"text": survey}
+        return
+
+    async def query(emit) -> str:
+        async def on_event(kind: str, value: str) -> None:
+            if kind == "tool":
+                emit("progress", {"phase": "survey", "message": value})
+
+        text = await _run_query(prompt, target, on_event=on_event)
+        await asyncio.to_thread(response_cache.put, key, text, "SURVEY")
+        return text
+
+    yield "progress", {"phase": "survey", "message": "Surveying codebase"}
+    flight = _join(key, query)
+    async for event in flight.follow():
+        yield event
+    yield "survey", {"text": await flight.result()}
+
+
+async def codebase_context(target: str, repo_map) -> str:
+    """Ticket-independent survey of the codebase, cached per tree hash."""
+    async for event, data in _survey_events(target, repo_map):
+        if event == "survey":
+            return data["text"]
+    raise RuntimeError("codebase survey produced no result")
+
+
+async def stream_questions(
+    ticket: str, target: str, scan_codebase: bool = True
+) -> AsyncIterator[tuple[str, dict]]:
+    """Yield (event, data) as questions are produced for a vague ticket.
+
+    Events: ``progress`` (scan activity), ``context``, one ``question`` per
+    question as soon as its JSON object is complete, then ``done`` with the
+    full {context, questions} result.
+    """
+    prompt_name = "optimize_questions" if scan_codebase else "optimize_questions_no_codebase"
+    repo_map = await asyncio.to_thread(build_repo_map, target) if scan_codebase else None
+    tree_hash = repo_map.tree_hash if repo_map else ""
+    # Keyed on the ticket and template, not the survey: a hit needs no survey at all
+    blocks = {"codebase_context": "", "repo_map": ""} if scan_codebase else {}
+    keyed = load_prompt(prompt_name, ticket=_normalize_ticket(ticket), **blocks)
+    key = cache_key("QUESTIONS", keyed, OPTIMIZER_MODEL, tree_hash)
+
+    raw = await asyncio.to_thread(response_cache.get, key)
+    streamed = {"context": False, "question": 0}
+    if raw is None:
+        if scan_codebase:
+            async for event, data in _survey_events(target, repo_map):
+                if event == "survey":
+                    survey = data["text"]
+                else:
+                    yield event, data
+            prompt = load_prompt(
+                prompt_name, ticket=ticket, codebase_context=survey,
+                repo_map=repo_map_context(target, repo_map),
+            )
+        else:
+            prompt = load_prompt(prompt_name, ticket=ticket)
+
+        async def query(emit) -> str:
+            parser = _QuestionStream()
+
+            async def on_event(kind: str, value: str) -> None:
+                if kind == "text":
+                    for event in parser.feed(value):
+                        emit(*event)
+                else:
+                    emit("progress", {"phase": "questions", "message": value})
+
+            text = await _run_query(prompt, target, scan_codebase=scan_codebase, on_event=on_event)
+            _extract_json(text)     # only cache responses that parse
+            await asyncio.to_thread(response_cache.put, key, text, "QUESTIONS")
+            return text
+
+        yield "progress", {"phase": "questions", "message": "Drafting questions"}
+        flight = _join(key, query)
+        async for event, data in flight.follow():
+            if event == "context":
+                streamed["context"] = True
+            elif event == "question":
+                streamed["question"] += 1
+            yield event, data
+        raw = await flight.result()
+    else:
+        yield "progress", {"phase": "questions", "message": "Using cached questions"}
+
+    result = _extract_json(raw)
+    # Whatever the incremental parser missed (e.g. a fenced or reformatted reply)
+    if not streamed["context"] and result.get("context"):
+        yield "context", {"context": result["context"]}
+    for question in (result.get("questions") or [])[streamed["question"]:]:
+        yield "question", question
+    # The rewrite follows once the user has answered — connect its session now
+    shared_pool.warm(_options(target, os.path.isdir(target)))
+    yield "done", result
+
+
 async def generate_questions(ticket: str, target: str, scan_codebase: bool = True) -> dict:
     """Analyze codebase (if present) and return {context, questions} for a vague ticket."""
-    prompt_name = "optimize_questions" if scan_codebase else "optimize_questions_no_codebase"
-    prompt = _load_prompt(prompt_name, ticket=ticket)
-    raw = await _run_query(prompt, target, scan_codebase=scan_codebase)
-    return _extract_json(raw)
+    async for event, data in stream_questions(ticket, target, scan_codebase):
+        if event == "done":
+            return data
+    raise RuntimeError("optimizer produced no questions")
 
 
 async def rewrite_ticket(
@@ -86,7 +337,7 @@ async def rewrite_ticket(
     answers_text = "\n".join(
         f"Q: {a['question']}\nA: {a['answer']}" for a in answers
     )
-    prompt = _load_prompt(
+    prompt = load_prompt(
         "optimize_rewrite", ticket=ticket, context=context, answers=answers_text
     )
     return await _run_query(prompt, target, scan_codebase=os.path.isdir(target))
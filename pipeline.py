@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass
 
 from claude_agent_sdk import (
@@ -11,13 +12,33 @@ from claude_agent_sdk import (
     UserMessage,
 )
 
+from context_budget import estimate_tokens
 from events import EventBus
+from operator_inbox import OperatorInbox, OperatorMessage
+from prompt_registry import load_prompt, stable_prefix_chars
+from rate_limiter import PRIORITY_STAGE, limiter
+from resilience import (
+    RETRY_MAX_ATTEMPTS,
+    TRANSIENT_MESSAGE_ERRORS,
+    TransientLLMError,
+    backoff_delay,
+    breaker,
+    transient_result_error,
+)
+from stage_watchdog import StageWatchdog
+from tracing import Span, end_span, span, start_span
 
 
 @dataclass
 class StageResult:
     text: str
     session_id: str | None = None
+    cost_usd: float = 0.0       # running total for the client session (ResultMessage.total_cost_usd)
+    tokens: int = 0             # this query's input + cache writes + output tokens
+    duration_ms: int = 0
+    num_turns: int = 0
+    prompt_chars: int = 0
+    timed_out: str | None = None    # why the watchdog cut the stage short
 
 
 def print_banner(stage: str, description: str, event_bus: EventBus | None = None) -> None:
@@ -33,18 +54,236 @@ async def run_stage(
     description: str,
     prompt: str,
     event_bus: EventBus | None = None,
+    model: str | None = None,
+    priority: int = PRIORITY_STAGE,
+    inbox: OperatorInbox | None = None,
+    deadline: float | None = None,
+    max_turns: int | None = None,
 ) -> StageResult:
-    """Send a prompt to the agent session, collect and return text output."""
+    """Send a prompt to the agent session, collect and return text output.
+
+    Each query waits for the shared rate limiter (keyed by ``model``, served
+    by ``priority``). Transient API failures are retried on the same session
+    with backoff (see ``resilience``); the last one is re-raised as
+    TransientLLMError. Operator messages from ``inbox`` are appended to the
+    next query, or interrupt the turn in flight and are sent right after it.
+    A watchdog interrupts the stage after ``deadline`` seconds (or a tool call
+    past its own deadline, or after ``max_turns`` model turns); the partial
+    result comes back with ``timed_out``.
+    """
     print_banner(stage, description)
     if event_bus:
-        await event_bus.emit({"type": "banner", "data": {"stage": stage, "description": description}})
+        await event_bus.emit({"type": "banner", "data": {"stage": stage, "description": description, "model": model}})
+
+    stable = stable_prefix_chars(prompt)
+    print(f"  [{stage}] prompt: {len(prompt)} chars ({stable} stable prefix, {len(prompt) - stable} run context)")
+
+    with span("stage", stage=stage, model=model, priority=priority) as stage_span:
+        result = await _run_attempts(client, stage, prompt, event_bus, model, priority, inbox, deadline, max_turns)
+        if stage_span is not None:
+            stage_span.set(
+                turns=result.num_turns, tokens=result.tokens, cost_usd=result.cost_usd,
+                prompt_chars=result.prompt_chars, timed_out=result.timed_out,
+            )
+        return result
+
+
+async def _run_attempts(
+    client: ClaudeSDKClient,
+    stage: str,
+    prompt: str,
+    event_bus: EventBus | None,
+    model: str | None,
+    priority: int,
+    inbox: OperatorInbox | None,
+    deadline: float | None,
+    max_turns: int | None,
+) -> StageResult:
+    """run_stage's query loop: retries, operator-message re-queries and the watchdog."""
+
+    async def on_breaker_wait(snapshot: dict) -> None:
+        print(f"  [{stage}] circuit breaker open — waiting {snapshot['retry_in']}s")
+        if event_bus:
+            await event_bus.emit({"type": "breaker", "data": {"stage": stage, **snapshot}})
+
+    async def on_rate_wait(seconds: float) -> None:
+        print(f"  [{stage}] rate limit for {model or 'default'} — waiting ~{seconds:.1f}s")
+        if event_bus:
+            await event_bus.emit({
+                "type": "rate_limit",
+                "data": {"stage": stage, "model": model, "wait_seconds": round(seconds, 1), "priority": priority},
+            })
+
+    async def admit(estimate: int, requests: int) -> tuple[bool, tuple[float, float]]:
+        """Wait for the breaker and the rate limiter.
+
+        Returns whether this query is the breaker's probe, and the requests
+        and tokens the limiter took for it.
+        """
+        probe = await breaker.wait(on_breaker_wait)
+        try:
+            taken = await limiter.acquire(model, estimate, priority, on_rate_wait, requests)
+        except BaseException:
+            if probe:
+                breaker.abandon()
+            raise
+        return probe, taken
+
+    async with StageWatchdog(client, stage, deadline, event_bus, max_turns) as watchdog:
+        spent = StageResult(text="")     # usage and output of failed or interrupted attempts, added to the final result
+        query = prompt
+        attempt = 0
+        while True:
+            attempt += 1
+            if inbox is not None and (pending := inbox.take_all()):
+                query += "\n\n" + load_prompt("operator_message", operator_messages=inbox.render(pending))
+                await _delivered(pending, "query", stage, event_bus)
+            estimate = estimate_tokens(query)
+            requests = limiter.expected_requests(model)
+            with span("wait", model=model, attempt=attempt):
+                admitted = await watchdog.between_turns(admit(estimate, requests))
+            if admitted is None:
+                # The deadline passed before the query could be sent
+                spent.timed_out = watchdog.expired
+                spent.prompt_chars = len(prompt)
+                return spent
+            probe, taken = admitted
+            try:
+                result = await _query_once(client, stage, query, event_bus, inbox, watchdog)
+            except TransientLLMError as exc:
+                await _settle(model, exc.partial, taken)
+                opened = breaker.record_failure()
+                _add_usage(spent, exc.partial)
+                _add_text(spent, exc.partial)
+                if opened and event_bus:
+                    await event_bus.emit({"type": "breaker", "data": {"stage": stage, **breaker.snapshot()}})
+                if attempt == RETRY_MAX_ATTEMPTS:
+                    raise
+                wait = backoff_delay(attempt)
+                print(f"  [{stage}] transient API error ({exc.reason}) — retry {attempt} in {wait:.1f}s")
+                if event_bus:
+                    await event_bus.emit({
+                        "type": "retry",
+                        "data": {"stage": stage, "attempt": attempt, "max_attempts": RETRY_MAX_ATTEMPTS,
+                                 "wait_seconds": round(wait, 1), "reason": exc.reason, "status": exc.status,
+                                 "kind": exc.kind},
+                    })
+                await watchdog.between_turns(asyncio.sleep(wait))
+                if watchdog.expired:
+                    # Out of time: hand back what the stage produced instead of retrying
+                    spent.timed_out = watchdog.expired
+                    spent.prompt_chars = len(prompt)
+                    return spent
+                # The session already holds the prompt and the partial work: ask it to carry on
+                query = load_prompt("stage_retry", reason=exc.reason)
+                continue
+            except BaseException:
+                if probe:
+                    breaker.abandon()
+                raise
+            await _settle(model, result, taken)
+            if breaker.record_success() and event_bus:
+                await event_bus.emit({"type": "breaker", "data": {"stage": stage, **breaker.snapshot()}})
+            # A timed-out stage ends here; pending operator messages go with the next stage
+            urgent = inbox.take_urgent() if inbox is not None and not watchdog.expired else []
+            if urgent:
+                # The turn was interrupted (or had just ended): keep its output, send the messages now
+                _add_usage(spent, result)
+                _add_text(spent, result)
+                query = load_prompt("operator_message", operator_messages=inbox.render(urgent))
+                await _delivered(urgent, "interrupt", stage, event_bus)
+                attempt = 0
+                continue
+            _add_usage(result, spent)
+            # Output of interrupted or retried turns comes first, in the order it was produced
+            result.text = "\n".join(t for t in (spent.text, result.text) if t)
+            result.prompt_chars = len(prompt)
+            result.timed_out = watchdog.expired
+            return result
+
+
+def _add_usage(total: StageResult, part: StageResult) -> None:
+    total.tokens += part.tokens
+    total.duration_ms += part.duration_ms
+    total.num_turns += part.num_turns
 
+
+def _add_text(total: StageResult, part: StageResult) -> None:
+    total.text = "\n".join(t for t in (total.text, part.text) if t)
+
+
+async def _delivered(
+    messages: list[OperatorMessage], via: str, stage: str, event_bus: EventBus | None
+) -> None:
+    """Report how long each operator message took to reach the agent."""
+    for message in messages:
+        latency_ms = message.latency_ms()
+        print(f"  [{stage}] operator message delivered via {via} after {latency_ms}ms")
+        if event_bus:
+            await event_bus.emit({
+                "type": "human_delivered",
+                "data": {"stage": stage, "mode": message.mode, "via": via, "latency_ms": latency_ms},
+            })
+
+
+async def _settle(model: str | None, result: StageResult, taken: tuple[float, float]) -> None:
+    """Charge the rate limiter for the turns and tokens a query used beyond what admission took."""
+    turns = max(result.num_turns, 1)
+    requests, tokens = taken
+    limiter.record_turns(model, turns)
+    await asyncio.to_thread(limiter.settle, model, turns - requests, result.tokens - tokens)
+
+
+async def _query_once(
+    client: ClaudeSDKClient,
+    stage: str,
+    prompt: str,
+    event_bus: EventBus | None,
+    inbox: OperatorInbox | None = None,
+    watchdog: StageWatchdog | None = None,
+) -> StageResult:
+    """One query/receive_response round; raises TransientLLMError on a retryable API failure."""
     await client.query(prompt)
+    # While the turn runs, interrupt-mode operator messages or the watchdog may cut it short
+    if inbox is not None:
+        inbox.attach(client)
+    if watchdog is not None:
+        watchdog.turn_started()
+    try:
+        return await _receive(client, stage, prompt, event_bus, watchdog)
+    finally:
+        if inbox is not None:
+            inbox.detach()
+        if watchdog is not None:
+            watchdog.turn_ended()
+
 
+async def _receive(
+    client: ClaudeSDKClient,
+    stage: str,
+    prompt: str,
+    event_bus: EventBus | None,
+    watchdog: StageWatchdog | None,
+) -> StageResult:
     collected_text: list[str] = []
     session_id: str | None = None
+    usage: dict = {}
+    cost_usd = 0.0
+    duration_ms = 0
+    num_turns = 0
+    message_error: str | None = None
+    failure: TransientLLMError | None = None
+    # Spans: model time runs from the query (or the last tool results) to the first
+    # tool call; each tool call runs from its ToolUseBlock to its ToolResultBlock.
+    turn_index = 1
+    turn: Span | None = start_span("llm_turn", turn=turn_index)
+    tools: dict[str, Span] = {}
     async for message in client.receive_response():
+        if watchdog is not None:
+            watchdog.activity()
         if isinstance(message, AssistantMessage):
+            if getattr(message, "error", None) in TRANSIENT_MESSAGE_ERRORS:
+                message_error = message.error
             for block in message.content:
                 if isinstance(block, ThinkingBlock):
                     print(f"  [{stage}] thinking ({len(block.thinking)} chars)")
@@ -71,6 +310,11 @@ async def run_stage(
                             v_str = v_str[:97] + "..."
                         sanitized_input[k] = v_str
                     print(f"  [{stage}] tool: {block.name}")
+                    end_span(turn, stop="tool_use")
+                    detail = next((sanitized_input[k] for k in ("command", "file_path", "pattern") if k in sanitized_input), None)
+                    tools[block.id] = start_span("tool", tool=block.name, tool_use_id=block.id, input=detail)
+                    if watchdog is not None:
+                        watchdog.tool_started(block.id, block.name)
                     if event_bus:
                         await event_bus.emit({
                             "type": "tool",
@@ -80,6 +324,10 @@ async def run_stage(
             # UserMessage carries ToolResultBlock content from tool executions
             content = message.content if isinstance(message.content, list) else []
             for block in content:
+                if isinstance(block, ToolResultBlock):
+                    end_span(tools.pop(block.tool_use_id, None), is_error=bool(block.is_error))
+                if isinstance(block, ToolResultBlock) and watchdog is not None:
+                    watchdog.tool_finished(block.tool_use_id)
                 if isinstance(block, ToolResultBlock) and block.is_error:
                     snippet = str(block.content)[:200] if block.content else ""
                     print(f"  [{stage}] tool result ERROR: {snippet}")
@@ -88,8 +336,22 @@ async def run_stage(
                             "type": "tool_error",
                             "data": {"stage": stage, "error": snippet},
                         })
+            if not tools and (turn is None or turn.end_ns is not None):
+                # Every tool call is back: the model has the next turn
+                turn_index += 1
+                if watchdog is not None:
+                    watchdog.model_turn()
+                turn = start_span("llm_turn", turn=turn_index)
         elif isinstance(message, ResultMessage):
+            end_span(turn, stop="result")
+            failure = transient_result_error(message)
+            if failure is None and message_error and message.is_error:
+                failure = TransientLLMError(message_error)
             session_id = message.session_id
+            usage = message.usage or {}
+            cost_usd = message.total_cost_usd or 0.0
+            duration_ms = message.duration_ms or 0
+            num_turns = message.num_turns or 0
             cost = f"${message.total_cost_usd:.4f}" if message.total_cost_usd else "n/a"
             duration = message.duration_ms
             turns = message.num_turns
@@ -100,4 +362,24 @@ async def run_stage(
                     "data": {"stage": stage, "turns": turns, "cost": cost, "duration": duration},
                 })
 
-    return StageResult(text="\n".join(collected_text), session_id=session_id)
+    # Interrupted or failed mid-turn: close what never got a result
+    end_span(turn, error="incomplete")
+    for pending in tools.values():
+        end_span(pending, error="no result")
+    tokens = sum(
+        usage.get(key) or 0
+        for key in ("input_tokens", "cache_creation_input_tokens", "output_tokens")
+    )
+    result = StageResult(
+        text="\n".join(collected_text),
+        session_id=session_id,
+        cost_usd=cost_usd,
+        tokens=tokens,
+        duration_ms=duration_ms,
+        num_turns=num_turns,
+        prompt_chars=len(prompt),
+    )
+    if failure is not None:
+        failure.partial = result
+        raise failure
+    return result
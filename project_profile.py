@@ -0,0 +1,257 @@
+"""Per-target project profile: language, test command, test-file matcher, source roots.
+
+The profile is computed from a single scan of the project's top level, kept in
+memory and persisted to ``.git/tdd_profile.json``. It is keyed by the mtimes
+of the project directory, its manifests and the few directories detection
+looks inside, so creating ``package.json`` or installing jest invalidates it
+without re-running the full detection on every call.
+"""
+
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+
+PROFILE_FILENAME = "tdd_profile.json"
+_PROFILE_VERSION = 1
+
+# Files whose presence or content changes detection
+_MANIFESTS = (
+    "Gemfile", "Rakefile", "pytest.ini", "setup.cfg", "pyproject.toml", "manage.py",
+    "setup.py", "tox.ini", "composer.json", "phpunit.xml", "phpunit.xml.dist",
+    "package.json", "go.mod", "Cargo.toml", "pom.xml", "build.gradle",
+    "build.gradle.kts", "mix.exs", "Package.swift",
+)
+# Directories detection looks inside (bin/rails, node_modules/.bin/jest, test/*.rb, ...)
+_PROBE_DIRS = ("bin", "test", "spec", os.path.join("node_modules", ".bin"), os.path.join("vendor", "bin"))
+
+# Test-file patterns that apply to every project
+_COMMON_TEST_FILE_PATTERNS = [
+    r"(^|/)tests?/",            # test/ or tests/ directory
+    r"(^|/)spec/",              # spec/ directory (rspec)
+    r"_test\.\w+$",             # _test.go, _test.py, etc.
+    r"_spec\.\w+$",             # _spec.rb, _spec.ts, etc.
+    r"\.test\.\w+$",            # .test.js, .test.ts, etc.
+    r"\.spec\.\w+$",            # .spec.js, .spec.ts, etc.
+    r"test_[^/]+\.py$",         # test_*.py (pytest convention)
+]
+# Extra conventions per language
+_LANGUAGE_TEST_FILE_PATTERNS: dict[str, list[str]] = {
+    "javascript": [r"(^|/)__tests__/"],
+    "php": [r"Test\.php$"],
+    "java": [r"Tests?\.(java|kt)$"],
+    "dotnet": [r"(^|/)[^/]*\.Tests?/", r"Tests?\.cs$"],
+    "swift": [r"(^|/)Tests/"],
+    "elixir": [r"_test\.exs$"],
+}
+_SOURCE_ROOT_CANDIDATES = ("src", "lib", "app", "pkg", "cmd", "internal", "Sources")
+
+_cache: dict[str, "ProjectProfile"] = {}
+
+
+@dataclass
+class ProjectProfile:
+    """Detection results for one target directory."""
+    target: str
+    language: str | None
+    test_command: str | None
+    test_file_patterns: list[str]
+    source_roots: list[str]
+    fingerprint: dict[str, float]   # relative path → mtime at scan time
+    _test_file_re: re.Pattern | None = field(default=None, repr=False, compare=False)
+
+    def is_test_file(self, file_path: str) -> bool:
+        """Return True if ``file_path`` matches this project's test-file conventions."""
+        if self._test_file_re is None:
+            self._test_file_re = re.compile("|".join(f"(?:{p})" for p in self.test_file_patterns))
+        return self._test_file_re.search(file_path) is not None
+
+    def to_json(self) -> dict:
+        data = asdict(self)
+        data.pop("_test_file_re", None)
+        data["version"] = _PROFILE_VERSION
+        return data
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _fingerprint(target: str, entries: dict[str, bool]) -> dict[str, float]:
+    """mtimes of the target dir plus every manifest and probe dir that exists."""
+    paths = ["."]
+    paths += [m for m in _MANIFESTS if m in entries]
+    paths += [name for name in entries if name.endswith((".sln", ".csproj"))]
+    for probe in _PROBE_DIRS:
+        top = probe.split(os.sep, 1)[0]
+        if top in entries:
+            # Track the parent too, so a nested dir appearing later is noticed
+            paths += [top, probe] if top != probe else [top]
+    fp: dict[str, float] = {}
+    for rel in paths:
+        mtime = _mtime(os.path.join(target, rel))
+        if mtime is not None:
+            fp[rel] = mtime
+    return fp
+
+
+def _is_fresh(profile: ProjectProfile) -> bool:
+    """Cheap validation: re-stat only the paths recorded in the fingerprint."""
+    return all(
+        _mtime(os.path.join(profile.target, rel)) == mtime
+        for rel, mtime in profile.fingerprint.items()
+    )
+
+
+def _scan_entries(target: str) -> dict[str, bool]:
+    """One scandir of the project top level: name → is_dir."""
+    try:
+        with os.scandir(target) as it:
+            return {entry.name: entry.is_dir() for entry in it}
+    except OSError:
+        return {}
+
+
+def _detect(target: str, entries: dict[str, bool]) -> tuple[str | None, str | None]:
+    """Return (language, test command) from the top-level entries."""
+    def exists(*parts: str) -> bool:
+        if parts[0] not in entries:
+            return False
+        return len(parts) == 1 or os.path.exists(os.path.join(target, *parts))
+
+    # Ruby / Rails
+    if exists("bin", "rails"):
+        return "ruby", "bin/rails test"
+    if exists("Gemfile") and exists("spec"):
+        return "ruby", "bundle exec rspec"
+    if exists("Gemfile") and exists("test"):
+        return "ruby", "bundle exec rake test"
+    # Plain Ruby without bundler
+    if exists("Rakefile") and (exists("test") or exists("spec")):
+        return "ruby", "rake test"
+    if entries.get("test"):
+        test_dir = os.path.join(target, "test")
+        if any(f.endswith(".rb") for f in os.listdir(test_dir)):
+            return "ruby", (
+                "ruby -Ilib:test "
+                "-e \"require 'minitest/autorun'; "
+                "Dir.glob('test/**/*_test.rb').each { |f| load File.expand_path(f) }\""
+            )
+
+    # Python
+    if exists("pytest.ini") or exists("setup.cfg") or exists("pyproject.toml"):
+        return "python", "python -m pytest"
+    if exists("manage.py"):                      # Django
+        return "python", "python manage.py test"
+    if exists("setup.py") or exists("tox.ini"):
+        return "python", "python -m pytest"
+
+    # PHP
+    if exists("vendor", "bin", "phpunit"):
+        return "php", "vendor/bin/phpunit"
+    if exists("phpunit.xml") or exists("phpunit.xml.dist") or exists("composer.json"):
+        return "php", "vendor/bin/phpunit"
+
+    # JavaScript / TypeScript
+    if exists("package.json"):
+        if exists("node_modules", ".bin", "jest"):
+            return "javascript", "npx jest"
+        if exists("node_modules", ".bin", "vitest"):
+            return "javascript", "npx vitest run"
+        return "javascript", "npm test"
+
+    # Go
+    if exists("go.mod"):
+        return "go", "go test ./..."
+
+    # Rust
+    if exists("Cargo.toml"):
+        return "rust", "cargo test"
+
+    # Java
+    if exists("pom.xml"):
+        return "java", "mvn test"
+    if exists("build.gradle") or exists("build.gradle.kts"):
+        return "java", "./gradlew test"
+
+    # .NET — solution/project files have arbitrary names
+    if any(name.endswith((".sln", ".csproj")) for name in entries):
+        return "dotnet", "dotnet test"
+
+    # Elixir
+    if exists("mix.exs"):
+        return "elixir", "mix test"
+
+    # Swift
+    if exists("Package.swift"):
+        return "swift", "swift test"
+
+    return None, None
+
+
+def scan_project(target: str) -> ProjectProfile:
+    """Compute a fresh profile for ``target`` (no caching)."""
+    entries = _scan_entries(target)
+    language, test_command = _detect(target, entries)
+    roots = [name for name in _SOURCE_ROOT_CANDIDATES if entries.get(name)] or ["."]
+    return ProjectProfile(
+        target=target,
+        language=language,
+        test_command=test_command,
+        test_file_patterns=_COMMON_TEST_FILE_PATTERNS + _LANGUAGE_TEST_FILE_PATTERNS.get(language or "", []),
+        source_roots=roots,
+        fingerprint=_fingerprint(target, entries),
+    )
+
+
+def _profile_path(target: str) -> str | None:
+    git_dir = os.path.join(target, ".git")
+    return os.path.join(git_dir, PROFILE_FILENAME) if os.path.isdir(git_dir) else None
+
+
+def _read_persisted(target: str) -> ProjectProfile | None:
+    path = _profile_path(target)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.pop("version", None) != _PROFILE_VERSION:
+            return None
+        return ProjectProfile(**data)
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _persist(profile: ProjectProfile) -> None:
+    path = _profile_path(profile.target)
+    if not path:
+        return
+    try:
+        with open(path, "w") as f:
+            json.dump(profile.to_json(), f, indent=2)
+    except OSError:
+        pass
+
+
+def load_profile(target: str) -> ProjectProfile:
+    """Return the profile for ``target``, rescanning only when it is stale."""
+    target = os.path.abspath(target)
+    profile = _cache.get(target) or _read_persisted(target)
+    if profile is None or profile.target != target or not _is_fresh(profile):
+        profile = scan_project(target)
+        _persist(profile)
+    _cache[target] = profile
+    return profile
+
+
+def invalidate_profile(target: str) -> None:
+    """Drop the cached and persisted profile for ``target``."""
+    target = os.path.abspath(target)
+    _cache.pop(target, None)
+    path = _profile_path(target)
+    if path and os.path.exists(path):
+        os.remove(path)
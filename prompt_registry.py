@@ -0,0 +1,161 @@
+"""Shared registry for the ``prompts/*.md`` templates.
+
+Templates are parsed once and re-read only when their mtime changes. Rendering
+keeps the cacheable part of a prompt at the front: per-run blocks such as the
+ticket, plan or reviewer findings are replaced in the instructions by a
+``<name>`` reference and appended, with the project-directory preamble, after
+a ``## Run context`` header. Short inline values (test command, gate exit
+code, ...) are substituted in place. Oversized blocks are compacted first
+(see ``context_budget``).
+
+``python prompt_registry.py`` validates every template and prints its size.
+"""
+
+import os
+import string
+import sys
+from dataclasses import dataclass
+
+from context_budget import fit_blocks
+
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+CONTEXT_HEADER = "## Run context"
+
+# Multi-line values that change per run; they go after the stable instructions
+BLOCK_FIELDS = frozenset({
+    "ticket", "plan", "prior_summary", "context", "answers",
+    "review_issues", "qa_issues", "security_issues", "failure_delta",
+    "test_status_block", "final_test_block", "review_summary", "qa_summary",
+    "security_summary", "files_modified", "repo_map", "diff_context", "codebase_context",
+})
+
+
+@dataclass
+class _Template:
+    name: str
+    mtime_ns: int
+    segments: list[tuple[str, str]]     # ("text", literal) or ("field", name)
+    fields: list[str]                   # distinct fields in order of first use
+
+    @property
+    def static_chars(self) -> int:
+        return sum(len(value) for kind, value in self.segments if kind == "text")
+
+
+def _parse(name: str, source: str, mtime_ns: int) -> _Template:
+    segments: list[tuple[str, str]] = []
+    fields: list[str] = []
+    try:
+        parsed = list(string.Formatter().parse(source))
+    except ValueError as exc:
+        raise ValueError(f"prompt template {name}.md: {exc}") from None
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            segments.append(("text", literal))
+        if field is None:
+            continue
+        if not field.isidentifier() or spec or conversion:
+            raise ValueError(f"prompt template {name}.md: unsupported placeholder {{{field}}}")
+        segments.append(("field", field))
+        if field not in fields:
+            fields.append(field)
+    return _Template(name, mtime_ns, segments, fields)
+
+
+def _preamble(target: str) -> str:
+    return (
+        f"PROJECT DIRECTORY: {target}\n"
+        f"You are working exclusively within this directory. All file reads, writes, "
+        f"edits, searches, and shell commands MUST operate within {target} only. "
+        f"Do NOT access, scan, or create files outside of {target}."
+    )
+
+
+class PromptRegistry:
+    def __init__(self, directory: str = PROMPTS_DIR) -> None:
+        self.directory = directory
+        self._templates: dict[str, _Template] = {}
+        self.load_all()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.md")
+
+    def _load(self, name: str, mtime_ns: int) -> _Template:
+        with open(self._path(name)) as f:
+            template = _parse(name, f.read(), mtime_ns)
+        self._templates[name] = template
+        return template
+
+    def load_all(self) -> None:
+        """Parse and validate every template; raises ValueError on a malformed one."""
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            if entry.name.endswith(".md"):
+                self._load(entry.name[:-3], entry.stat().st_mtime_ns)
+
+    def get(self, name: str) -> _Template:
+        """Return the parsed template, re-reading it if the file changed on disk."""
+        mtime_ns = os.stat(self._path(name)).st_mtime_ns
+        template = self._templates.get(name)
+        if template is None or template.mtime_ns != mtime_ns:
+            template = self._load(name, mtime_ns)
+        return template
+
+    def render(self, name: str, target: str | None = None, **kwargs: str) -> str:
+        """Render ``name``: stable instructions first, per-run context last."""
+        template = self.get(name)
+        values = {**kwargs, "target": target} if target else kwargs
+        missing = [f for f in template.fields if f not in values]
+        if missing:
+            raise KeyError(f"prompt template {name}.md needs {', '.join(missing)}")
+
+        parts: list[str] = []
+        for kind, value in template.segments:
+            if kind == "text":
+                parts.append(value)
+            elif value in BLOCK_FIELDS:
+                parts.append(f"<{value}> (in the run context below)")
+            else:
+                parts.append(str(values[value]))
+        content = "".join(parts).rstrip()
+
+        blocks = {f: str(values[f]).strip() for f in template.fields if f in BLOCK_FIELDS}
+        preamble = _preamble(target) if target else ""
+        blocks, notes = fit_blocks(blocks, len(content) + len(preamble))
+        for note in notes:
+            print(f"  [{name}] compacted {note}")
+        tail = [f"<{field}>\n{text}\n</{field}>" for field, text in blocks.items()]
+        if preamble:
+            tail.append(preamble)
+        if tail:
+            content += f"\n\n---\n\n{CONTEXT_HEADER}\n\n" + "\n\n".join(tail)
+        return content
+
+
+def stable_prefix_chars(prompt: str) -> int:
+    """Length of the part of a rendered prompt that does not depend on the run."""
+    index = prompt.find(f"\n\n---\n\n{CONTEXT_HEADER}\n\n")
+    return index if index != -1 else len(prompt)
+
+
+registry = PromptRegistry()
+
+
+def load_prompt(name: str, target: str | None = None, **kwargs: str) -> str:
+    """Render prompts/<name>.md through the shared registry."""
+    return registry.render(name, target=target, **kwargs)
+
+
+def main() -> int:
+    print(f"{'template':<34} {'static chars':>12}  fields")
+    for name, template in sorted(registry._templates.items()):
+        blocks = [f for f in template.fields if f in BLOCK_FIELDS]
+        inline = [f for f in template.fields if f not in BLOCK_FIELDS]
+        print(
+            f"{name:<34} {template.static_chars:>12}  "
+            f"inline={','.join(inline) or '-'}  block={','.join(blocks) or '-'}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
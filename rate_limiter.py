@@ -0,0 +1,241 @@
+"""Token-bucket rate limiting for model calls, shared by every process on the host.
+
+The proxy enforces requests-per-minute and tokens-per-minute per model. Each
+model alias gets two buckets (requests, tokens) that refill continuously at
+those rates. Bucket state lives in one JSON file guarded by ``flock``, so
+concurrent runs, optimizer and summarizer calls — in any number of worker
+processes — draw from the same budget.
+
+Admission is per query, but one query runs a whole multi-turn agent loop and
+every turn is a request to the proxy. So a query is admitted on an estimate:
+the model's expected turn count (a running average of recent queries, see
+``expected_requests``) and its prompt tokens. Concurrent runs therefore can't
+all start long loops against a bucket that only holds one request each. Once
+a query finishes, ``settle`` charges or refunds the difference between the
+actual turns and tokens and the estimate. Buckets may go negative, which makes
+later callers wait. Turns inside a loop are not paced, so a loop that runs
+well over its estimate can still briefly exceed the proxy's RPM.
+
+Waiters are served by priority (GREEN fixes first, optimizer last). Within a
+process they queue in priority order; across processes each waiter advertises
+its priority in the state file, and lower-priority waiters hold back while a
+higher-priority one is waiting.
+
+Limits: RATE_LIMIT_RPM / RATE_LIMIT_TPM for every model, and RATE_LIMITS
+(``sonnet=50/400000,haiku=100/800000``) per alias. No limits, no waiting.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:     # not POSIX: limits still apply within this process
+    fcntl = None
+
+
+def _parse_limits(spec: str) -> dict[str, tuple[float | None, float | None]]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        alias, _, values = item.partition("=")
+        rpm, _, tpm = values.partition("/")
+        limits[alias.strip()] = (float(rpm) if rpm.strip() else None, float(tpm) if tpm.strip() else None)
+    return limits
+
+
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM") or 0) or None
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM") or 0) or None
+RATE_LIMITS = _parse_limits(os.getenv("RATE_LIMITS", ""))
+RATE_LIMIT_STATE = os.getenv(
+    "RATE_LIMIT_STATE", os.path.join(tempfile.gettempdir(), "tdd-pipeline-ratelimit.json")
+)
+
+# Lower runs first
+PRIORITY_FIX = 0            # GREEN / *_GREEN: the run is blocked on them
+PRIORITY_STAGE = 1
+PRIORITY_REVIEW = 2
+PRIORITY_BACKGROUND = 3     # summaries, reports, commits
+PRIORITY_OPTIMIZER = 4
+
+_STAGE_PRIORITIES = {
+    "GREEN": PRIORITY_FIX, "REVIEW_GREEN": PRIORITY_FIX, "QA_GREEN": PRIORITY_FIX,
+    "SECURITY_GREEN": PRIORITY_FIX,
+    "REVIEW": PRIORITY_REVIEW, "QA": PRIORITY_REVIEW, "SECURITY_REVIEW": PRIORITY_REVIEW,
+    "REPORT": PRIORITY_BACKGROUND, "GIT_COMMIT": PRIORITY_BACKGROUND,
+}
+# A waiter that hasn't refreshed its advertisement for this long is gone
+_WAITER_TTL_SECONDS = 5.0
+_MAX_POLL_SECONDS = 1.0
+# Weight of the latest query in the running average of turns per query
+_TURNS_SMOOTHING = 0.2
+
+
+def priority_for_stage(kind: str) -> int:
+    return _STAGE_PRIORITIES.get(kind, PRIORITY_STAGE)
+
+
+def limits_for(model: str) -> tuple[float | None, float | None]:
+    """(requests/min, tokens/min) for ``model``; None means unlimited."""
+    rpm, tpm = RATE_LIMITS.get(model, (None, None))
+    return rpm or RATE_LIMIT_RPM, tpm or RATE_LIMIT_TPM
+
+
+class RateLimiter:
+    def __init__(self, state_path: str = RATE_LIMIT_STATE) -> None:
+        self.state_path = state_path
+        self._local: dict[str, dict] = {}               # state when fcntl is unavailable
+        self._queues: dict[str, list] = {}              # model → heap of [priority, seq, future]
+        self._seq = itertools.count()
+        self._waiter_id = f"{os.getpid()}"
+        self._turns: dict[str, float] = {}              # model → running average of turns per query
+
+    # ── Shared state ──
+
+    def _update(self, fn):
+        """Run ``fn(state)`` under the file lock and persist the result."""
+        if fcntl is None:
+            return fn(self._local)
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), "r+") as f:
+                raw = f.read()
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                result = fn(state)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+            return result
+        finally:
+            os.close(fd)     # releases the lock
+
+    @staticmethod
+    def _refill(bucket: dict, rpm: float | None, tpm: float | None, now: float) -> None:
+        elapsed = max(now - bucket.get("at", now), 0.0)
+        bucket["at"] = now
+        if rpm:
+            bucket["requests"] = min(bucket.get("requests", rpm) + elapsed * rpm / 60, rpm)
+        if tpm:
+            bucket["tokens"] = min(bucket.get("tokens", tpm) + elapsed * tpm / 60, tpm)
+
+    def _try_take(self, model: str, tokens: int, priority: int, requests: int = 1) -> float:
+        """Take from the buckets if possible; otherwise return seconds to wait."""
+        rpm, tpm = limits_for(model)
+        tokens = min(tokens, tpm) if tpm else tokens      # a huge prompt must still fit eventually
+        requests = min(requests, rpm) if rpm else requests
+
+        def take(state: dict) -> float:
+            now = time.time()
+            bucket = state.setdefault(model, {})
+            self._refill(bucket, rpm, tpm, now)
+            waiters = bucket.setdefault("waiters", {})
+            for wid, (_, seen) in list(waiters.items()):
+                if now - seen > _WAITER_TTL_SECONDS:
+                    del waiters[wid]
+            ahead = any(p < priority for wid, (p, _) in waiters.items() if wid != self._waiter_id)
+            wait = 0.0
+            if rpm and bucket["requests"] < requests:
+                wait = max(wait, (requests - bucket["requests"]) * 60 / rpm)
+            if tpm and bucket["tokens"] < tokens:
+                wait = max(wait, (tokens - bucket["tokens"]) * 60 / tpm)
+            if ahead and wait == 0.0:
+                wait = 0.2
+            if wait > 0:
+                waiters[self._waiter_id] = [priority, now]
+                return wait
+            waiters.pop(self._waiter_id, None)
+            if rpm:
+                bucket["requests"] -= requests
+            if tpm:
+                bucket["tokens"] -= tokens
+            return 0.0
+
+        return self._update(take)
+
+    # ── API ──
+
+    async def acquire(
+        self, model: str | None, tokens: int, priority: int = PRIORITY_STAGE, on_wait=None, requests: int = 1
+    ) -> tuple[float, float]:
+        """Wait until a ``tokens``-sized query of ``requests`` turns may be sent.
+
+        Returns the requests and tokens actually taken, which admission caps
+        at the model's limits; settle the query's usage against these.
+        ``on_wait(seconds)`` is awaited once if the caller has to wait.
+        """
+        model = model or "default"
+        rpm, tpm = limits_for(model)
+        if not rpm and not tpm:
+            return requests, tokens
+        taken = (min(requests, rpm) if rpm else requests, min(tokens, tpm) if tpm else tokens)
+        loop = asyncio.get_running_loop()
+        queue = self._queues.setdefault(model, [])
+        entry = [priority, next(self._seq), loop.create_future()]    # future: "you are next"
+        heapq.heappush(queue, entry)
+        notified = False
+        try:
+            while True:
+                # Only the best local waiter competes for the shared buckets
+                if queue[0] is entry:
+                    wait = await asyncio.to_thread(self._try_take, model, tokens, priority, requests)
+                    if wait == 0.0:
+                        return taken
+                else:
+                    wait = _MAX_POLL_SECONDS
+                if on_wait is not None and not notified:
+                    notified = True
+                    await on_wait(wait)
+                try:
+                    await asyncio.wait_for(asyncio.shield(entry[2]), min(wait, _MAX_POLL_SECONDS))
+                    entry[2] = loop.create_future()
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            queue.remove(entry)
+            heapq.heapify(queue)
+            if queue and not queue[0][2].done():
+                queue[0][2].set_result(None)     # wake the next local waiter now
+
+    def waiting(self) -> dict[str, int]:
+        """Queries in this process waiting for each model's buckets."""
+        return {model: len(queue) for model, queue in self._queues.items() if queue}
+
+    def expected_requests(self, model: str | None) -> int:
+        """Turns to charge up front for a query to ``model``, from recent queries."""
+        return max(round(self._turns.get(model or "default", 1.0)), 1)
+
+    def record_turns(self, model: str | None, turns: int) -> None:
+        """Feed a finished query's turn count into ``expected_requests``."""
+        model = model or "default"
+        average = self._turns.get(model)
+        self._turns[model] = turns if average is None else average + _TURNS_SMOOTHING * (turns - average)
+
+    def settle(self, model: str | None, extra_requests: int, extra_tokens: int) -> None:
+        """Charge usage beyond the admitted estimate (negative values refund)."""
+        model = model or "default"
+        rpm, tpm = limits_for(model)
+        if (not rpm or not extra_requests) and (not tpm or not extra_tokens):
+            return
+
+        def charge(state: dict) -> None:
+            bucket = state.setdefault(model, {})
+            self._refill(bucket, rpm, tpm, time.time())
+            if rpm:
+                bucket["requests"] = min(bucket["requests"] - extra_requests, rpm)
+            if tpm:
+                bucket["tokens"] = min(bucket["tokens"] - extra_tokens, tpm)
+
+        self._update(charge)
+
+
+limiter = RateLimiter()
@@ -0,0 +1,309 @@
+"""Precomputed repository map for stage prompts.
+
+A compact overview of the target: language stats, test layout and a file tree
+with the top-level symbols of each source file. It is injected into PLAN, RED,
+REVIEW, QA, SECURITY and optimizer prompts so agents don't spend their first
+turns globbing the tree to re-discover the layout.
+
+The map is cached by a hash of the tree (paths, sizes, mtimes): in memory and
+in ``.git/tdd_repo_map.json``. When the tree changes, only files whose size or
+mtime changed are re-scanned for symbols.
+
+Per-stage turn counts are appended to ``.git/tdd_stage_log.jsonl`` together
+with whether the map was injected; ``python repo_map.py --compare <target>``
+prints mean turns per stage with and without it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from project_profile import load_profile
+
+REPO_MAP = os.getenv("REPO_MAP", "1") not in ("0", "false", "no")
+# Rendered map size; directories beyond this collapse to file counts
+REPO_MAP_MAX_CHARS = int(os.getenv("REPO_MAP_MAX_CHARS", "6000"))
+REPO_MAP_FILENAME = "tdd_repo_map.json"
+STAGE_LOG_FILENAME = "tdd_stage_log.jsonl"
+_CACHE_VERSION = 1
+
+# Files larger than this are listed but not scanned for symbols
+_MAX_SCAN_BYTES = 256 * 1024
+_MAX_SYMBOLS_PER_FILE = 8
+SKIP_DIRS = {".git", "node_modules", "vendor", "__pycache__", ".venv", "venv", "dist", "build",
+             "target", "_build", "deps", ".build", "coverage", ".next", ".tox", ".mypy_cache"}
+
+LANGUAGES = {
+    ".py": "Python", ".rb": "Ruby", ".js": "JavaScript", ".jsx": "JavaScript", ".mjs": "JavaScript",
+    ".ts": "TypeScript", ".tsx": "TypeScript", ".go": "Go", ".rs": "Rust", ".java": "Java",
+    ".kt": "Kotlin", ".cs": "C#", ".php": "PHP", ".ex": "Elixir", ".exs": "Elixir",
+    ".swift": "Swift", ".c": "C", ".h": "C", ".cpp": "C++", ".hpp": "C++", ".scala": "Scala",
+}
+
+# Top-level declarations per language; group 1 is the symbol
+_SYMBOL_PATTERNS: dict[str, re.Pattern] = {
+    "Python": re.compile(r"^(?:async\s+)?(?:def|class)\s+(\w+)", re.M),
+    "Ruby": re.compile(r"^\s{0,2}(?:class|module|def)\s+([\w:.?!]+)", re.M),
+    "JavaScript": re.compile(
+        r"^(?:export\s+(?:default\s+)?)?(?:async\s+)?(?:function\*?|class|const|let)\s+(\w+)", re.M),
+    "TypeScript": re.compile(
+        r"^(?:export\s+(?:default\s+)?)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+        r"(?:function\*?|class|interface|type|enum|const)\s+(\w+)", re.M),
+    "Go": re.compile(r"^(?:func(?:\s+\([^)]*\))?|type)\s+(\w+)", re.M),
+    "Rust": re.compile(r"^(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:fn|struct|enum|trait|mod)\s+(\w+)", re.M),
+    "Java": re.compile(r"^(?:public\s+|abstract\s+|final\s+)*(?:class|interface|enum|record)\s+(\w+)", re.M),
+    "Kotlin": re.compile(r"^(?:data\s+|open\s+|abstract\s+)*(?:class|object|interface|fun)\s+(\w+)", re.M),
+    "C#": re.compile(r"^\s*(?:public\s+|internal\s+|static\s+|sealed\s+|abstract\s+|partial\s+)*"
+                     r"(?:class|interface|record|enum|struct)\s+(\w+)", re.M),
+    "PHP": re.compile(r"^(?:abstract\s+|final\s+)?(?:class|interface|trait|function)\s+(\w+)", re.M),
+    "Elixir": re.compile(r"^\s{0,2}(?:defmodule|def|defp)\s+([\w.?!]+)", re.M),
+    "Swift": re.compile(r"^(?:public\s+|open\s+|final\s+)*(?:class|struct|enum|protocol|func)\s+(\w+)", re.M),
+}
+
+_cache: dict[str, "RepoMap"] = {}
+
+
+@dataclass
+class RepoMap:
+    target: str
+    tree_hash: str
+    files: dict[str, list]                  # path → [size, mtime_ns, language, symbols]
+    test_files: list[str] = field(default_factory=list)
+
+    def language_stats(self) -> list[tuple[str, int]]:
+        counts = Counter(info[2] for info in self.files.values() if info[2])
+        return counts.most_common()
+
+    def render(self, max_chars: int = REPO_MAP_MAX_CHARS) -> str:
+        """Compact text form: languages, test layout, then the tree with symbols."""
+        lines = [f"Files: {len(self.files)}"]
+        langs = self.language_stats()
+        if langs:
+            lines.append("Languages: " + ", ".join(f"{name} ({n})" for name, n in langs[:8]))
+        if self.test_files:
+            test_dirs = Counter(os.path.dirname(p) or "." for p in self.test_files)
+            lines.append(
+                f"Tests: {len(self.test_files)} files in "
+                + ", ".join(f"{d}/ ({n})" for d, n in test_dirs.most_common(6))
+            )
+        lines.append("Tree (path: top-level symbols):")
+
+        by_dir: dict[str, list[str]] = defaultdict(list)
+        for path in sorted(self.files):
+            by_dir[os.path.dirname(path)].append(path)
+        used = sum(len(line) + 1 for line in lines)
+        collapsed: list[str] = []
+        for directory in sorted(by_dir):
+            entries = []
+            for path in by_dir[directory]:
+                symbols = self.files[path][3]
+                entry = f"  {path}"
+                if symbols:
+                    more = "" if len(symbols) <= _MAX_SYMBOLS_PER_FILE else ", ..."
+                    entry += ": " + ", ".join(symbols[:_MAX_SYMBOLS_PER_FILE]) + more
+                entries.append(entry)
+            block_chars = sum(len(e) + 1 for e in entries)
+            if used + block_chars > max_chars:
+                collapsed.append(f"  {directory or '.'}/ ({len(entries)} files)")
+                continue
+            lines.extend(entries)
+            used += block_chars
+        if collapsed:
+            lines.append("Not expanded (size limit):")
+            summary = collapsed[:40]
+            lines.extend(summary)
+            if len(collapsed) > len(summary):
+                lines.append(f"  ... and {len(collapsed) - len(summary)} more directories")
+        return "\n".join(lines)
+
+
+def list_files(target: str) -> list[str]:
+    """Tracked plus untracked-but-not-ignored files; a filtered walk outside git."""
+    if os.path.isdir(os.path.join(target, ".git")):
+        proc = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            cwd=target, capture_output=True,
+        )
+        if proc.returncode == 0:
+            paths = [p for p in proc.stdout.decode(errors="replace").split("\0") if p]
+            return [p for p in paths if not SKIP_DIRS.intersection(p.split("/")[:-1])]
+    paths: list[str] = []
+    for root, dirs, files in os.walk(target):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
+        rel_root = os.path.relpath(root, target)
+        for name in files:
+            paths.append(name if rel_root == "." else os.path.join(rel_root, name))
+    return paths
+
+
+def _symbols(path: str, language: str | None) -> list[str]:
+    pattern = _SYMBOL_PATTERNS.get(language or "")
+    if pattern is None:
+        return []
+    try:
+        with open(path, errors="replace") as f:
+            text = f.read(_MAX_SCAN_BYTES)
+    except OSError:
+        return []
+    seen: dict[str, None] = {}
+    for match in pattern.finditer(text):
+        if not match.group(1).startswith("_"):     # private helpers add noise, not orientation
+            seen.setdefault(match.group(1), None)
+    return list(seen)
+
+
+def _cache_path(target: str) -> str | None:
+    git_dir = os.path.join(target, ".git")
+    return os.path.join(git_dir, REPO_MAP_FILENAME) if os.path.isdir(git_dir) else None
+
+
+def _read_persisted(target: str) -> RepoMap | None:
+    path = _cache_path(target)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.pop("version", None) != _CACHE_VERSION:
+            return None
+        return RepoMap(**data)
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _persist(repo_map: RepoMap) -> None:
+    path = _cache_path(repo_map.target)
+    if not path:
+        return
+    try:
+        with open(path, "w") as f:
+            json.dump({"version": _CACHE_VERSION, **repo_map.__dict__}, f)
+    except OSError:
+        pass
+
+
+def _stat_files(target: str) -> tuple[dict[str, tuple[int, int]], str]:
+    """(rel path → (size, mtime_ns), digest of those stats) for the project's files."""
+    stats: dict[str, tuple[int, int]] = {}
+    for rel in list_files(target):
+        try:
+            st = os.stat(os.path.join(target, rel))
+        except OSError:
+            continue
+        stats[rel] = (st.st_size, st.st_mtime_ns)
+    digest = hashlib.sha1()
+    for rel in sorted(stats):
+        digest.update(f"{rel}\0{stats[rel][0]}\0{stats[rel][1]}\n".encode())
+    return stats, digest.hexdigest()
+
+
+def tree_hash(target: str) -> str:
+    """Digest of every project file's path, size and mtime; no symbol scan."""
+    return _stat_files(os.path.abspath(target))[1]
+
+
+def build_repo_map(target: str) -> RepoMap:
+    """Return the map for ``target``, re-scanning only files that changed."""
+    target = os.path.abspath(target)
+    stats, tree_hash = _stat_files(target)
+
+    previous = _cache.get(target) or _read_persisted(target)
+    if previous is not None and previous.tree_hash == tree_hash:
+        _cache[target] = previous
+        return previous
+
+    old_files = previous.files if previous else {}
+    profile = load_profile(target)
+    files: dict[str, list] = {}
+    for rel, (size, mtime_ns) in stats.items():
+        old = old_files.get(rel)
+        if old and old[0] == size and old[1] == mtime_ns:
+            files[rel] = old
+            continue
+        language = LANGUAGES.get(os.path.splitext(rel)[1].lower())
+        symbols = _symbols(os.path.join(target, rel), language) if size <= _MAX_SCAN_BYTES else []
+        files[rel] = [size, mtime_ns, language, symbols]
+    repo_map = RepoMap(
+        target=target,
+        tree_hash=tree_hash,
+        files=files,
+        test_files=sorted(rel for rel in files if profile.is_test_file(rel)),
+    )
+    _cache[target] = repo_map
+    _persist(repo_map)
+    return repo_map
+
+
+def repo_map_context(target: str, repo_map: RepoMap | None = None) -> str:
+    """Rendered map for prompt injection, or a note when disabled/empty."""
+    if not REPO_MAP:
+        return "(repository map disabled — explore the project with Glob/Grep/Read)"
+    repo_map = repo_map or build_repo_map(target)
+    if not repo_map.files:
+        return "(empty project — no files yet)"
+    return repo_map.render()
+
+
+def log_stage(target: str, kind: str, stage: str, num_turns: int, duration_ms: int, prompt_chars: int) -> None:
+    """Append one stage's turn count for the with/without-map comparison."""
+    path = os.path.join(target, ".git", STAGE_LOG_FILENAME)
+    if not os.path.isdir(os.path.dirname(path)):
+        return
+    entry = {"kind": kind, "stage": stage, "turns": num_turns, "duration_ms": duration_ms,
+             "prompt_chars": prompt_chars, "repo_map": REPO_MAP}
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+
+def compare_turns(target: str) -> list[tuple[str, float | None, float | None, int, int]]:
+    """Per stage kind: (kind, mean turns with map, mean turns without, n with, n without)."""
+    turns: dict[tuple[str, bool], list[int]] = defaultdict(list)
+    with open(os.path.join(target, ".git", STAGE_LOG_FILENAME)) as f:
+        for line in f:
+            entry = json.loads(line)
+            turns[(entry["kind"], entry["repo_map"])].append(entry["turns"])
+    rows = []
+    for kind in sorted({k for k, _ in turns}):
+        with_map, without = turns.get((kind, True), []), turns.get((kind, False), [])
+        rows.append((
+            kind,
+            sum(with_map) / len(with_map) if with_map else None,
+            sum(without) / len(without) if without else None,
+            len(with_map),
+            len(without),
+        ))
+    return rows
+
+
+def main() -> int:
+    args = sys.argv[1:]
+    if args and args[0] == "--compare":
+        target = args[1] if len(args) > 1 else os.getcwd()
+        try:
+            rows = compare_turns(target)
+        except FileNotFoundError:
+            print(f"No stage log under {target}/.git")
+            return 1
+
+        def fmt(v: float | None) -> str:
+            return f"{v:.1f}" if v is not None else "-"
+
+        print(f"{'stage':<16} {'with map':>9} {'without':>9} {'n':>7}")
+        for kind, with_map, without, n_with, n_without in rows:
+            print(f"{kind:<16} {fmt(with_map):>9} {fmt(without):>9} {f'{n_with}/{n_without}':>7}")
+        return 0
+    target = args[0] if args else os.getcwd()
+    print(build_repo_map(target).render())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
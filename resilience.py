@@ -0,0 +1,149 @@
+"""Retry and circuit breaking for agent queries.
+
+A 429 or 5xx from the model API (through the proxy) ends an agent turn with
+an error result instead of an exception. ``run_stage`` turns that into
+``TransientLLMError`` and retries the stage on the same session after a
+jittered exponential backoff, so the agent's history and the files it already
+changed are kept and it continues from there.
+
+One ``CircuitBreaker`` is shared by every run in the process. After
+``BREAKER_THRESHOLD`` consecutive transient failures it opens and all stages
+wait ``BREAKER_COOLDOWN_SECONDS`` before a single probe query is let through;
+a successful probe closes it again.
+"""
+
+import asyncio
+import os
+import random
+import re
+import time
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "2"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "60"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "60"))
+
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+# AssistantMessage.error values worth retrying (newer SDKs)
+TRANSIENT_MESSAGE_ERRORS = {"rate_limit", "server_error"}
+# Error result text from CLIs that don't report api_error_status
+_TRANSIENT_TEXT = re.compile(
+    r"API Error:?\s*(?:408|429|5\d\d)\b|overloaded|rate[ _-]?limit|too many requests"
+    # Timeouts only in API/connection wording: a tool's "Command timed out" is not transient
+    r"|connection (?:error|reset|refused|timed? ?out)|request timed? ?out|API Error:[^\n]*\btimed? ?out",
+    re.IGNORECASE,
+)
+
+
+def error_kind(status: int | None, text: str) -> str:
+    """One of a fixed set of failure kinds, for labels that must not grow with error text."""
+    text = text.lower()
+    if status == 429 or re.search(r"rate[ _-]?limit|too many requests", text):
+        return "rate_limit"
+    if status == 529 or "overloaded" in text:
+        return "overloaded"
+    if status == 408 or re.search(r"timed? ?out", text):
+        return "timeout"
+    if re.search(r"connection", text):
+        return "connection"
+    if (status or 0) >= 500 or re.search(r"\b5\d\d\b|server[ _]error", text):
+        return "5xx"
+    return "other"
+
+
+class TransientLLMError(Exception):
+    """The model API failed in a way that is worth retrying."""
+
+    def __init__(self, reason: str, status: int | None = None) -> None:
+        self.reason = reason
+        self.status = status
+        self.kind = error_kind(status, reason)
+        self.partial = None     # StageResult of the failed attempt, for usage accounting
+        super().__init__(reason)
+
+
+def transient_result_error(message) -> TransientLLMError | None:
+    """TransientLLMError for an error ResultMessage caused by a retryable API failure."""
+    if not getattr(message, "is_error", False):
+        return None
+    status = getattr(message, "api_error_status", None)
+    text = (getattr(message, "result", None) or "").strip()
+    if status in TRANSIENT_STATUSES or (status is None and _TRANSIENT_TEXT.search(text)):
+        return TransientLLMError(text[:200] or f"API error {status}", status)
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for retry ``attempt`` (1-based)."""
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed → open (cooldown) → half-open (one probe)."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN_SECONDS) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def remaining(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "retry_in": round(self.remaining(), 1)}
+
+    async def wait(self, on_wait=None) -> bool:
+        """Return once a query may be sent; True if the caller is the half-open probe.
+
+        ``on_wait(snapshot)`` is awaited before each cooldown pause.
+        """
+        while True:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half_open":
+                if not self._probing:
+                    self._probing = True
+                    return True
+                await asyncio.sleep(1.0)
+                continue
+            if on_wait is not None:
+                await on_wait(self.snapshot())
+            await asyncio.sleep(self.remaining())
+
+    def record_success(self) -> bool:
+        """Reset after a successful query; True if this closed an open breaker."""
+        was_open = self._opened_at is not None
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        return was_open
+
+    def abandon(self) -> None:
+        """Let another probe through when this one ended without reaching the API verdict."""
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """Count a transient failure; True if this (re)opened the breaker."""
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            return True
+        return False
+
+
+breaker = CircuitBreaker()
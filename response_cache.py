@@ -0,0 +1,96 @@
+"""Content-addressed cache for one-shot agent responses.
+
+REPORT and the optimizer's clarifying questions are pure functions of their
+prompt, the model and the state of the tree. Their responses are stored on
+local disk under a SHA-256 of those inputs, so reruns and resumes with
+identical inputs skip the call. Test timings ("0.42s") are masked before
+hashing so an unchanged test run still matches.
+
+Entries are plain JSON files; reads refresh their mtime, and writes evict the
+least recently used entries once the directory exceeds
+``RESPONSE_CACHE_MAX_BYTES``.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1") not in ("0", "false", "no")
+RESPONSE_CACHE_DIR = os.getenv(
+    "RESPONSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tdd-pipeline", "responses")
+)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+_TIMING = re.compile(r"\b\d+(?:\.\d+)?\s*(?:ms|s|sec|seconds)\b")
+
+
+def cache_key(kind: str, prompt: str, model: str | None, tree_hash: str) -> str:
+    digest = hashlib.sha256()
+    for part in (kind, model or "", tree_hash, _TIMING.sub("<t>", prompt)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, directory: str = RESPONSE_CACHE_DIR, max_bytes: int = RESPONSE_CACHE_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        if not RESPONSE_CACHE:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)      # LRU: a hit makes the entry recent again
+        except (OSError, ValueError):
+            return None
+        return entry.get("text")
+
+    def put(self, key: str, text: str, kind: str) -> None:
+        if not RESPONSE_CACHE:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump({"kind": kind, "created": time.time(), "text": text}, f)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache is under 90% of its limit."""
+        entries: list[tuple[float, int, str]] = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,128 @@
+"""Incremental run state folded from the pipeline's event stream.
+
+``RunState.apply`` is called for every event as it is emitted and keeps a
+compact picture of the run: files touched, tool calls, turns and cost per
+stage, the verification timeline and how often each stage kind has run.
+Status, stop summaries and resume read this instead of re-scanning the event
+history.
+"""
+
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, field
+
+# Tools whose file_path input names a file the agent changed
+_WRITE_TOOLS = {"Write", "Edit", "MultiEdit", "NotebookEdit"}
+_ROUND = re.compile(r"\(round (\d+)/(\d+)\)")
+
+
+@dataclass
+class StageStats:
+    name: str
+    kind: str = ""
+    started_at: float = 0.0
+    tools: dict[str, int] = field(default_factory=dict)
+    tool_errors: int = 0
+    turns: int = 0
+    cost_usd: float = 0.0
+    duration_ms: int = 0
+
+
+@dataclass
+class RunState:
+    target: str = ""
+    stage: str = ""
+    stages: dict[str, StageStats] = field(default_factory=dict)
+    files_touched: set[str] = field(default_factory=set)
+    verifications: list[dict] = field(default_factory=list)
+    iterations: dict[str, int] = field(default_factory=dict)    # stage kind → times run
+    rounds: dict[str, list[int]] = field(default_factory=dict)   # stage kind → [round, of]
+    timeouts: list[dict] = field(default_factory=list)
+    retries: int = 0
+    human_messages: int = 0
+    cost_usd: float = 0.0
+    tokens_used: int = 0
+    events: int = 0
+    _kind: str = ""         # kind announced by the latest prompt_size event
+
+    def _current(self) -> StageStats | None:
+        return self.stages.get(self.stage)
+
+    def apply(self, event: dict) -> None:
+        """Fold one event into the state."""
+        self.events += 1
+        kind = event.get("type")
+        data = event.get("data") or {}
+        if kind == "init":
+            self.target = data.get("target", "")
+        elif kind == "prompt_size":
+            # Emitted just before the stage banner: names the stage kind
+            self._kind = data.get("kind", "")
+            self.iterations[self._kind] = self.iterations.get(self._kind, 0) + 1
+        elif kind == "banner":
+            name = data.get("stage", "")
+            self.stage = name
+            self.stages.setdefault(name, StageStats(name, self._kind, time.time()))
+            self._kind = ""
+            if match := _ROUND.search(name):
+                self.rounds[self.stages[name].kind or name] = [int(match[1]), int(match[2])]
+        elif kind == "tool":
+            stats = self._current()
+            tool = data.get("tool", "")
+            if stats is not None:
+                stats.tools[tool] = stats.tools.get(tool, 0) + 1
+            path = (data.get("input") or {}).get("file_path")
+            if tool in _WRITE_TOOLS and isinstance(path, str):
+                if self.target and os.path.isabs(path):
+                    path = os.path.relpath(path, self.target)
+                self.files_touched.add(path)
+        elif kind == "tool_error":
+            if stats := self._current():
+                stats.tool_errors += 1
+        elif kind == "result":
+            if stats := self._current():
+                stats.turns += data.get("turns") or 0
+                stats.duration_ms += data.get("duration") or 0
+        elif kind == "budget":
+            # Emitted after each stage: the cost delta belongs to it
+            cost = data.get("cost_usd", 0.0)
+            if stats := self._current():
+                stats.cost_usd = round(stats.cost_usd + cost - self.cost_usd, 6)
+            self.cost_usd = cost
+            self.tokens_used = data.get("tokens_used", 0)
+        elif kind == "test_verify":
+            self.verifications.append({
+                "stage": data.get("stage", ""),
+                "outcome": data.get("outcome", ""),
+                "total": data.get("total_tests", 0),
+                "failures": data.get("failures", 0),
+                "errors": data.get("errors", 0),
+                "at": time.time(),
+            })
+        elif kind == "timeout":
+            self.timeouts.append({"stage": data.get("stage", ""), "reason": data.get("reason", "")})
+        elif kind == "retry":
+            self.retries += 1
+        elif kind == "human_input":
+            self.human_messages += 1
+
+    @property
+    def last_verification(self) -> dict | None:
+        return self.verifications[-1] if self.verifications else None
+
+    def snapshot(self) -> dict:
+        return {
+            "stage": self.stage,
+            "stages": [asdict(stats) for stats in self.stages.values()],
+            "files_touched": sorted(self.files_touched),
+            "verifications": list(self.verifications),
+            "iterations": dict(self.iterations),
+            "rounds": {kind: list(r) for kind, r in self.rounds.items()},
+            "timeouts": list(self.timeouts),
+            "retries": self.retries,
+            "human_messages": self.human_messages,
+            "cost_usd": self.cost_usd,
+            "tokens_used": self.tokens_used,
+            "events": self.events,
+        }
@@ -0,0 +1,194 @@
+"""Wall-clock deadlines and heartbeats for agent stages.
+
+``max_turns`` bounds how much a stage does, not how long it takes: a slow
+tool or a hung Bash command can hold a stage forever. A ``StageWatchdog``
+runs next to each stage and
+
+- interrupts the agent once the stage exceeds its deadline
+  (``STAGE_DEADLINE_SECONDS``, or per stage kind via ``STAGE_DEADLINES``),
+- interrupts it when a single tool call runs past its deadline
+  (``TOOL_DEADLINE_SECONDS``, or per tool via ``TOOL_DEADLINES``),
+- interrupts it once it has used ``max_turns`` model turns (the run budget's
+  per-stage turn cap; the session's own ``max_turns`` can't change per stage),
+- emits a ``heartbeat`` every ``HEARTBEAT_SECONDS`` with the stage's elapsed
+  time, how long since the agent last produced anything and which tools are
+  running, so the UI can tell a slow stage from a hung one.
+
+Between turns the stage may be waiting on the circuit breaker, the rate
+limiter or a retry backoff; those waits run through ``between_turns`` so an
+expiry cancels them instead of letting the stage sleep past its deadline.
+
+An expiry is recorded as a ``timeout`` event; the interrupted stage returns
+its partial result and the pipeline carries on through the stage's usual
+fallback (failed gate → fix round, missing verdict → another review round).
+"""
+
+import asyncio
+import os
+import time
+
+from claude_agent_sdk import ClaudeSDKClient
+
+from events import EventBus
+
+
+def _parse_deadlines(spec: str) -> dict[str, float]:
+    deadlines = {}
+    for item in spec.split(","):
+        name, sep, seconds = item.partition("=")
+        if sep and seconds.strip():
+            deadlines[name.strip()] = float(seconds)
+    return deadlines
+
+
+# 0 disables a deadline
+STAGE_DEADLINE_SECONDS = float(os.getenv("STAGE_DEADLINE_SECONDS", "1800"))
+STAGE_DEADLINES = _parse_deadlines(os.getenv("STAGE_DEADLINES", ""))       # "GREEN=2400,REPORT=300"
+TOOL_DEADLINE_SECONDS = float(os.getenv("TOOL_DEADLINE_SECONDS", "900"))
+TOOL_DEADLINES = _parse_deadlines(os.getenv("TOOL_DEADLINES", ""))         # "Bash=600,Read=60"
+HEARTBEAT_SECONDS = float(os.getenv("HEARTBEAT_SECONDS", "15"))
+
+_TICK_SECONDS = 1.0
+
+
+def stage_deadline(kind: str) -> float | None:
+    seconds = STAGE_DEADLINES.get(kind, STAGE_DEADLINE_SECONDS)
+    return seconds if seconds > 0 else None
+
+
+def tool_deadline(tool: str) -> float | None:
+    seconds = TOOL_DEADLINES.get(tool, TOOL_DEADLINE_SECONDS)
+    return seconds if seconds > 0 else None
+
+
+class StageWatchdog:
+    """Deadlines and heartbeats for one ``run_stage`` call."""
+
+    def __init__(
+        self,
+        client: ClaudeSDKClient,
+        stage: str,
+        deadline: float | None,
+        event_bus: EventBus | None = None,
+        max_turns: int | None = None,
+    ) -> None:
+        self.client = client
+        self.stage = stage
+        self.deadline = deadline
+        self.max_turns = max_turns
+        self.model_turns = 0
+        self.event_bus = event_bus
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.expired: str | None = None             # reason, once a deadline has passed
+        self._tools: dict[str, tuple[str, float]] = {}  # tool_use_id → (tool, started)
+        self._in_turn = False
+        self._waiting: asyncio.Future | None = None    # between-turn wait an expiry cancels
+        self._task: asyncio.Task | None = None
+
+    # ── Fed by the stage's receive loop ──
+
+    def turn_started(self) -> None:
+        self._in_turn = True
+        self.model_turns += 1
+        self.last_activity = time.monotonic()
+
+    def model_turn(self) -> None:
+        """The model starts another turn of the same query (its tool calls are all back)."""
+        self.model_turns += 1
+
+    def turn_ended(self) -> None:
+        self._in_turn = False
+        self._tools.clear()
+
+    def activity(self) -> None:
+        self.last_activity = time.monotonic()
+
+    def tool_started(self, tool_use_id: str, tool: str) -> None:
+        self._tools[tool_use_id] = (tool, time.monotonic())
+
+    def tool_finished(self, tool_use_id: str) -> None:
+        self._tools.pop(tool_use_id, None)
+
+    async def between_turns(self, coro):
+        """Await ``coro`` unless the deadline passes first; None once the stage has expired."""
+        if self.expired is not None:
+            coro.close()
+            return None
+        waiting = self._waiting = asyncio.ensure_future(coro)
+        try:
+            await asyncio.wait({waiting})
+        except asyncio.CancelledError:
+            waiting.cancel()
+            raise
+        finally:
+            self._waiting = None
+        return None if waiting.cancelled() else waiting.result()
+
+    # ── Lifecycle ──
+
+    async def __aenter__(self) -> "StageWatchdog":
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _overdue(self, now: float) -> str | None:
+        if self.deadline is not None and now - self.started > self.deadline:
+            return f"stage exceeded its {self.deadline:.0f}s deadline"
+        if self.max_turns is not None and self.model_turns > self.max_turns:
+            return f"stage used its {self.max_turns}-turn budget"
+        for tool, started in self._tools.values():
+            limit = tool_deadline(tool)
+            if limit is not None and now - started > limit:
+                return f"{tool} call exceeded its {limit:.0f}s deadline"
+        return None
+
+    def snapshot(self, now: float | None = None) -> dict:
+        now = now or time.monotonic()
+        idle = now - self.last_activity
+        if self._tools:
+            state = "tool"
+        elif not self._in_turn:
+            state = "waiting"       # between queries: rate limit, backoff
+        else:
+            state = "model"
+        return {
+            "stage": self.stage,
+            "state": state,
+            "elapsed_seconds": round(now - self.started, 1),
+            "idle_seconds": round(idle, 1),
+            "deadline_seconds": self.deadline,
+            "tools": [
+                {"tool": tool, "seconds": round(now - started, 1)} for tool, started in self._tools.values()
+            ],
+        }
+
+    async def _emit(self, event: dict) -> None:
+        if self.event_bus:
+            await self.event_bus.emit(event)
+
+    async def _watch(self) -> None:
+        next_beat = self.started + HEARTBEAT_SECONDS
+        while True:
+            await asyncio.sleep(_TICK_SECONDS)
+            now = time.monotonic()
+            if self.expired is None and (reason := self._overdue(now)):
+                self.expired = reason
+                print(f"  [{self.stage}] TIMEOUT: {reason} — interrupting")
+                await self._emit({"type": "timeout", "data": {**self.snapshot(now), "reason": reason}})
+                if self._in_turn:
+                    try:
+                        await self.client.interrupt()
+                    except Exception as exc:
+                        print(f"  [{self.stage}] interrupt failed: {exc}")
+                elif self._waiting is not None:
+                    self._waiting.cancel()
+            if HEARTBEAT_SECONDS > 0 and now >= next_beat:
+                next_beat = now + HEARTBEAT_SECONDS
+                await self._emit({"type": "heartbeat", "data": self.snapshot(now)})
@@ -46,20 +46,47 @@ export async function postMkdir(target) {
   });
 }
 
-export async function postMessage(message) {
+export async function postMessage(message, mode) {
   return fetch('/api/message', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ message }),
+    body: JSON.stringify({ message, mode }),
   });
 }
 
-export async function postOptimize(ticket, target) {
-  return fetch('/api/optimize', {
+// POST an optimize request and call onEvent(type, data) for each SSE event.
+// EventSource only does GET, so the stream is read and split into frames here.
+export async function streamOptimize(ticket, target, onEvent) {
+  const res = await fetch('/api/optimize/stream', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({ ticket, target }),
   });
+  if (!res.ok) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data.error || `Request failed (${res.status})`);
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    // sse-starlette ends lines with CRLF; a chunk may split one, so normalise the whole buffer
+    buffer = (buffer + decoder.decode(value, { stream: true })).replace(/\r\n/g, '\n');
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let type = 'message';
+      const data = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).replace(/^ /, ''));
+      }
+      if (data.length) onEvent(type, JSON.parse(data.join('\n')));
+    }
+  }
 }
 
 export async function postOptimizeSubmit(ticket, target, context, answers) {
@@ -61,7 +61,8 @@ async function sendHumanMessage() {
   textarea.value = '';
   textarea.style.height = '';
   try {
-    await postMessage(msg);
+    const mode = document.getElementById('human-interrupt').checked ? 'interrupt' : 'queue';
+    await postMessage(msg, mode);
   } catch (err) {
     textarea.value = msg; // restore if failed
   }
@@ -72,6 +73,7 @@ async function init() {
   const config = await fetchConfig();
   const targetInput = document.getElementById('target');
   targetInput.value = config.default_target;
+  document.getElementById('human-interrupt').checked = config.operator_message_mode !== 'queue';
   targetInput.placeholder = 'Enter target path';
   targetInput.disabled = false;
 
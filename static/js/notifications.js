@@ -79,5 +79,9 @@ export function showSummary(summary) {
     ${metaHtml ? '<div class="summary-meta">' + metaHtml + '</div>' : ''}
     <div class="summary-body"></div>`;
   el.querySelector('.summary-body').textContent = summary.summary || JSON.stringify(summary, null, 2);
+  if (summary.enrichment === 'pending') {
+    el.insertAdjacentHTML('beforeend',
+      '<div class="summary-meta">A narrative summary is being written in the background and will be used when you resume.</div>');
+  }
   document.getElementById('stages').appendChild(el);
 }
@@ -1,5 +1,5 @@
 // Plan optimizer: Q&A flow for refining vague tickets
-import { postOptimize, postOptimizeSubmit } from './api.js';
+import { streamOptimize, postOptimizeSubmit } from './api.js';
 
 let _context = '';
 let _questions = [];
@@ -20,19 +20,35 @@ export async function startOptimize() {
 
   btn.disabled = true;
   btn.textContent = 'Analyzing...';
-  panel.innerHTML = '<div class="opt-loading"><span class="spinner"></span> Analyzing ticket...</div>';
+  _context = '';
+  _questions = [];
+  panel.innerHTML = '<div id="opt-context"></div><div id="opt-questions" class="opt-questions"></div>'
+    + '<div class="opt-loading"><span class="spinner"></span> <span id="opt-progress">Analyzing ticket...</span></div>';
   panel.style.display = 'block';
 
   try {
-    const res = await postOptimize(ticket, target);
-    const data = await res.json();
-    if (!res.ok) {
-      panel.innerHTML = `<div class="opt-error">${esc(data.error || 'Failed')}</div>`;
-      return;
-    }
-    _context = data.context || '';
-    _questions = data.questions || [];
-    renderQuestions(data);
+    let finished = false;
+    await streamOptimize(ticket, target, (type, data) => {
+      if (type === 'progress') {
+        const el = document.getElementById('opt-progress');
+        if (el) el.textContent = data.message;
+      } else if (type === 'context') {
+        _context = data.context || '';
+        renderContext(_context);
+      } else if (type === 'question') {
+        _questions.push(data);
+        appendQuestion(data);
+      } else if (type === 'done') {
+        finished = true;
+        _context = data.context || _context;
+        _questions = data.questions || _questions;
+        renderActions();
+      } else if (type === 'error') {
+        finished = true;
+        panel.innerHTML = `<div class="opt-error">${esc(data.error || 'Failed')}</div>`;
+      }
+    });
+    if (!finished) panel.innerHTML = '<div class="opt-error">Optimizer stream ended unexpectedly</div>';
   } catch (err) {
     panel.innerHTML = `<div class="opt-error">${esc(err.message)}</div>`;
   } finally {
@@ -42,37 +58,43 @@ export async function startOptimize() {
 }
 
 
-function renderQuestions(data) {
-  const panel = document.getElementById('optimize-panel');
-  const qid = id => esc(String(id));
+function renderContext(context) {
+  const el = document.getElementById('opt-context');
+  if (el && context) el.innerHTML = `<div class="opt-context">${esc(context)}</div>`;
+}
 
-  let h = '';
-  if (data.context) h += `<div class="opt-context">${esc(data.context)}</div>`;
+function appendQuestion(q) {
+  const list = document.getElementById('opt-questions');
+  if (!list) return;
+  const qid = esc(String(q.id));
 
-  for (const q of (data.questions || [])) {
-    h += `<div class="opt-q"><div class="opt-q-text">${esc(q.question)}</div><div class="opt-opts">`;
-    for (const opt of q.options) {
-      h += `<label class="opt-opt"><input type="radio" name="q${qid(q.id)}" value="${esc(opt)}"><span>${esc(opt)}</span></label>`;
-    }
-    h += `<label class="opt-opt opt-custom"><input type="radio" name="q${qid(q.id)}" value="__custom__"><input type="text" class="opt-custom-input" placeholder="Other..." disabled></label>`;
-    h += '</div></div>';
+  let h = `<div class="opt-q"><div class="opt-q-text">${esc(q.question)}</div><div class="opt-opts">`;
+  for (const opt of (q.options || [])) {
+    h += `<label class="opt-opt"><input type="radio" name="q${qid}" value="${esc(opt)}"><span>${esc(opt)}</span></label>`;
   }
-
-  h += '<div class="opt-actions"><button id="rewrite-btn" onclick="submitOptimize()">Rewrite Ticket</button></div>';
-  panel.innerHTML = h;
-
-  // Wire "Other" radios
-  panel.querySelectorAll('.opt-custom input[type="radio"]').forEach(radio => {
-    const txt = radio.parentElement.querySelector('.opt-custom-input');
-    panel.querySelectorAll(`input[name="${radio.name}"]`).forEach(r => {
-      r.addEventListener('change', () => {
-        txt.disabled = !radio.checked;
-        if (radio.checked) txt.focus();
-      });
+  h += `<label class="opt-opt opt-custom"><input type="radio" name="q${qid}" value="__custom__"><input type="text" class="opt-custom-input" placeholder="Other..." disabled></label>`;
+  h += '</div></div>';
+  list.insertAdjacentHTML('beforeend', h);
+
+  // Wire the "Other" radio
+  const card = list.lastElementChild;
+  const radio = card.querySelector('.opt-custom input[type="radio"]');
+  const txt = card.querySelector('.opt-custom-input');
+  card.querySelectorAll(`input[name="${radio.name}"]`).forEach(r => {
+    r.addEventListener('change', () => {
+      txt.disabled = !radio.checked;
+      if (radio.checked) txt.focus();
     });
   });
 }
 
+function renderActions() {
+  const panel = document.getElementById('optimize-panel');
+  panel.querySelectorAll('.opt-loading').forEach(e => e.remove());
+  panel.insertAdjacentHTML('beforeend',
+    '<div class="opt-actions"><button id="rewrite-btn" onclick="submitOptimize()">Rewrite Ticket</button></div>');
+}
+
 export async function submitOptimize() {
   const ticket = document.getElementById('ticket').value.trim();
   const target = document.getElementById('target').value.trim();
@@ -76,6 +76,29 @@ export function connectSSE() {
     addHumanMessage(d.message);
   });
 
+  // Heartbeats say what the stage is waiting on, so a slow stage can be told from a hung one
+  state.evtSource.addEventListener('heartbeat', e => {
+    const d = JSON.parse(e.data);
+    const el = document.getElementById('heartbeat');
+    if (!el) return;
+    const what = d.tools.length
+      ? `running ${d.tools.map(t => `${t.tool} ${Math.round(t.seconds)}s`).join(', ')}`
+      : { model: 'model working', waiting: 'waiting to send' }[d.state] || d.state;
+    el.textContent = `${what} · last output ${Math.round(d.idle_seconds)}s ago`;
+    el.classList.toggle('quiet', d.idle_seconds > 120);
+  });
+
+  state.evtSource.addEventListener('timeout', e => {
+    const d = JSON.parse(e.data);
+    addError(`${d.stage}: ${d.reason}`);
+  });
+
+  state.evtSource.addEventListener('human_delivered', e => {
+    const d = JSON.parse(e.data);
+    const via = { interrupt: 'interrupting the agent', query: 'with the next prompt', tool_call: 'at the next tool call' }[d.via] || d.via;
+    addLog(`Message delivered ${via} after ${(d.latency_ms / 1000).toFixed(1)}s`);
+  });
+
   state.evtSource.addEventListener('agent_text', e => {
     const d = JSON.parse(e.data);
     addStageText(d.text);
@@ -108,6 +131,7 @@ export function connectSSE() {
 
   state.evtSource.addEventListener('done', () => {
     finalizeCurrent();
+    document.getElementById('heartbeat').textContent = '';
     stopTimer();
     document.getElementById('indicator').className = 'dot done';
     document.getElementById('form-card').classList.remove('hidden');
@@ -1,99 +1,177 @@
-"""Summarization agent for stopped TDD pipelines.
-
-When a user stops a running pipeline, this module spins up a short-lived
-Claude agent session to read the codebase and produce a structured summary
-of what was completed, what's in progress, and what's failing.
+"""Summaries for stopped TDD pipelines.
+
+When a user stops a running pipeline, ``build_summary`` assembles a
+structured summary right away from what the run already knows: the folded
+run state, the tracker's last test result and the git diff of the working
+tree. It is written to ``.tdd_summary.json`` immediately, so stopping never
+waits on a model call.
+
+``enrich_summary`` then runs a short-lived Claude agent session in the
+background to read the codebase and write a narrative of what was completed,
+what's in progress and what's failing. The narrative is merged into the saved
+summary when it is ready, unless a newer summary has replaced it meanwhile.
 """
 
+import asyncio
 import json
 import os
+import threading
 import time
 
-from claude_agent_sdk import ClaudeAgentOptions, ClaudeSDKClient
+from claude_agent_sdk import ClaudeAgentOptions
 
+from client_pool import shared_pool
+from diff_context import collect_diff
 from events import EventBus
 from pipeline import run_stage
-from test_tracker import TestTracker
-from test_verifier import verify_tests
+from prompt_registry import load_prompt
+from rate_limiter import PRIORITY_BACKGROUND
+from run_state import RunState
+from test_tracker import TestOutcome, TestTracker
 
-_PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
 SUMMARIZE_MODEL = os.getenv("SUMMARIZE_MODEL", "sonnet") or None
+SUMMARY_FILE = ".tdd_summary.json"
+# Failing test names kept in the summary
+MAX_FAILED_TESTS = 20
+
+# Serialises summary writes, so a compare-and-save can't interleave with a newer save
+_save_lock = threading.Lock()
+
+
+def _test_status(tracker: TestTracker, run_state: RunState) -> dict:
+    """Latest known test status: the tracker's last run, else the last verification."""
+    result = tracker.last_result
+    if result is not None:
+        return {
+            "passing": result.outcome == TestOutcome.PASS,
+            "total": result.total_tests,
+            "failures": result.failures,
+            "errors": result.errors,
+            "command": result.command,
+            "failed_tests": result.failed_tests[:MAX_FAILED_TESTS],
+        }
+    verification = run_state.last_verification
+    if verification is not None:
+        return {
+            "passing": verification["outcome"] == TestOutcome.PASS.value,
+            "total": verification["total"],
+            "failures": verification["failures"],
+            "errors": verification["errors"],
+            "command": tracker.canonical_test_command,
+            "failed_tests": [],
+        }
+    return {
+        "passing": False, "total": 0, "failures": 0, "errors": 0,
+        "command": tracker.canonical_test_command, "failed_tests": [], "unknown": True,
+    }
+
+
+def _changed_files(target: str) -> list[dict]:
+    """Uncommitted changes against HEAD (the run's baseline unless it already committed)."""
+    try:
+        diffs = collect_diff(target, "HEAD")
+    except (OSError, RuntimeError):
+        return []
+    return [
+        {"path": d.path, "status": d.status_label, "added": d.added, "removed": d.removed}
+        for d in diffs
+    ]
+
+
+def _render(summary: dict) -> str:
+    """Plain-text account of the stopped run, built from the summary fields."""
+    ts = summary["test_status"]
+    if ts.get("unknown"):
+        tests = "no test run recorded"
+    else:
+        tests = (
+            f"{'PASSING' if ts['passing'] else 'FAILING'} — {ts['total']} tests, "
+            f"{ts['failures']} failures, {ts['errors']} errors"
+        )
+    lines = [
+        f"Stopped during {summary['interrupted_stage']}.",
+        f"Completed stages: {', '.join(summary['completed_stages']) or '(none)'}",
+        f"Tests: {tests}",
+    ]
+    if ts["failed_tests"]:
+        lines.append("Failing tests:")
+        lines.extend(f"  - {name}" for name in ts["failed_tests"])
+    if summary["changes"]:
+        lines.append("Uncommitted changes:")
+        for change in summary["changes"]:
+            counts = "binary" if change["added"] is None else f"+{change['added']} -{change['removed']}"
+            lines.append(f"  - {change['path']} ({change['status']}, {counts})")
+    elif summary["files_modified"]:
+        lines.append("Files edited by the agents:")
+        lines.extend(f"  - {path}" for path in summary["files_modified"])
+    return "\n".join(lines)
+
+
+def _write(summary: dict) -> str:
+    summary_path = os.path.join(summary["target"], SUMMARY_FILE)
+    tmp = f"{summary_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp, summary_path)
+    return summary_path
+
+
+def _save(summary: dict) -> str:
+    with _save_lock:
+        return _write(summary)
 
 
-def _load_prompt(name: str, **kwargs: str) -> str:
-    path = os.path.join(_PROMPTS_DIR, f"{name}.md")
-    with open(path) as f:
-        template = f.read()
-    return template.format(**kwargs) if kwargs else template
+def _replace_if_current(enriched: dict) -> bool:
+    """Save ``enriched`` only if the saved summary is still the one it was built from."""
+    summary_path = os.path.join(enriched["target"], SUMMARY_FILE)
+    with _save_lock:
+        try:
+            with open(summary_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("timestamp") != enriched["timestamp"]:
+            return False
+        _write(enriched)
+        return True
 
 
-async def summarize_pipeline(
+async def build_summary(
     ticket: str,
     target: str,
     completed_stages: list[str],
     interrupted_stage: str,
     tracker: TestTracker,
-    event_history: list[dict],
-    event_bus: EventBus | None = None,
+    run_state: RunState,
 ) -> dict:
-    """Run a summarization agent and return a structured summary dict.
-
-    The agent reads modified files and test files, assesses current state,
-    and produces a JSON summary that can be used to resume in a new session.
-    """
-    if event_bus:
-        await event_bus.emit({
-            "type": "log",
-            "data": {"message": "Running summarization agent..."},
-        })
-
-    # Run independent test verification to get current test status
-    test_result = await verify_tests(tracker, target)
-    test_status = {
-        "passing": test_result.outcome.value == "pass",
-        "total": test_result.total_tests,
-        "failures": test_result.failures,
-        "errors": test_result.errors,
-        "command": test_result.command,
+    """Build and save the deterministic summary of a stopped run; no model calls."""
+    changes = await asyncio.to_thread(_changed_files, target)
+    files = run_state.files_touched | {c["path"] for c in changes}
+    summary = {
+        "ticket": ticket[:1000],
+        "target": target,
+        "completed_stages": completed_stages,
+        "interrupted_stage": interrupted_stage,
+        "test_status": _test_status(tracker, run_state),
+        "files_modified": sorted(files),
+        "changes": changes,
+        "run": run_state.snapshot(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "enrichment": "pending",
     }
+    summary["facts"] = _render(summary)
+    summary["summary"] = summary["facts"]
+    await asyncio.to_thread(_save, summary)
+    return summary
 
-    # Extract files modified from event history (tool events with Write/Edit)
-    files_modified = set()
-    for event in event_history:
-        if event.get("type") == "tool":
-            data = event.get("data", {})
-            tool = data.get("tool", "")
-            inp = data.get("input", {})
-            if tool in ("Write", "Edit") and "file_path" in inp:
-                fpath = inp["file_path"]
-                # Make relative to target if possible
-                if isinstance(fpath, str):
-                    try:
-                        fpath = os.path.relpath(fpath, target)
-                    except ValueError:
-                        pass
-                    files_modified.add(fpath)
-
-    # Build context for the summarization agent
-    files_list = "\n".join(f"  - {f}" for f in sorted(files_modified)) or "  (none detected)"
-    test_status_str = (
-        f"Passing: {test_status['passing']}, "
-        f"Total: {test_status['total']}, "
-        f"Failures: {test_status['failures']}, "
-        f"Errors: {test_status['errors']}"
-    )
 
-    prompt = _load_prompt(
-        "summarize",
-        ticket=ticket[:500],
-        completed_stages=", ".join(completed_stages) or "(none)",
-        interrupted_stage=interrupted_stage,
-        test_status=test_status_str,
-        files_modified=files_list,
-    )
+async def enrich_summary(summary: dict, event_bus: EventBus | None = None) -> dict:
+    """Add an agent-written narrative to a saved summary and save it again.
 
-    # Fork the pipeline session if available so the summarizer has full context,
-    # otherwise fall back to a fresh session.
+    The agent reads modified files and test files, assesses current state,
+    and writes a narrative that can be used to resume in a new session.
+    """
+    target = summary["target"]
     options = ClaudeAgentOptions(
         allowed_tools=["Read", "Glob", "Grep", "Bash"],
         permission_mode="bypassPermissions",
@@ -101,39 +179,40 @@ async def summarize_pipeline(
         cwd=target,
         max_turns=15,
     )
+    ts = summary["test_status"]
+    prompt = load_prompt(
+        "summarize",
+        ticket=summary["ticket"][:500],
+        completed_stages=", ".join(summary["completed_stages"]) or "(none)",
+        interrupted_stage=summary["interrupted_stage"],
+        test_status=(
+            f"Passing: {ts['passing']}, Total: {ts['total']}, "
+            f"Failures: {ts['failures']}, Errors: {ts['errors']}"
+        ),
+        files_modified="\n".join(f"  - {f}" for f in summary["files_modified"]) or "  (none detected)",
+    )
 
-    summary_text = ""
-    async with ClaudeSDKClient(options=options) as client:
-        result = await run_stage(
-            client,
-            "SUMMARIZE",
-            "Generating pipeline summary",
-            prompt,
-            event_bus=event_bus,
-        )
-        summary_text = result.text
-
-    # Build the structured summary
-    summary = {
-        "ticket": ticket[:1000],
-        "target": target,
-        "completed_stages": completed_stages,
-        "interrupted_stage": interrupted_stage,
-        "test_status": test_status,
-        "files_modified": sorted(files_modified),
-        "summary": summary_text,
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-    }
-
-    # Save to target directory
-    summary_path = os.path.join(target, ".tdd_summary.json")
-    with open(summary_path, "w") as f:
-        json.dump(summary, f, indent=2)
-
-    if event_bus:
-        await event_bus.emit({
-            "type": "log",
-            "data": {"message": f"Summary saved to {summary_path}"},
-        })
-
-    return summary
+    try:
+        async with shared_pool.session(options, "SUMMARIZE", event_bus) as client:
+            result = await run_stage(
+                client,
+                "SUMMARIZE",
+                "Generating pipeline summary",
+                prompt,
+                event_bus=event_bus,
+                model=SUMMARIZE_MODEL,
+                priority=PRIORITY_BACKGROUND,
+            )
+        narrative, status = result.text, "done"
+    except Exception as exc:
+        print(f"  Summary enrichment failed: {exc}")
+        narrative, status = "", "failed"
+
+    enriched = {**summary, "enrichment": status}
+    if narrative:
+        enriched["narrative"] = narrative
+        enriched["summary"] = narrative
+    if not await asyncio.to_thread(_replace_if_current, enriched):
+        return summary      # replaced by a newer run's summary: keep that one
+    print(f"  Summary narrative saved to {os.path.join(target, SUMMARY_FILE)}")
+    return enriched
@@ -1,17 +1,34 @@
 """PostToolUse hook that monitors Bash test commands and injects corrective context."""
 
-import re
+import os
 import time
 from typing import Any
 
+from test_parsers import TestCounts, parse_output
 from test_tracker import (
     TestOutcome,
     TestResult,
     TestTracker,
     is_test_command,
-    parse_test_counts,
 )
 
+# Only the tail of a tool response is parsed and stored — runner summaries and
+# failure lists sit at the end, and agent test output can run to megabytes.
+MONITOR_PARSE_CHARS = int(os.getenv("MONITOR_PARSE_CHARS", "200000"))
+# Newly failing test names listed per injected message
+MONITOR_MAX_NEW_FAILURES = 10
+# Output tail injected when the runner's failing test names can't be parsed
+MONITOR_FALLBACK_TAIL_CHARS = 800
+
+
+def _bounded_tail(text: str, limit: int) -> str:
+    """Return at most ``limit`` trailing chars of ``text``, starting on a line boundary."""
+    if len(text) <= limit:
+        return text
+    tail = text[-limit:]
+    newline = tail.find("\n")
+    return tail[newline + 1:] if newline != -1 else tail
+
 
 def create_test_monitor_hook(tracker: TestTracker):
     """Return a PostToolUse callback bound to the given tracker.
@@ -21,13 +38,19 @@ def create_test_monitor_hook(tracker: TestTracker):
     2. Records the result in the tracker
     3. If tests failed, injects strong corrective context so the agent
        cannot claim failures are "intentional"
+
+    Injected context is a delta: only tests that are newly failing since the
+    previous recorded run are named, so repeated runs with the same failures
+    don't re-send the same output on every call.
     """
+    last_fallback_tail: str | None = None
 
-    async def hook(
+    async def test_monitor_hook(
         input_data: dict[str, Any],
         tool_use_id: str | None,
         context: Any,
     ) -> dict[str, Any]:
+        nonlocal last_fallback_tail
         command = input_data.get("tool_input", {}).get("command", "")
         if not is_test_command(command):
             return {}
@@ -35,13 +58,18 @@ def create_test_monitor_hook(tracker: TestTracker):
         tool_response = input_data.get("tool_response", "")
 
         # tool_response may be a dict with {output, exitCode} or a string
+        exit_code: int | None = None
         if isinstance(tool_response, dict):
             output_text = str(tool_response.get("output", ""))
             exit_code = int(tool_response.get("exitCode", 0))
         else:
             output_text = str(tool_response) if tool_response else ""
+
+        output_text = _bounded_tail(output_text, MONITOR_PARSE_CHARS)
+        counts = parse_output(command, output_text)
+        if exit_code is None:
             # Infer exit code from output content
-            exit_code = _infer_exit_code(output_text)
+            exit_code = _infer_exit_code(counts)
 
         outcome = TestOutcome.PASS if exit_code == 0 else TestOutcome.FAIL
 
@@ -51,14 +79,19 @@ def create_test_monitor_hook(tracker: TestTracker):
             stdout=output_text,
             stderr="",
             outcome=outcome,
+            total_tests=counts.total,
+            failures=counts.failures,
+            errors=counts.errors,
+            failed_tests=counts.failed_tests,
+            failure_excerpts=counts.excerpts,
             timestamp=time.time(),
         )
-        parse_test_counts(result, output_text)
 
         # If exit code says pass but output shows failures, override
         if outcome == TestOutcome.PASS and result.failures > 0:
             result.outcome = TestOutcome.FAIL
 
+        previous = tracker.last_result
         await tracker.record(result)
 
         if result.outcome == TestOutcome.FAIL:
@@ -86,10 +119,23 @@ def create_test_monitor_hook(tracker: TestTracker):
                 "intentional. Do NOT proceed until all tests pass."
             )
 
+            previously_failing = set(previous.failed_tests) if previous else set()
+            new_failures = [n for n in result.failed_tests if n not in previously_failing]
+            if new_failures:
+                shown = new_failures[:MONITOR_MAX_NEW_FAILURES]
+                more = len(new_failures) - len(shown)
+                context_msg += "\nNewly failing since the previous run:\n" + "\n".join(
+                    f"  - {name}" for name in shown
+                )
+                if more:
+                    context_msg += f"\n  ... and {more} more"
+            elif result.failed_tests:
+                context_msg += (
+                    f"\nThe same {len(result.failed_tests)} test(s) are still failing "
+                    "as in the previous run."
+                )
+
             if consecutive_same >= 3:
-                # Include the actual test output so the agent has the
-                # information it needs without having to re-run tests.
-                output_tail = output_text[-2000:] if output_text else "(no output)"
                 context_msg += (
                     f" WARNING: Same failure count for the last "
                     f"{consecutive_same} consecutive runs — you are stuck in a loop.\n"
@@ -99,11 +145,17 @@ def create_test_monitor_hook(tracker: TestTracker):
                     "  3. Find the exact assertion that is failing.\n"
                     "  4. Ask yourself: what must my implementation return/do to "
                     "satisfy that specific assertion?\n"
-                    "  5. Make only that one targeted change, then re-run.\n"
-                    "If the pipeline blocks you from editing a test file, that is "
-                    "correct — it means you must change the IMPLEMENTATION, not the test.\n"
-                    f"Last test output (for reference):\n```\n{output_tail}\n```"
+                    "  5. Make only that one targeted change, then re-run."
+                    "\nIf the pipeline blocks you from editing a test file, that is "
+                    "correct — it means you must change the IMPLEMENTATION, not the test."
                 )
+                # Without parsed test names, include the output tail — but only
+                # when it differs from the tail already injected.
+                if not result.failed_tests:
+                    output_tail = _bounded_tail(output_text, MONITOR_FALLBACK_TAIL_CHARS) or "(no output)"
+                    if output_tail != last_fallback_tail:
+                        last_fallback_tail = output_tail
+                        context_msg += f"\nLast test output (for reference):\n```\n{output_tail}\n```"
 
             return {
                 "hookSpecificOutput": {
@@ -114,16 +166,11 @@ def create_test_monitor_hook(tracker: TestTracker):
 
         return {}
 
-    return hook
+    return test_monitor_hook
 
 
-def _infer_exit_code(output: str) -> int:
+def _infer_exit_code(counts: TestCounts) -> int:
     """Best-effort exit code inference when not available directly."""
-    # Check for minitest failure pattern
-    m = re.search(r"(\d+)\s+failures?,\s*(\d+)\s+errors?", output)
-    if m and (int(m.group(1)) > 0 or int(m.group(2)) > 0):
-        return 1
-    # Check for explicit failure markers
-    if re.search(r"\bFAILED\b|\bFail(?:ure|ed)\b", output):
+    if counts.failures > 0 or counts.errors > 0 or counts.failed:
         return 1
     return 0
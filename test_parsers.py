@@ -0,0 +1,665 @@
+"""Streaming test-runner output parsers, keyed by test command.
+
+Each parser consumes output one line at a time and keeps only running
+totals, so a run is a single linear pass regardless of output size. Every
+pattern is anchored on a digit-run or word-run boundary (``(?<!\\d)``,
+``(?<![A-Za-z])``) so the regex engine never re-scans the same run from
+multiple start positions — the classic cause of catastrophic backtracking
+on long lines of digits or letters.
+"""
+
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable
+
+# "<count> <word>" pairs, e.g. "5 passed", "2 failures", "10 examples"
+_COUNT_WORD = re.compile(r"(?<!\d)(\d+)\s+([A-Za-z]+)")
+# "<Word>: <count>" pairs, e.g. "Failures: 2", "Total:    12"
+_WORD_COLON_COUNT = re.compile(r"(?<![A-Za-z])([A-Za-z]+):\s*(\d+)")
+# "<word>=<count>" pairs, e.g. "failures=2" (unittest)
+_WORD_EQ_COUNT = re.compile(r"(?<![A-Za-z])([A-Za-z]+)=(\d+)")
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+_GENERIC_FAILURE = re.compile(r"\bFAILED\b|\bFail(?:ure|ed)\b")
+# "  1) name" — numbered failure headers (phpunit, mocha, ExUnit)
+_NUMBERED = re.compile(r"\s*\d+\) (.+)")
+
+# Cap on failing test names kept per run, so huge failure lists stay bounded
+MAX_FAILED_NAMES = 200
+# Assertion excerpt kept per failing test: first N meaningful lines, each truncated
+EXCERPT_LINES = 6
+EXCERPT_LINE_CHARS = 200
+
+
+@dataclass
+class TestCounts:
+    """Totals extracted from a test run's output."""
+    total: int = 0
+    failures: int = 0
+    errors: int = 0
+    matched: bool = False   # a recognisable summary line was seen
+    failed: bool = False    # an explicit failure marker was seen
+    failed_tests: list[str] = field(default_factory=list)
+    excerpts: dict[str, str] = field(default_factory=dict)
+
+
+def _pairs(pattern: re.Pattern, line: str) -> dict[str, int]:
+    """Collect word → count pairs from a line, keyed by lower-case word."""
+    out: dict[str, int] = {}
+    for m in pattern.finditer(line):
+        if pattern is _COUNT_WORD:
+            out[m.group(2).lower()] = int(m.group(1))
+        else:
+            out[m.group(1).lower()] = int(m.group(2))
+    return out
+
+
+class OutputParser:
+    """Base class for a streaming parser: call feed_line() per line, then result().
+
+    Subclasses implement feed(). Calling _fail() records a failing test and,
+    by default, captures the next few meaningful lines as its excerpt.
+    """
+
+    name = "base"
+
+    def __init__(self) -> None:
+        self.counts = TestCounts()
+        self._failed_names: dict[str, None] = {}
+        self._excerpts: dict[str, list[str]] = {}
+        self._capturing: list[str] | None = None
+        self._capture_started = False
+
+    def feed(self, line: str) -> None:
+        raise NotImplementedError
+
+    def feed_line(self, line: str) -> None:
+        self._capture_started = False
+        before = (self.counts.total, self.counts.failures, self.counts.errors)
+        self.feed(line)
+        if self._capturing is None or self._capture_started:
+            return
+        if (self.counts.total, self.counts.failures, self.counts.errors) != before:
+            # A summary line ends any failure-detail block
+            self._capturing = None
+            return
+        text = line.strip()
+        captured = len(self._capturing)
+        if not text:
+            # A blank line ends the excerpt once it has some substance
+            if captured >= 2:
+                self._capturing = None
+        elif not text.strip("-=_⎯ "):
+            # Separators ("-----", "=====", "⎯⎯⎯") close a detail block
+            if captured:
+                self._capturing = None
+        else:
+            self._capturing.append(text[:EXCERPT_LINE_CHARS])
+            if captured + 1 >= EXCERPT_LINES:
+                self._capturing = None
+
+    def _capture(self, name: str) -> None:
+        """Start collecting excerpt lines for ``name`` from the next line on."""
+        name = name.strip()
+        if name and len(self._excerpts) < MAX_FAILED_NAMES:
+            self._capturing = self._excerpts[name] = []
+            self._capture_started = True
+        else:
+            self._capturing = None
+
+    def _fail(self, name: str, excerpt: list[str] | None = None, capture: bool = True) -> None:
+        """Record the identifier of a failing test (insertion-ordered, capped)."""
+        self._capturing = None
+        name = name.strip()
+        if not name or len(self._failed_names) >= MAX_FAILED_NAMES:
+            return
+        self._failed_names[name] = None
+        if excerpt:
+            self._excerpts[name] = [e.strip()[:EXCERPT_LINE_CHARS] for e in excerpt[:EXCERPT_LINES]]
+        elif capture:
+            self._capture(name)
+
+    def result(self) -> TestCounts:
+        self.counts.failed_tests = list(self._failed_names)
+        self.counts.excerpts = {
+            name: "\n".join(lines)
+            for name, lines in self._excerpts.items()
+            if lines and name in self._failed_names
+        }
+        return self.counts
+
+
+class MinitestParser(OutputParser):
+    """Rails / minitest: ``33 runs, 45 assertions, 2 failures, 0 errors, 0 skips``."""
+
+    name = "minitest"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._expect_name = False
+
+    def feed(self, line: str) -> None:
+        if self._expect_name and line.strip():
+            # "UsersControllerTest#test_create [test/...rb:19]:"
+            self._fail(line.split(" [", 1)[0].rstrip(":"))
+            self._expect_name = False
+        if "assertions" not in line:
+            if line.startswith(("Failure:", "Error:")):
+                self.counts.failed = True
+                self._expect_name = True
+                self._capturing = None
+            return
+        p = _pairs(_COUNT_WORD, line)
+        runs = p.get("runs", p.get("run", p.get("tests", p.get("test"))))
+        if runs is None:
+            return
+        self.counts.total = runs
+        self.counts.failures = p.get("failures", p.get("failure", 0))
+        self.counts.errors = p.get("errors", p.get("error", 0))
+        self.counts.matched = True
+
+
+class PytestParser(OutputParser):
+    """pytest: ``==== 2 failed, 5 passed, 1 error in 0.12s ====``."""
+
+    name = "pytest"
+
+    def feed(self, line: str) -> None:
+        if line.startswith(("FAILED ", "ERROR ")):
+            # short test summary: "FAILED tests/test_api.py::test_create - assert ..."
+            name, _, message = line.split(" ", 1)[1].partition(" - ")
+            self._fail(name, excerpt=[message] if message else None, capture=False)
+        if "passed" not in line and "failed" not in line and "error" not in line:
+            return
+        p = _pairs(_COUNT_WORD, line)
+        if "passed" not in p and "failed" not in p and "error" not in p and "errors" not in p:
+            return
+        passed = p.get("passed", 0)
+        failed = p.get("failed", 0)
+        self.counts.total = passed + failed
+        self.counts.failures = failed
+        self.counts.errors = p.get("errors", p.get("error", 0))
+        self.counts.matched = True
+
+
+class UnittestParser(OutputParser):
+    """unittest / Django: ``Ran 12 tests in 0.3s`` then ``FAILED (failures=2, errors=1)``."""
+
+    name = "unittest"
+
+    def feed(self, line: str) -> None:
+        if line.startswith("Ran "):
+            p = _pairs(_COUNT_WORD, line)
+            total = p.get("tests", p.get("test"))
+            if total is not None:
+                self.counts.total = total
+                self.counts.failures = 0
+                self.counts.errors = 0
+                self.counts.matched = True
+        elif line.startswith("FAILED ("):
+            p = _pairs(_WORD_EQ_COUNT, line)
+            self.counts.failures = p.get("failures", 0)
+            self.counts.errors = p.get("errors", 0)
+            self.counts.failed = True
+        elif line.startswith(("FAIL: ", "ERROR: ")):
+            self._fail(line.split(" ", 1)[1])
+
+
+class JestParser(OutputParser):
+    """jest: ``Tests:       2 failed, 5 passed, 7 total``."""
+
+    name = "jest"
+
+    def feed(self, line: str) -> None:
+        if not line.startswith("Tests:"):
+            stripped = line.lstrip()
+            if stripped.startswith("● ") and " › " in stripped:
+                self._fail(stripped[2:])
+            return
+        p = _pairs(_COUNT_WORD, line)
+        if "total" not in p:
+            return
+        self.counts.total = p["total"]
+        self.counts.failures = p.get("failed", 0)
+        self.counts.matched = True
+
+
+class VitestParser(OutputParser):
+    """vitest: ``Tests  2 failed | 5 passed (7)``."""
+
+    name = "vitest"
+
+    def feed(self, line: str) -> None:
+        stripped = line.lstrip()
+        if stripped.startswith("FAIL ") and " > " in stripped:
+            # " FAIL  src/cart.test.ts > Cart > applies discount"
+            self._fail(stripped[5:])
+            return
+        if not stripped.startswith("Tests ") or ("|" not in stripped and "(" not in stripped):
+            return
+        p = _pairs(_COUNT_WORD, stripped)
+        if "failed" not in p and "passed" not in p:
+            return
+        failed = p.get("failed", 0)
+        self.counts.failures = failed
+        self.counts.total = p.get("passed", 0) + failed + p.get("skipped", 0)
+        self.counts.matched = True
+
+
+class MochaParser(OutputParser):
+    """mocha: ``5 passing (12ms)`` / ``2 failing``."""
+
+    name = "mocha"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._passing = 0
+        self._in_failures = False
+        self._pending: str | None = None
+
+    def feed(self, line: str) -> None:
+        if self._in_failures:
+            stripped = line.strip()
+            if self._pending is not None and stripped:
+                # "  1) Cart" is followed by "       applies discount:"
+                if stripped.endswith(":"):
+                    self._fail(f"{self._pending} {stripped[:-1]}")
+                    self._pending = None
+                    return
+                self._fail(self._pending)
+                self._pending = None
+            m = _NUMBERED.match(line)
+            if m:
+                self._pending = m.group(1)
+                return
+        if "passing" in line:
+            p = _pairs(_COUNT_WORD, line)
+            if "passing" in p:
+                self._passing = p["passing"]
+                self.counts.failures = 0
+                self.counts.total = self._passing
+                self.counts.matched = True
+        elif "failing" in line:
+            p = _pairs(_COUNT_WORD, line)
+            if "failing" in p:
+                self.counts.failures = p["failing"]
+                self.counts.total = self._passing + p["failing"]
+                self.counts.matched = True
+                self._in_failures = True
+
+    def result(self) -> TestCounts:
+        if self._pending is not None:
+            self._fail(self._pending)
+            self._pending = None
+        return super().result()
+
+
+class GoParser(OutputParser):
+    """go test: counts top-level ``--- PASS:`` / ``--- FAIL:`` lines and package results."""
+
+    name = "go"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._passed = 0
+        # With -v, go prints a test's log lines *before* its "--- FAIL" line;
+        # without it, they follow the "--- FAIL" line, indented
+        self._recent: deque[str] = deque(maxlen=EXCERPT_LINES)
+        self._following: list[str] | None = None     # excerpt of the last failure, still open
+
+    def feed(self, line: str) -> None:
+        if "--- FAIL:" in line:
+            # "--- FAIL: TestDivide (0.00s)"; subtests are indented
+            name = line.split("--- FAIL:", 1)[1].rsplit(" (", 1)[0].strip()
+            self._fail(name, excerpt=list(self._recent), capture=False)
+            self._recent.clear()
+            self._following = self._excerpts.setdefault(name, []) if name in self._failed_names else None
+        elif line.startswith(("=== ", "FAIL", "ok ", "PASS")) or line.lstrip().startswith("---"):
+            self._recent.clear()
+            self._following = None
+        elif line.startswith(("    ", "\t")) and line.strip():
+            if self._following is not None:
+                if len(self._following) < EXCERPT_LINES:
+                    self._following.append(line.strip()[:EXCERPT_LINE_CHARS])
+            else:
+                self._recent.append(line)
+        if line.startswith("--- FAIL:"):
+            self.counts.failures += 1
+            self.counts.failed = True
+        elif line.startswith("--- PASS:"):
+            self._passed += 1
+        elif line.startswith("FAIL"):
+            self.counts.failed = True
+            if "[build failed]" in line or "[setup failed]" in line:
+                self.counts.errors += 1
+        elif line.startswith("panic:"):
+            self.counts.errors += 1
+            self.counts.failed = True
+        elif not line.startswith("ok "):
+            return
+        self.counts.total = self._passed + self.counts.failures
+        self.counts.matched = True
+
+
+class CargoParser(OutputParser):
+    """cargo test: sums every ``test result: ... 3 passed; 1 failed; ...`` line."""
+
+    name = "cargo"
+
+    def feed(self, line: str) -> None:
+        if line.startswith("test result:"):
+            p = _pairs(_COUNT_WORD, line)
+            failed = p.get("failed", 0)
+            self.counts.total += p.get("passed", 0) + failed
+            self.counts.failures += failed
+            self.counts.matched = True
+            if failed:
+                self.counts.failed = True
+        elif line.startswith("test ") and line.endswith(" ... FAILED"):
+            self._fail(line[5:-len(" ... FAILED")], capture=False)
+        elif line.startswith("---- ") and line.endswith(" stdout ----"):
+            # "---- tests::divides stdout ----" opens the panic message block
+            self._capture(line[5:-len(" stdout ----")])
+        elif line.startswith("error: could not compile") or line.startswith("error[E"):
+            self.counts.errors += 1
+            self.counts.failed = True
+
+
+class RspecParser(OutputParser):
+    """rspec: ``10 examples, 2 failures, 1 pending``."""
+
+    name = "rspec"
+
+    def feed(self, line: str) -> None:
+        if line.startswith("rspec ./"):
+            # "rspec ./spec/models/order_spec.rb:12 # Order#total sums line items"
+            self._fail(line[6:].split(" # ", 1)[-1], capture=False)
+            return
+        m = _NUMBERED.match(line)
+        if m:
+            # "  1) Order#total sums line items" heads the failure details
+            self._capture(m.group(1))
+            return
+        if "example" not in line and "occurred outside" not in line:
+            return
+        p = _pairs(_COUNT_WORD, line)
+        if "occurred outside" in line:
+            self.counts.errors = p.get("errors", p.get("error", 0))
+            self.counts.failed = True
+            return
+        total = p.get("examples", p.get("example"))
+        if total is None:
+            return
+        self.counts.total = total
+        self.counts.failures = p.get("failures", p.get("failure", 0))
+        self.counts.matched = True
+
+
+class PhpunitParser(OutputParser):
+    """phpunit: ``OK (5 tests, 10 assertions)`` or ``Tests: 5, Assertions: 8, Failures: 2.``"""
+
+    name = "phpunit"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._in_failures = False
+
+    def feed(self, line: str) -> None:
+        if line.startswith(("There was", "There were", "FAILURES!")):
+            self._capturing = None
+            self._in_failures = "error" in line or "failure" in line
+            return
+        if self._in_failures:
+            m = _NUMBERED.match(line)
+            if m:
+                self._fail(m.group(1))
+                return
+        if line.startswith("OK ("):
+            p = _pairs(_COUNT_WORD, line)
+            self.counts.total = p.get("tests", p.get("test", 0))
+            self.counts.failures = 0
+            self.counts.errors = 0
+            self.counts.matched = True
+        elif line.startswith("Tests:"):
+            p = _pairs(_WORD_COLON_COUNT, line)
+            self.counts.total = p.get("tests", 0)
+            self.counts.failures = p.get("failures", 0)
+            self.counts.errors = p.get("errors", 0)
+            self.counts.matched = True
+            if self.counts.failures or self.counts.errors:
+                self.counts.failed = True
+
+
+class MixParser(OutputParser):
+    """ExUnit: ``1 doctest, 10 tests, 2 failures`` (plus optional properties/excluded)."""
+
+    name = "mix"
+
+    def feed(self, line: str) -> None:
+        m = _NUMBERED.match(line)
+        if m and m.group(1).startswith(("test ", "doctest ", "property ")):
+            # "  1) test sums line items (CartTest)"
+            self._fail(m.group(1))
+            return
+        if "failure" not in line:
+            if line.lstrip().startswith("** ("):
+                self.counts.errors += 1
+                self.counts.failed = True
+            return
+        p = _pairs(_COUNT_WORD, line)
+        tests = (
+            p.get("tests", p.get("test", 0))
+            + p.get("doctests", p.get("doctest", 0))
+            + p.get("properties", p.get("property", 0))
+        )
+        if not tests and "failures" not in p and "failure" not in p:
+            return
+        self.counts.total = tests
+        self.counts.failures = p.get("failures", p.get("failure", 0))
+        self.counts.matched = True
+
+
+class DotnetParser(OutputParser):
+    """dotnet test: sums ``Failed!  - Failed: 2, Passed: 10, Skipped: 0, Total: 12`` per project."""
+
+    name = "dotnet"
+
+    def feed(self, line: str) -> None:
+        if "Total:" in line:
+            p = _pairs(_WORD_COLON_COUNT, line)
+            if "total" in p:
+                self.counts.total += p["total"]
+                self.counts.failures += p.get("failed", 0)
+                self.counts.matched = True
+                if p.get("failed"):
+                    self.counts.failed = True
+        elif line.startswith("Total tests:"):
+            # Legacy vstest format: totals on separate indented lines
+            p = _pairs(_WORD_COLON_COUNT, line)
+            self.counts.total += p.get("tests", 0)
+            self.counts.matched = True
+        elif line.startswith("     Failed:"):
+            p = _pairs(_WORD_COLON_COUNT, line)
+            self.counts.failures += p.get("failed", 0)
+        elif line.startswith("  Failed ") and not line.startswith("  Failed!"):
+            # "  Failed Calc.Tests.CartTests.AppliesDiscount [12 ms]"
+            self._fail(line[9:].split(" [", 1)[0])
+        elif "Build FAILED" in line or ": error CS" in line:
+            self.counts.failed = True
+            if ": error " in line:
+                self.counts.errors += 1
+
+
+class MavenParser(OutputParser):
+    """Maven surefire: sums aggregate ``Tests run: 10, Failures: 2, Errors: 1`` lines."""
+
+    name = "maven"
+
+    def feed(self, line: str) -> None:
+        if line.startswith("[INFO]"):
+            self._capturing = None
+        if "Tests run:" in line:
+            # Per-class lines carry "Time elapsed"; module aggregates do not.
+            if "Time elapsed" in line:
+                return
+            p = _pairs(_WORD_COLON_COUNT, line)
+            self.counts.total += p.get("run", 0)
+            self.counts.failures += p.get("failures", 0)
+            self.counts.errors += p.get("errors", 0)
+            self.counts.matched = True
+        elif "<<< FAILURE!" in line or "<<< ERROR!" in line:
+            # "[ERROR] com.example.CartTest.appliesDiscount -- Time elapsed: 0.005 s <<< FAILURE!"
+            name = line.split("] ", 1)[-1].split("Time elapsed", 1)[0]
+            self._fail(name.strip().rstrip("-").strip())
+        elif "BUILD FAILURE" in line:
+            self.counts.failed = True
+
+
+class GradleParser(OutputParser):
+    """Gradle: ``10 tests completed, 2 failed, 1 skipped``."""
+
+    name = "gradle"
+
+    def feed(self, line: str) -> None:
+        if "tests completed" in line:
+            p = _pairs(_COUNT_WORD, line)
+            self.counts.total = p.get("tests", 0)
+            self.counts.failures = p.get("failed", 0)
+            self.counts.matched = True
+        elif line.endswith(" FAILED") and " > " in line and not line.startswith(">"):
+            # "CartTest > appliesDiscount() FAILED"
+            self._fail(line[:-len(" FAILED")])
+        elif line.startswith("BUILD FAILED"):
+            self.counts.failed = True
+
+
+class SwiftParser(OutputParser):
+    """XCTest ``Executed 10 tests, with 2 failures`` and swift-testing ``Test run with 5 tests``."""
+
+    name = "swift"
+
+    def feed(self, line: str) -> None:
+        if line.startswith("Test Case '") and line.endswith(("failed", "seconds).")) and "' failed" in line:
+            # "Test Case '-[CalcTests.CalcTests testDivide]' failed (0.002 seconds)."
+            self._fail(line[len("Test Case '"):line.index("' failed")], capture=False)
+            return
+        if ": error: -[" in line:
+            # "/path/Tests.swift:14: error: -[Suite testX] : XCTAssertEqual failed: ..."
+            name, _, message = line.split(": error: ", 1)[1].partition(" : ")
+            self._excerpts.setdefault(name.strip(), []).append(message.strip()[:EXCERPT_LINE_CHARS])
+            return
+        if "Executed" in line:
+            p = _pairs(_COUNT_WORD, line)
+            if "tests" not in p and "test" not in p:
+                return
+            self.counts.total = p.get("tests", p.get("test", 0))
+            self.counts.failures = p.get("failures", p.get("failure", 0))
+            self.counts.matched = True
+        elif "Test run with" in line:
+            p = _pairs(_COUNT_WORD, line)
+            self.counts.total = p.get("tests", p.get("test", 0))
+            if "failed" in line:
+                self.counts.failures = max(self.counts.failures, p.get("issues", p.get("issue", 1)))
+                self.counts.failed = True
+            self.counts.matched = True
+
+
+class GenericParser(OutputParser):
+    """Fallback for unknown commands (``npm test`` etc.): run every parser, first match wins."""
+
+    name = "generic"
+
+    # Priority order when several summaries appear in the same output
+    _ORDER = (
+        MinitestParser, PytestParser, JestParser, VitestParser, RspecParser,
+        PhpunitParser, MixParser, CargoParser, DotnetParser, MavenParser,
+        GradleParser, SwiftParser, UnittestParser, MochaParser, GoParser,
+    )
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._parsers = [cls() for cls in self._ORDER]
+        self._marker = False
+
+    def feed(self, line: str) -> None:
+        for parser in self._parsers:
+            parser.feed_line(line)
+        if not self._marker and _GENERIC_FAILURE.search(line):
+            self._marker = True
+
+    def result(self) -> TestCounts:
+        results = [parser.result() for parser in self._parsers]
+        for counts in results:
+            if counts.matched:
+                self.counts = counts
+                break
+        if not self.counts.failed_tests:
+            # Fall back to the first parser that recognised failing test names
+            fallback = next((c for c in results if c.failed_tests), None)
+            if fallback is not None:
+                self.counts.failed_tests = fallback.failed_tests
+                self.counts.excerpts = fallback.excerpts
+        self.counts.failed = self.counts.failed or self._marker
+        return self.counts
+
+
+# Registry: parser name → class. Runner detection below maps a command to a name.
+PARSERS: dict[str, type[OutputParser]] = {
+    cls.name: cls
+    for cls in (
+        MinitestParser, PytestParser, UnittestParser, JestParser, VitestParser,
+        MochaParser, GoParser, CargoParser, RspecParser, PhpunitParser,
+        MixParser, DotnetParser, MavenParser, GradleParser, SwiftParser,
+        GenericParser,
+    )
+}
+
+# Ordered (pattern, parser name) pairs matched against the test command.
+# Covers every command detect_test_command can return.
+_RUNNER_PATTERNS: list[tuple[re.Pattern, str]] = [
+    (re.compile(r"\brspec\b"), "rspec"),
+    (re.compile(r"\bbin/rails\s+test\b|\brake\s+test\b|\bruby\s+-I"), "minitest"),
+    (re.compile(r"\bpytest\b"), "pytest"),
+    (re.compile(r"\bmanage\.py\s+test\b|\bunittest\b"), "unittest"),
+    (re.compile(r"\bphpunit\b"), "phpunit"),
+    (re.compile(r"\bjest\b"), "jest"),
+    (re.compile(r"\bvitest\b"), "vitest"),
+    (re.compile(r"\bmocha\b"), "mocha"),
+    (re.compile(r"\bgo\s+test\b"), "go"),
+    (re.compile(r"\bcargo\s+test\b"), "cargo"),
+    (re.compile(r"\bmix\s+test\b"), "mix"),
+    (re.compile(r"\bdotnet\s+test\b"), "dotnet"),
+    (re.compile(r"\bmvn\b"), "maven"),
+    (re.compile(r"\bgradlew?\b"), "gradle"),
+    (re.compile(r"\bswift\s+test\b"), "swift"),
+]
+
+
+def runner_for_command(command: str | None) -> str:
+    """Return the registry key of the parser for a test command."""
+    if command:
+        for pattern, name in _RUNNER_PATTERNS:
+            if pattern.search(command):
+                return name
+    return "generic"
+
+
+def parser_for_command(command: str | None) -> OutputParser:
+    """Return a fresh parser instance for a test command."""
+    return PARSERS[runner_for_command(command)]()
+
+
+def parse_lines(command: str | None, lines: Iterable[str]) -> TestCounts:
+    """Feed output lines through the parser for ``command`` and return the totals."""
+    parser = parser_for_command(command)
+    for line in lines:
+        if "\x1b" in line:
+            line = _ANSI.sub("", line)
+        parser.feed_line(line)
+    return parser.result()
+
+
+def parse_output(command: str | None, output: str) -> TestCounts:
+    """Parse a complete output string for ``command``."""
+    return parse_lines(command, output.splitlines())
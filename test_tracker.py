@@ -3,6 +3,8 @@ import re
 from dataclasses import dataclass, field
 from enum import Enum
 
+from test_parsers import parse_output
+
 
 class TestOutcome(Enum):
     PASS = "pass"
@@ -23,6 +25,9 @@ class TestResult:
     failures: int = 0
     errors: int = 0
     timestamp: float = 0.0
+    failed_tests: list[str] = field(default_factory=list)
+    failure_excerpts: dict[str, str] = field(default_factory=dict)
+    timed_out: bool = False
 
 
 # Patterns that identify a command as a test invocation
@@ -50,34 +55,95 @@ _TEST_COMMAND_PATTERNS: list[str] = [
 ]
 
 
+# All patterns folded into one alternation so a check is a single regex scan
+_TEST_COMMAND_RE = re.compile("|".join(f"(?:{p})" for p in _TEST_COMMAND_PATTERNS))
+
+
 def is_test_command(command: str) -> bool:
     """Check if a shell command looks like a test invocation."""
-    return any(re.search(p, command) for p in _TEST_COMMAND_PATTERNS)
+    return bool(command) and _TEST_COMMAND_RE.search(command) is not None
 
 
 def parse_test_counts(result: TestResult, output: str) -> None:
-    """Extract test/failure/error counts from common test runner output."""
-    # Rails/minitest: "33 runs, 45 assertions, 2 failures, 0 errors, 0 skips"
-    m = re.search(r"(\d+)\s+runs?.*?(\d+)\s+failures?.*?(\d+)\s+errors?", output)
-    if m:
-        result.total_tests = int(m.group(1))
-        result.failures = int(m.group(2))
-        result.errors = int(m.group(3))
-        return
-    # pytest: "5 passed, 2 failed"
-    passed = re.search(r"(\d+)\s+passed", output)
-    failed = re.search(r"(\d+)\s+failed", output)
-    if passed or failed:
-        result.total_tests = int(passed.group(1)) if passed else 0
-        f = int(failed.group(1)) if failed else 0
-        result.failures = f
-        result.total_tests += f
-        return
-    # jest/mocha: "Tests: 2 failed, 5 passed, 7 total"
-    m = re.search(r"Tests:\s+(\d+)\s+failed.*?(\d+)\s+total", output)
-    if m:
-        result.failures = int(m.group(1))
-        result.total_tests = int(m.group(2))
+    """Extract test/failure/error counts using the parser for ``result.command``."""
+    counts = parse_output(result.command, output)
+    result.total_tests = counts.total
+    result.failures = counts.failures
+    result.errors = counts.errors
+    result.failed_tests = counts.failed_tests
+    result.failure_excerpts = counts.excerpts
+
+
+@dataclass
+class FailureDelta:
+    """Which tests changed state between two verification runs."""
+    newly_failing: list[str] = field(default_factory=list)
+    still_failing: list[str] = field(default_factory=list)
+    newly_fixed: list[str] = field(default_factory=list)
+
+
+def diff_results(previous: TestResult | None, current: TestResult) -> FailureDelta:
+    """Compare failing test names of two runs (previous may be None for the first run)."""
+    before = set(previous.failed_tests) if previous else set()
+    after = set(current.failed_tests)
+    return FailureDelta(
+        newly_failing=[n for n in current.failed_tests if n not in before],
+        still_failing=[n for n in current.failed_tests if n in before],
+        newly_fixed=[n for n in (previous.failed_tests if previous else []) if n not in after],
+    )
+
+
+def format_failure_delta(
+    previous: TestResult | None,
+    current: TestResult,
+    max_tests: int = 15,
+) -> str:
+    """Render a compact failure report for fix prompts.
+
+    Lists tests newly failing, still failing and newly fixed since ``previous``,
+    each failing test with its assertion excerpt. Falls back to a short output
+    tail when the runner's failing test names could not be parsed.
+    """
+    if current.outcome == TestOutcome.PASS:
+        return "All tests passing."
+    if not current.failed_tests:
+        lines = ["(Individual failing tests could not be identified from the runner output.)"]
+        if current.stdout:
+            lines.append(f"Test output (tail):\n```\n{current.stdout[-1500:]}\n```")
+        if current.stderr:
+            lines.append(f"Stderr (tail):\n```\n{current.stderr[-500:]}\n```")
+        return "\n".join(lines)
+
+    delta = diff_results(previous, current)
+    budget = max_tests
+    sections: list[str] = []
+
+    def _render(title: str, names: list[str], with_excerpts: bool) -> None:
+        nonlocal budget
+        if not names:
+            return
+        shown = names[:max(budget, 0)]
+        budget -= len(shown)
+        out = [f"{title} ({len(names)}):"]
+        for name in shown:
+            out.append(f"  - {name}")
+            excerpt = current.failure_excerpts.get(name) if with_excerpts else None
+            if excerpt:
+                out.extend(f"      {line}" for line in excerpt.splitlines())
+        if len(names) > len(shown):
+            out.append(f"  ... and {len(names) - len(shown)} more")
+        sections.append("\n".join(out))
+
+    first_run = previous is None or not previous.failed_tests
+    _render("Failing tests" if first_run else "Newly failing", delta.newly_failing, True)
+    _render("Still failing", delta.still_failing, True)
+    if delta.newly_fixed:
+        fixed = delta.newly_fixed
+        sections.append(
+            f"Newly fixed ({len(fixed)}): " + ", ".join(fixed[:max_tests])
+            + (f" ... and {len(fixed) - max_tests} more" if len(fixed) > max_tests else "")
+        )
+    return "\n\n".join(sections)
 
 
 @dataclass
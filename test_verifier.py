@@ -7,23 +7,40 @@ textual claims about test status are irrelevant compared to this.
 
 import asyncio
 import os
+import signal
 import time
 
+from project_profile import load_profile
 from test_tracker import TestOutcome, TestResult, TestTracker, parse_test_counts
+from tracing import span
+
+VERIFY_TIMEOUT_SECONDS = float(os.getenv("VERIFY_TIMEOUT_SECONDS", "120"))
 
 
 async def verify_tests(
     tracker: TestTracker,
     cwd: str,
-    timeout: int = 120,
+    timeout: float = VERIFY_TIMEOUT_SECONDS,
 ) -> TestResult:
     """Run tests via subprocess and return the actual result.
 
     This runs independently of the agent session and captures the real
     exit code and output.
     """
-    command = tracker.canonical_test_command
+    command = tracker.canonical_test_command or load_profile(cwd).test_command
+    with span("verify_tests", command=command) as verify_span:
+        result = await _run_tests(command, cwd, timeout)
+        if verify_span is not None:
+            verify_span.set(
+                outcome=result.outcome.value, exit_code=result.exit_code, total_tests=result.total_tests,
+                failures=result.failures, errors=result.errors, timed_out=result.timed_out,
+            )
+    if result.outcome != TestOutcome.ERROR:     # the suite ran (not a timeout or launch failure)
+        await tracker.record(result)
+    return result
 
+
+async def _run_tests(command: str, cwd: str, timeout: float) -> TestResult:
     proc = None
     try:
         proc = await asyncio.create_subprocess_shell(
@@ -31,6 +48,7 @@ async def verify_tests(
             cwd=cwd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,     # so a timeout can kill the runner's children too
         )
         stdout_bytes, stderr_bytes = await asyncio.wait_for(
             proc.communicate(), timeout=timeout
@@ -41,14 +59,22 @@ async def verify_tests(
 
     except asyncio.TimeoutError:
         if proc:
-            proc.kill()
+            try:
+                if hasattr(os, "killpg"):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
         return TestResult(
             command=command,
             exit_code=-1,
             stdout="",
-            stderr="Test verification timed out",
+            stderr=f"Test verification timed out after {timeout:.0f}s",
             outcome=TestOutcome.ERROR,
             timestamp=time.time(),
+            timed_out=True,
         )
     except Exception as e:
         return TestResult(
@@ -70,8 +96,6 @@ async def verify_tests(
         timestamp=time.time(),
     )
     parse_test_counts(result, stdout)
-
-    await tracker.record(result)
     return result
 
 
@@ -80,77 +104,7 @@ def detect_test_command(target: str) -> str | None:
 
     Returns None if the project type cannot be determined yet (e.g. empty directory).
     Callers should re-run detection after the PLAN stage creates project files.
+    Detection is served from the cached project profile and only rescans
+    when the project's manifests have changed.
     """
-    def exists(*parts: str) -> bool:
-        return os.path.exists(os.path.join(target, *parts))
-
-    # Ruby / Rails
-    if exists("bin", "rails"):
-        return "bin/rails test"
-    if exists("Gemfile") and exists("spec"):
-        return "bundle exec rspec"
-    if exists("Gemfile") and exists("test"):
-        return "bundle exec rake test"
-    # Plain Ruby without bundler
-    if exists("Rakefile") and (exists("test") or exists("spec")):
-        return "rake test"
-    if exists("test"):
-        test_dir = os.path.join(target, "test")
-        if os.path.isdir(test_dir) and any(f.endswith(".rb") for f in os.listdir(test_dir)):
-            return (
-                "ruby -Ilib:test "
-                "-e \"require 'minitest/autorun'; "
-                "Dir.glob('test/**/*_test.rb').each { |f| load File.expand_path(f) }\""
-            )
-
-    # Python
-    if exists("pytest.ini") or exists("setup.cfg") or exists("pyproject.toml"):
-        return "python -m pytest"
-    if exists("manage.py"):                      # Django
-        return "python manage.py test"
-    if exists("setup.py") or exists("tox.ini"):
-        return "python -m pytest"
-
-    # PHP
-    if exists("vendor", "bin", "phpunit"):
-        return "vendor/bin/phpunit"
-    if exists("phpunit.xml") or exists("phpunit.xml.dist"):
-        return "vendor/bin/phpunit"
-    if exists("composer.json"):
-        return "vendor/bin/phpunit"
-
-    # JavaScript / TypeScript
-    if exists("package.json"):
-        if exists("node_modules", ".bin", "jest"):
-            return "npx jest"
-        if exists("node_modules", ".bin", "vitest"):
-            return "npx vitest run"
-        return "npm test"
-
-    # Go
-    if exists("go.mod"):
-        return "go test ./..."
-
-    # Rust
-    if exists("Cargo.toml"):
-        return "cargo test"
-
-    # Java
-    if exists("pom.xml"):
-        return "mvn test"
-    if exists("build.gradle") or exists("build.gradle.kts"):
-        return "./gradlew test"
-
-    # .NET
-    if exists("*.sln") or exists("*.csproj"):
-        return "dotnet test"
-
-    # Elixir
-    if exists("mix.exs"):
-        return "mix test"
-
-    # Swift
-    if exists("Package.swift"):
-        return "swift test"
-
-    return None
+    return load_profile(target).test_command
@@ -0,0 +1,376 @@
+"""Span tracing for pipeline runs.
+
+A run is one trace. Spans nest as run → stage → LLM turn / tool call, with
+hook invocations and test verifications alongside; each records its wall
+time and attributes. The current span is carried in a context variable, so
+callers open spans with ``with span(...)`` and children find their parent.
+Tool calls are opened at their ToolUseBlock and closed at the matching
+ToolResultBlock (``start_span`` / ``end_span``).
+
+Tracing is off unless TRACE_EXPORT names an exporter. Finished spans are
+buffered in memory and written per trace to ``TRACE_DIR`` when the run ends,
+off the event loop; the oldest traces are deleted past TRACE_DIR_MAX_BYTES.
+
+- ``jsonl``: ``<trace_id>.jsonl``, one span per line
+- ``otlp``: ``<trace_id>.otlp.json``, the whole trace in OTLP/JSON
+
+    python tracing.py [trace file]    # critical path of a trace (default: latest)
+"""
+
+import asyncio
+import contextvars
+import functools
+import glob
+import json
+import os
+import secrets
+import sys
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterator
+
+TRACE_EXPORT = [
+    e.strip() for e in os.getenv("TRACE_EXPORT", "").split(",")
+    if e.strip() and e.strip() not in ("0", "false", "no")
+]
+TRACE_DIR = os.getenv(
+    "TRACE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tdd-pipeline", "traces")
+)
+TRACE_DIR_MAX_BYTES = int(os.getenv("TRACE_DIR_MAX_BYTES", str(100 * 1024 * 1024)))
+SERVICE_NAME = "tdd-pipeline"
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("trace_span", default=None)
+
+
+@dataclass
+class Span:
+    trace: "Trace"
+    name: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Spans of one run, buffered until ``export``."""
+
+    def __init__(
+        self,
+        exporters: list[str] = TRACE_EXPORT,
+        directory: str = TRACE_DIR,
+        max_bytes: int = TRACE_DIR_MAX_BYTES,
+    ) -> None:
+        self.trace_id = secrets.token_hex(16)
+        self.exporters = exporters
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.finished: list[Span] = []
+        self.stage: Span | None = None      # innermost open stage, parent of hook spans
+
+    def record(self, span: Span) -> None:
+        self.finished.append(span)
+
+    def export(self) -> None:
+        """Write the trace and trim TRACE_DIR (blocking: call it off the event loop)."""
+        files: dict[str, str] = {}      # suffix → contents
+        if "jsonl" in self.exporters:
+            files[".jsonl"] = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in self.finished)
+        if "otlp" in self.exporters:
+            files[".otlp.json"] = json.dumps(_otlp(self.finished))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for suffix, text in files.items():
+                with open(os.path.join(self.directory, self.trace_id + suffix), "w") as f:
+                    f.write(text)
+        except OSError as exc:
+            print(f"  Trace export failed: {exc}")
+        self._evict()
+
+    def _evict(self) -> None:
+        """Delete the oldest traces until TRACE_DIR is under 90% of its limit."""
+        entries: list[tuple[float, int, str]] = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+
+def start_span(name: str, parent: Span | None = None, **attributes: Any) -> Span | None:
+    """Open a span under ``parent`` (default: the current span); None outside a trace."""
+    parent = parent or _current.get()
+    if parent is None:
+        return None
+    span = Span(parent.trace, name, secrets.token_hex(8), parent.span_id, time.time_ns())
+    span.set(**attributes)
+    return span
+
+
+def end_span(span: Span | None, error: str | None = None, **attributes: Any) -> None:
+    if span is None or span.end_ns is not None:
+        return
+    span.set(**attributes)
+    span.error = error
+    span.end_ns = time.time_ns()
+    span.trace.record(span)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """Child of the current span for the duration of the block (a no-op outside a trace)."""
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    token = _current.set(current)
+    stage = current.trace.stage
+    if name == "stage":
+        current.trace.stage = current
+    try:
+        yield current
+    except BaseException as exc:
+        end_span(current, error=type(exc).__name__)
+        raise
+    finally:
+        current.trace.stage = stage
+        _current.reset(token)
+        end_span(current)
+
+
+@asynccontextmanager
+async def trace_run(name: str = "run", **attributes: Any) -> AsyncIterator[Span | None]:
+    """Root span of a new trace; nothing is recorded when no exporter is configured."""
+    if not TRACE_EXPORT:
+        yield None
+        return
+    trace = Trace()
+    root = Span(trace, name, secrets.token_hex(8), None, time.time_ns())
+    root.set(**attributes)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as exc:
+        end_span(root, error=type(exc).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        end_span(root)
+        await asyncio.to_thread(trace.export)
+
+
+def traced_hook(hook):
+    """Wrap an SDK hook callback so each invocation is a span.
+
+    Hooks run on the SDK's reader task, whose context predates the stage, so
+    the span is parented to the trace's open stage rather than the context.
+    """
+    root = _current.get()
+    if root is None:
+        return hook
+
+    @functools.wraps(hook)
+    async def wrapper(input_data, tool_use_id, context):
+        hook_span = start_span(
+            "hook", parent=root.trace.stage or root, hook=hook.__name__,
+            event=input_data.get("hook_event_name"), tool=input_data.get("tool_name"),
+            tool_use_id=tool_use_id,
+        )
+        try:
+            output = await hook(input_data, tool_use_id, context)
+        except BaseException as exc:
+            end_span(hook_span, error=type(exc).__name__)
+            raise
+        decision = ((output or {}).get("hookSpecificOutput") or {}).get("permissionDecision")
+        end_span(hook_span, decision=decision)
+        return output
+
+    return wrapper
+
+
+# ── OTLP/JSON export ──
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp(spans: list[Span]) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": SERVICE_NAME},
+            "spans": [
+                {
+                    "traceId": s.trace.trace_id,
+                    "spanId": s.span_id,
+                    **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                    "name": s.name,
+                    "kind": 1,      # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                }
+                for s in spans
+            ],
+        }],
+    }]}
+
+
+# ── Critical-path summary ──
+
+
+def load_trace(path: str) -> list[dict]:
+    """Spans of a JSONL or OTLP/JSON trace file, in the JSONL record shape."""
+    with open(path) as f:
+        if not path.endswith(".otlp.json"):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    spans = []
+    for resource in data.get("resourceSpans", []):
+        for scope in resource.get("scopeSpans", []):
+            for s in scope.get("spans", []):
+                start, end = int(s["startTimeUnixNano"]), int(s["endTimeUnixNano"])
+                spans.append({
+                    "trace_id": s["traceId"],
+                    "span_id": s["spanId"],
+                    "parent_id": s.get("parentSpanId"),
+                    "name": s["name"],
+                    "start_ns": start,
+                    "end_ns": end,
+                    "duration_ms": (end - start) / 1e6,
+                    "attributes": {
+                        a["key"]: next(iter(a["value"].values())) for a in s.get("attributes", [])
+                    },
+                    "error": (s.get("status") or {}).get("message"),
+                })
+    return spans
+
+
+def critical_path(spans: list[dict], root: dict) -> list[tuple[int, dict]]:
+    """(depth, span) along the chain of children that determined each parent's end."""
+    children: dict[str, list[dict]] = {}
+    for s in spans:
+        if s.get("end_ns") is not None:
+            children.setdefault(s["parent_id"], []).append(s)
+
+    path: list[tuple[int, dict]] = []
+
+    def walk(span: dict, depth: int) -> None:
+        path.append((depth, span))
+        # From the parent's end backwards: the latest-ending child, then the one before it…
+        chain, cursor = [], span["end_ns"]
+        for child in sorted(children.get(span["span_id"], []), key=lambda c: c["end_ns"], reverse=True):
+            if child["end_ns"] <= cursor:
+                chain.append(child)
+                cursor = child["start_ns"]
+        for child in reversed(chain):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return path
+
+
+def _label(span: dict) -> str:
+    attrs = span["attributes"]
+    detail = attrs.get("stage") or attrs.get("tool") or attrs.get("hook") or attrs.get("command") or ""
+    if span["name"] == "hook" and attrs.get("tool"):
+        detail = f"{attrs['hook']} ({attrs['tool']})"
+    return f"{span['name']} {detail}".strip()
+
+
+def summarize(spans: list[dict]) -> str:
+    roots = [s for s in spans if s["parent_id"] is None]
+    if not roots:
+        return "No root span (the run has not finished)."
+    root = roots[0]
+    total = root["duration_ms"] or 1.0
+    lines = [f"Trace {root.get('trace_id', '')}: {_label(root)} {total / 1000:.1f}s", "", "Critical path:"]
+    for depth, s in critical_path(spans, root):
+        if depth == 0 or s["duration_ms"] < total * 0.001:
+            continue
+        error = f"  [{s['error']}]" if s.get("error") else ""
+        lines.append(
+            f"  {'  ' * (depth - 1)}{_label(s):<48} {s['duration_ms'] / 1000:8.2f}s "
+            f"{100 * s['duration_ms'] / total:5.1f}%{error}"
+        )
+
+    # Where the time went, by span kind (tools by name)
+    totals: dict[str, list[float]] = {}
+    for s in spans:
+        if s["name"] in ("run", "stage"):
+            continue
+        key = _label(s) if s["name"] in ("tool", "hook") else s["name"]
+        totals.setdefault(key, []).append(s["duration_ms"])
+    lines += ["", f"{'Span':<40} {'count':>6} {'total':>9} {'max':>8}"]
+    for key, durations in sorted(totals.items(), key=lambda kv: -sum(kv[1])):
+        lines.append(
+            f"{key:<40} {len(durations):>6} {sum(durations) / 1000:8.2f}s {max(durations) / 1000:7.2f}s"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        files = glob.glob(os.path.join(TRACE_DIR, "*.jsonl")) + glob.glob(os.path.join(TRACE_DIR, "*.otlp.json"))
+        if not files:
+            print(f"usage: python tracing.py <trace file>   (no traces in {TRACE_DIR})")
+            return 1
+        path = max(files, key=os.path.getmtime)
+    print(summarize(load_trace(path)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,21 +6,29 @@ import asyncio
 import json
 import os
 import time
+from contextlib import asynccontextmanager
 
 import uvicorn
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, JSONResponse
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 from sse_starlette.sse import EventSourceResponse
 
+from budget import RunBudget
+from client_pool import shared_pool
 from events import EventBus
-from optimizer import generate_questions, rewrite_ticket
+from loop_monitor import loop_monitor
+from metrics import metrics
+from operator_inbox import MESSAGE_MODES, OPERATOR_MESSAGE_MODE, OperatorInbox
+from optimizer import generate_questions, rewrite_ticket, stream_questions
 from run_pipeline import PipelineStopped, run_pipeline
-from summarize import summarize_pipeline
+from run_state import RunState
+from summarize import SUMMARY_FILE, build_summary, enrich_summary
+from test_tracker import TestTracker
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 HTML_PATH = os.path.join(STATIC_DIR, "index.html")
@@ -28,23 +36,60 @@ HTML_PATH = os.path.join(STATIC_DIR, "index.html")
 # Global state
 _status: dict = {"status": "idle", "stage": ""}
 _bus: EventBus | None = None
+_run_state: RunState = RunState()
 _homepage_cache: tuple[str, str] | None = None  # (mtime, html)
 _task: asyncio.Task | None = None
 _history: list[dict] = []
 _stop_event: asyncio.Event = asyncio.Event()
-_human_queue: asyncio.Queue = asyncio.Queue()
+_inbox: OperatorInbox = OperatorInbox()
 _ticket: str = ""
 _target: str = ""
-_optimize_task: asyncio.Task | None = None
-
-
-async def _run(ticket: str, target: str, resume: bool = False, thinking: bool = False) -> None:
-    global _status, _bus, _task, _history, _stop_event, _human_queue, _ticket, _target
+# Summary enrichments still running after their pipeline finished
+_background: set[asyncio.Task] = set()
+
+
+async def _stop_summary(
+    ticket: str,
+    target: str,
+    completed_stages: list[str],
+    interrupted_stage: str,
+    tracker: TestTracker,
+) -> None:
+    """Emit the deterministic stop summary now; add the agent narrative in the background."""
+    try:
+        summary = await build_summary(
+            ticket=ticket,
+            target=target,
+            completed_stages=completed_stages,
+            interrupted_stage=interrupted_stage,
+            tracker=tracker,
+            run_state=_run_state,
+        )
+    except Exception as sum_exc:
+        await _bus.emit({
+            "type": "error",
+            "data": {"message": f"Summarization failed: {sum_exc}"},
+        })
+        return
+    await _bus.emit({"type": "summary", "data": {"summary": summary}})
+    task = asyncio.create_task(enrich_summary(summary))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _run(
+    ticket: str,
+    target: str,
+    resume: bool = False,
+    thinking: bool = False,
+    budget: RunBudget | None = None,
+) -> None:
+    global _status, _bus, _run_state, _task, _history, _stop_event, _ticket, _target
     _history = []
-    _bus = EventBus()
+    _run_state = RunState()
+    _bus = EventBus(observers=[_run_state.apply, metrics.observe])
     _stop_event.clear()
-    while not _human_queue.empty():
-        _human_queue.get_nowait()
+    _inbox.clear()
     _status = {"status": "running", "stage": "INIT", "started_at": time.time() * 1000}
     _ticket = ticket
     _target = target
@@ -62,10 +107,8 @@ async def _run(ticket: str, target: str, resume: bool = False, thinking: bool =
         # Load prior summary if resuming
         prior_summary = None
         if resume:
-            summary_path = os.path.join(target, ".tdd_summary.json")
-            if os.path.exists(summary_path):
-                with open(summary_path) as f:
-                    summary_data = json.load(f)
+            summary_data = await asyncio.to_thread(_read_json, os.path.join(target, SUMMARY_FILE))
+            if summary_data is not None:
                 prior_summary = summary_data.get("summary", "")
 
         report = await run_pipeline(
@@ -75,7 +118,8 @@ async def _run(ticket: str, target: str, resume: bool = False, thinking: bool =
             stop_event=_stop_event,
             prior_summary=prior_summary,
             thinking=thinking,
-            human_queue=_human_queue,
+            inbox=_inbox,
+            budget=budget,
         )
         await _bus.emit({"type": "report", "data": {"text": report}})
         await _bus.emit({"type": "done", "data": {}})
@@ -83,56 +127,23 @@ async def _run(ticket: str, target: str, resume: bool = False, thinking: bool =
         await tracker  # wait for tracker to process done before returning
 
     except PipelineStopped as stopped:
-        # User requested stop — run summarization
+        # User requested stop — summarize from what the run already knows
         _status.update({"status": "stopping", "stage": "SUMMARIZE"})
-        await _bus.emit({"type": "stopped", "data": {"message": "Pipeline stopped by user"}})
-
-        try:
-            summary = await summarize_pipeline(
-                ticket=ticket,
-                target=target,
-                completed_stages=stopped.completed_stages,
-                interrupted_stage=stopped.current_stage,
-                tracker=stopped.tracker,
-                event_history=list(_history),
-                event_bus=_bus,
-            )
-            await _bus.emit({"type": "summary", "data": {"summary": summary}})
-        except Exception as sum_exc:
-            await _bus.emit({
-                "type": "error",
-                "data": {"message": f"Summarization failed: {sum_exc}"},
-            })
-
+        await _bus.emit({"type": "stopped", "data": {"message": stopped.reason}})
+        await _stop_summary(
+            ticket, target, stopped.completed_stages, stopped.current_stage, stopped.tracker
+        )
         await _bus.emit({"type": "done", "data": {}})
         _status.update({"status": "done", "stage": "STOPPED"})
 
     except asyncio.CancelledError:
-        # Task was cancelled (from stop endpoint) — run summarization
+        # Task was cancelled outside a stage (from stop endpoint) — summarize what we can
+        interrupted_stage = _status.get("stage", "UNKNOWN")
         _status.update({"status": "stopping", "stage": "SUMMARIZE"})
         if _bus:
             await _bus.emit({"type": "stopped", "data": {"message": "Pipeline stopped by user"}})
-
-            try:
-                # We don't have PipelineStopped info here, so use what we can
-                from test_tracker import TestTracker
-                fallback_tracker = TestTracker()
-                summary = await summarize_pipeline(
-                    ticket=ticket,
-                    target=target,
-                    completed_stages=[],
-                    interrupted_stage=_status.get("stage", "UNKNOWN"),
-                    tracker=fallback_tracker,
-                    event_history=list(_history),
-                    event_bus=_bus,
-                )
-                await _bus.emit({"type": "summary", "data": {"summary": summary}})
-            except Exception as sum_exc:
-                await _bus.emit({
-                    "type": "error",
-                    "data": {"message": f"Summarization failed: {sum_exc}"},
-                })
-
+            # We don't have PipelineStopped info here, so use what we can
+            await _stop_summary(ticket, target, [], interrupted_stage, TestTracker())
             await _bus.emit({"type": "done", "data": {}})
         _status.update({"status": "done", "stage": "STOPPED"})
 
@@ -171,9 +182,13 @@ async def api_run(request: Request) -> JSONResponse:
     thinking = body.get("thinking", False)
     if not ticket:
         return JSONResponse({"error": "ticket is required"}, status_code=400)
+    try:
+        budget = RunBudget.from_request(body.get("budget"))
+    except (TypeError, ValueError, AttributeError) as exc:
+        return JSONResponse({"error": f"invalid budget: {exc}"}, status_code=400)
 
     os.makedirs(target, exist_ok=True)
-    _task = asyncio.create_task(_run(ticket, target, resume=resume, thinking=thinking))
+    _task = asyncio.create_task(_run(ticket, target, resume=resume, thinking=thinking, budget=budget))
     return JSONResponse({"ok": True})
 
 
@@ -195,12 +210,9 @@ async def api_summary(request: Request) -> JSONResponse:
     if not target:
         return JSONResponse({"error": "target is required"}, status_code=400)
 
-    summary_path = os.path.join(target, ".tdd_summary.json")
-    if not os.path.exists(summary_path):
+    summary = await asyncio.to_thread(_read_json, os.path.join(target, SUMMARY_FILE))
+    if summary is None:
         return JSONResponse({"error": "No summary found"}, status_code=404)
-
-    with open(summary_path) as f:
-        summary = json.load(f)
     return JSONResponse(summary)
 
 
@@ -232,21 +244,38 @@ async def api_events(request: Request) -> EventSourceResponse:
 
 
 async def api_status(request: Request) -> JSONResponse:
-    return JSONResponse(_status)
+    return JSONResponse({**_status, "run": _run_state.snapshot()})
+
+
+async def api_metrics(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint."""
+    runs_active = int(_task is not None and not _task.done())
+    return PlainTextResponse(
+        metrics.render(runs_active, _bus, loop_monitor), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+async def api_debug_loop(request: Request) -> JSONResponse:
+    """Event-loop lag and, with LOOP_DIAGNOSTICS=1, the call sites that blocked it."""
+    return JSONResponse(loop_monitor.snapshot())
+
+
+def _read_json(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
 
 
 async def api_config(request: Request) -> JSONResponse:
     cwd = os.getcwd()
     home = os.path.expanduser("~")
-    summary = None
-    summary_path = os.path.join(cwd, ".tdd_summary.json")
-    if os.path.exists(summary_path):
-        with open(summary_path) as f:
-            summary = json.load(f)
+    summary = await asyncio.to_thread(_read_json, os.path.join(cwd, SUMMARY_FILE))
     return JSONResponse({
         "default_target": cwd,
         "home": home,
         "summary": summary,
+        "operator_message_mode": OPERATOR_MESSAGE_MODE,
         "common_dirs": [
             {"name": "Current", "path": cwd},
             {"name": "Parent", "path": os.path.dirname(cwd)},
@@ -257,10 +286,6 @@ async def api_config(request: Request) -> JSONResponse:
 
 async def api_optimize(request: Request) -> JSONResponse:
     """Generate clarifying questions for a vague ticket."""
-    global _optimize_task
-    if _optimize_task is not None and not _optimize_task.done():
-        return JSONResponse({"error": "Optimization already in progress"}, status_code=409)
-
     body = await request.json()
     ticket = body.get("ticket", "").strip()
     target = body.get("target", os.getcwd()).strip()
@@ -270,23 +295,32 @@ async def api_optimize(request: Request) -> JSONResponse:
     scan_codebase = os.path.isdir(target)
 
     try:
-        _optimize_task = asyncio.ensure_future(
-            generate_questions(ticket, target, scan_codebase=scan_codebase)
-        )
-        result = await _optimize_task
+        result = await generate_questions(ticket, target, scan_codebase=scan_codebase)
         return JSONResponse(result)
     except Exception as exc:
         return JSONResponse({"error": str(exc)}, status_code=500)
-    finally:
-        _optimize_task = None
+
+
+async def api_optimize_stream(request: Request):
+    """Stream clarifying questions over SSE as the optimizer produces them."""
+    body = await request.json()
+    ticket = body.get("ticket", "").strip()
+    target = body.get("target", os.getcwd()).strip()
+    if not ticket:
+        return JSONResponse({"error": "ticket is required"}, status_code=400)
+
+    async def generator():
+        try:
+            async for event, data in stream_questions(ticket, target, scan_codebase=os.path.isdir(target)):
+                yield {"event": event, "data": json.dumps(data)}
+        except Exception as exc:
+            yield {"event": "error", "data": json.dumps({"error": str(exc)})}
+
+    return EventSourceResponse(generator())
 
 
 async def api_optimize_submit(request: Request) -> JSONResponse:
     """Rewrite the ticket using user answers to clarifying questions."""
-    global _optimize_task
-    if _optimize_task is not None and not _optimize_task.done():
-        return JSONResponse({"error": "Optimization already in progress"}, status_code=409)
-
     body = await request.json()
     ticket = body.get("ticket", "").strip()
     target = body.get("target", os.getcwd()).strip()
@@ -298,29 +332,38 @@ async def api_optimize_submit(request: Request) -> JSONResponse:
         return JSONResponse({"error": "answers are required"}, status_code=400)
 
     try:
-        _optimize_task = asyncio.ensure_future(
-            rewrite_ticket(ticket, target, context, answers)
-        )
-        rewritten = await _optimize_task
+        rewritten = await rewrite_ticket(ticket, target, context, answers)
         return JSONResponse({"optimized_ticket": rewritten})
     except Exception as exc:
         return JSONResponse({"error": str(exc)}, status_code=500)
-    finally:
-        _optimize_task = None
 
 
 async def api_message(request: Request) -> JSONResponse:
-    """Queue a human operator message to be injected into the running agent."""
+    """Deliver a human operator message to the running agent.
+
+    ``mode`` "interrupt" cuts the agent's current turn short; "queue" waits
+    for its next tool call.
+    """
     body = await request.json()
     message = body.get("message", "").strip()
+    mode = body.get("mode") or OPERATOR_MESSAGE_MODE
     if not message:
         return JSONResponse({"error": "message is required"}, status_code=400)
+    if mode not in MESSAGE_MODES:
+        return JSONResponse({"error": f"mode must be one of {', '.join(MESSAGE_MODES)}"}, status_code=400)
     if _task is None or _task.done():
         return JSONResponse({"error": "No pipeline running"}, status_code=400)
-    await _human_queue.put(message)
-    # Show the message in the UI immediately — don't wait for the hook to fire
+    # Show the message in the UI immediately — don't wait for it to be delivered
     if _bus:
-        await _bus.emit({"type": "human_input", "data": {"message": message, "stage": _status.get("stage", "")}})
+        await _bus.emit({
+            "type": "human_input",
+            "data": {"message": message, "mode": mode, "stage": _status.get("stage", "")},
+        })
+    try:
+        await _inbox.submit(message, mode)
+    except Exception as exc:
+        # The turn ended while interrupting; the message still goes with the next query
+        print(f"  Operator interrupt failed: {exc}")
     return JSONResponse({"ok": True})
 
 
@@ -337,6 +380,14 @@ async def api_mkdir(request: Request) -> JSONResponse:
         return JSONResponse({"error": str(exc)}, status_code=500)
 
 
+def _list_subdirs(path: str) -> list[dict]:
+    return [
+        {"name": entry.name, "path": entry.path, "is_dir": True}
+        for entry in os.scandir(path)
+        if entry.is_dir()
+    ]
+
+
 async def api_list_dirs(request: Request) -> JSONResponse:
     """List directories at a given path (for directory browser)."""
     body = await request.json()
@@ -354,10 +405,8 @@ async def api_list_dirs(request: Request) -> JSONResponse:
         if parent != path:
             entries.append({"name": "..", "path": parent, "is_dir": True})
 
-        # List directories
-        for entry in os.scandir(path):
-            if entry.is_dir():
-                entries.append({"name": entry.name, "path": entry.path, "is_dir": True})
+        # List directories (off the event loop: large or network directories are slow)
+        entries.extend(await asyncio.to_thread(_list_subdirs, path))
 
         return JSONResponse({"path": path, "entries": entries})
     except PermissionError:
@@ -372,8 +421,20 @@ class NoCacheJSMiddleware(BaseHTTPMiddleware):
         return response
 
 
+@asynccontextmanager
+async def lifespan(app):
+    loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+    for task in list(_background):
+        task.cancel()
+    # Disconnect warm agent sessions so their CLI subprocesses don't outlive the server
+    await shared_pool.close()
+
+
 app = Starlette(
     middleware=[Middleware(NoCacheJSMiddleware)],
+    lifespan=lifespan,
     routes=[
         Route("/", homepage),
         Route("/api/run", api_run, methods=["POST"]),
@@ -381,8 +442,11 @@ app = Starlette(
         Route("/api/summary", api_summary, methods=["POST"]),
         Route("/api/events", api_events),
         Route("/api/status", api_status),
+        Route("/metrics", api_metrics),
+        Route("/api/debug/loop", api_debug_loop),
         Route("/api/config", api_config),
         Route("/api/optimize", api_optimize, methods=["POST"]),
+        Route("/api/optimize/stream", api_optimize_stream, methods=["POST"]),
         Route("/api/optimize/submit", api_optimize_submit, methods=["POST"]),
         Route("/api/message", api_message, methods=["POST"]),
         Route("/api/mkdir", api_mkdir, methods=["POST"]),